@@ -0,0 +1,55 @@
+from typing import Callable, Dict
+import argparse
+import json
+import math
+import sys
+import instrument
+
+# Headless batches shared by the simulators: one JSON scenario per input line, one JSON result per output line
+
+# Replace NaN and infinite floats with None, so that results are written as strict JSON (null)
+def json_safe(obj: object) -> object:
+    if isinstance(obj, dict):
+        return {keys: json_safe(vals) for keys, vals in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [json_safe(vals) for vals in obj]
+    if isinstance(obj, float) and not math.isfinite(obj):
+        return None
+    return obj
+
+# Input, output and metrics arguments of every batch command line
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("input", nargs="?", default="-", help="JSON-lines scenario file (default: stdin)")
+    parser.add_argument("--out", default="-", help="JSON-lines output file (default: stdout)")
+    parser.add_argument("--metrics", default=None, help="write hunt, draw and timing counters here (.prom for Prometheus text, else JSON)")
+
+# Run every scenario of args.input through run_scenario and write the results to args.out
+# A scenario that fails for any reason is written as {"error": ...} and the batch goes on with the next one
+def run(args: argparse.Namespace, run_scenario: Callable[[Dict], Dict]) -> None:
+    if args.metrics is not None:
+        instrument.enable()
+
+    src = sys.stdin if args.input == "-" else open(args.input)
+    try:
+        out = sys.stdout if args.out == "-" else open(args.out, "w")
+    except OSError:
+        if src is not sys.stdin:
+            src.close()
+        raise
+    try:
+        for line in src:
+            if not line.strip():
+                continue
+            try:
+                result = run_scenario(json.loads(line))
+            except Exception as e:
+                result = {"error": f"{type(e).__name__}: {e}"}
+            out.write(json.dumps(json_safe(result), allow_nan=False) + "\n")
+            out.flush()
+    finally:
+        if args.metrics is not None:
+            instrument.write_report(args.metrics)
+        if src is not sys.stdin:
+            src.close()
+        if out is not sys.stdout:
+            out.close()
@@ -0,0 +1,281 @@
+from typing import Callable, Dict, List, Optional, Tuple
+import argparse
+import json
+import platform
+import sys
+import time
+import numpy as np
+import sim_toc
+import sim_bb
+
+# Representative setups
+TOC_SETUP = dict(initial_hunts=100, initial_words=0, trap_power=30000, trap_luck=40, word_multiplier=2.0)
+BB_SETUP = dict(trap_power=40000, trap_luck=50, use_ref=True)
+BB_INVENTORY = {"llavi": 300, "royal": 200, "lbean": 1000, "mbean": 0,
+                "rbean": 1000, "harps": 20000, "geggs": 0, "ferts": 50}
+BB_TARGET_EGGS = 50000
+BB_STOCKPILE = {"llavi": 10**6, "royal": 10**6, "lbean": 10**5, "mbean": 0,
+                "rbean": 10**5, "harps": 10**8, "geggs": 0, "ferts": 500}
+
+# Fixed seed for every benchmark
+SEED = 12345
+
+# Benchmarks return (runs, hunts) done, hunts may be None when not meaningful
+Benchmark = Callable[[float], Tuple[int, Optional[int]]]
+
+# sim_toc benchmarks
+def bench_toc_simulate_writing(scale: float) -> Tuple[int, Optional[int]]:
+    rng = np.random.default_rng(SEED)
+    n_runs = max(1, int(2000 * scale))
+    hunts = 0
+    for _ in range(n_runs):
+        hunts += sim_toc.simulate_writing(**TOC_SETUP, rng=rng)[0]
+    return n_runs, hunts
+
+def bench_toc_mc(scale: float) -> Tuple[int, Optional[int]]:
+    n_runs = max(1, int(2000 * scale))
+    _, _, _, hunts, _, _ = sim_toc.MC(n_runs, **TOC_SETUP, rng=SEED)
+    return n_runs, int(np.sum(hunts))
+
+def bench_toc_mc_vec(scale: float) -> Tuple[int, Optional[int]]:
+    n_runs = max(1, int(100000 * scale))
+    _, _, _, hunts, _, _ = sim_toc.MC_vec(n_runs, **TOC_SETUP, rng=SEED)
+    return n_runs, int(np.sum(hunts))
+
+def bench_toc_mc_vr(scale: float) -> Tuple[int, Optional[int]]:
+    n_runs = max(2, int(100000 * scale))
+    _, _, _, stats = sim_toc.MC_vr(n_runs, **TOC_SETUP, rng=SEED)
+    return n_runs, int(stats["hunts"].mean * stats["runs"])
+
+def bench_toc_solve_exact(scale: float) -> Tuple[int, Optional[int]]:
+    sim_toc.solve_exact(**TOC_SETUP)
+    return 1, None
+
+# sim_bb benchmarks
+def bench_bb_get_mouse(scale: float) -> Tuple[int, Optional[int]]:
+    mice = sim_bb.MiceData()
+    rng = np.random.default_rng(SEED)
+    n_calls = max(1, int(20000 * scale))
+    for _ in range(n_calls):
+        mice.get_mouse("Lavish", "Dungeon", rng)
+    return n_calls, None
+
+def bench_bb_catch_rate(scale: float) -> Tuple[int, Optional[int]]:
+    mice = sim_bb.MiceData()
+    n_calls = max(1, int(100000 * scale))
+    for _ in range(n_calls):
+        mice.catch_rate(BB_SETUP["trap_power"], BB_SETUP["trap_luck"], 25185, 1)
+    return n_calls, None
+
+def bench_bb_do_sim(scale: float) -> Tuple[int, Optional[int]]:
+    mice = sim_bb.MiceData()
+    uniforms = sim_bb.UniformBuffer(SEED)
+    n_runs = max(1, int(1000 * scale))
+    for _ in range(n_runs):
+        sim_bb.do_sim(mice, BB_SETUP["trap_power"], BB_SETUP["trap_luck"], 20, "SB", "Beanstalk", 4, uniforms=uniforms)
+    return n_runs, 20 * n_runs
+
+def bench_bb_do_sim_batch(scale: float) -> Tuple[int, Optional[int]]:
+    mice = sim_bb.MiceData()
+    n_runs = max(1, int(100000 * scale))
+    sim_bb.do_sim_batch(mice, BB_SETUP["trap_power"], BB_SETUP["trap_luck"], 20, "SB", "Beanstalk", 4, n_runs=n_runs, rng=SEED)
+    return n_runs, 20 * n_runs
+
+def bench_bb_simulate_beanstalk(scale: float) -> Tuple[int, Optional[int]]:
+    n_runs = max(1, int(1000 * scale))
+    result = sim_bb.simulate_beanstalk(**BB_SETUP, n_runs=n_runs, rng=SEED)
+    return n_runs, int(np.sum(result.hunts))
+
+def _bench_stage(simulator: Callable[..., Dict[str, int]], params: Dict, zone: str, n_runs: int, **kwargs) -> Tuple[int, Optional[int]]:
+    mice = sim_bb.MiceData()
+    uniforms = sim_bb.UniformBuffer(SEED)
+    hunts = 0
+    for _ in range(n_runs):
+        hunts += simulator(mice, BB_SETUP["trap_power"], BB_SETUP["trap_luck"], **params, **kwargs, zone=zone, uniforms=uniforms)["hunts"]
+    return n_runs, hunts
+
+def bench_bb_simulate_r1r_dungeon(scale: float) -> Tuple[int, Optional[int]]:
+    return _bench_stage(sim_bb.simulate_r1r, sim_bb.DUNGEON_R1R_PARAMS, "Dungeon", max(1, int(500 * scale)))
+
+def bench_bb_simulate_r1r_ballroom(scale: float) -> Tuple[int, Optional[int]]:
+    return _bench_stage(sim_bb.simulate_r1r, sim_bb.BALLROOM_R1R_PARAMS, "Ballroom", max(1, int(500 * scale)))
+
+def _bench_r1r_batch(params: Dict, zone: str, n_runs: int) -> Tuple[int, Optional[int]]:
+    batch = sim_bb.simulate_r1r_batch(sim_bb.MiceData(), BB_SETUP["trap_power"], BB_SETUP["trap_luck"], **params, zone=zone, n_runs=n_runs, rng=SEED)
+    return n_runs, int(np.sum(batch["hunts"]))
+
+def bench_bb_simulate_r1r_batch_dungeon(scale: float) -> Tuple[int, Optional[int]]:
+    return _bench_r1r_batch(sim_bb.DUNGEON_R1R_PARAMS, "Dungeon", max(1, int(100000 * scale)))
+
+def bench_bb_simulate_r1r_batch_ballroom(scale: float) -> Tuple[int, Optional[int]]:
+    return _bench_r1r_batch(sim_bb.BALLROOM_R1R_PARAMS, "Ballroom", max(1, int(100000 * scale)))
+
+def bench_bb_simulate_farm_harps(scale: float) -> Tuple[int, Optional[int]]:
+    return _bench_stage(sim_bb.simulate_farm, sim_bb.BALLROOM_FARM_PARAMS, "Ballroom", max(1, int(100 * scale)), target_loot="harps")
+
+def bench_bb_simulate_farm_magic(scale: float) -> Tuple[int, Optional[int]]:
+    return _bench_stage(sim_bb.simulate_farm, sim_bb.DUNGEON_FARM_PARAMS, "Dungeon", max(1, int(100 * scale)), target_loot="magic")
+
+def bench_bb_simulate_farm_batch_harps(scale: float) -> Tuple[int, Optional[int]]:
+    n_runs = max(1, int(10000 * scale))
+    result = sim_bb.simulate_ballroom(**BB_SETUP, target_loot="harps", n_runs=n_runs, rng=SEED)
+    return n_runs, int(np.sum(result.hunts))
+
+def bench_bb_simulate_farm_batch_magic(scale: float) -> Tuple[int, Optional[int]]:
+    n_runs = max(1, int(10000 * scale))
+    result = sim_bb.simulate_dungeon(**BB_SETUP, target_loot="magic", n_runs=n_runs, rng=SEED)
+    return n_runs, int(np.sum(result.hunts))
+
+def bench_bb_simulate_greathall(scale: float) -> Tuple[int, Optional[int]]:
+    n_runs = max(1, int(10000 * scale))
+    result = sim_bb.simulate_greathall(**BB_SETUP, n_runs=n_runs, rng=SEED)
+    return n_runs, int(np.sum(result.hunts))
+
+def bench_bb_expected_yields(scale: float) -> Tuple[int, Optional[int]]:
+    n_calls = max(1, int(100 * scale))
+    for _ in range(n_calls):
+        sim_bb.expected_yields(**BB_SETUP)
+    return n_calls, None
+
+def bench_bb_plan_chain(scale: float) -> Tuple[int, Optional[int]]:
+    sim_bb.plan_chain(**BB_SETUP, target_eggs=BB_TARGET_EGGS, inventory=BB_INVENTORY, verbose=False)
+    return 1, None
+
+def bench_bb_plan_chain_mc(scale: float) -> Tuple[int, Optional[int]]:
+    sim_bb.plan_chain(**BB_SETUP, target_eggs=BB_TARGET_EGGS, inventory=BB_INVENTORY, verbose=False, seed=SEED, n_runs=1000)
+    return 1, None
+
+def bench_bb_plan_chain_mc_vr(scale: float) -> Tuple[int, Optional[int]]:
+    sim_bb.plan_chain(**BB_SETUP, target_eggs=BB_TARGET_EGGS, inventory=BB_INVENTORY, verbose=False, seed=SEED, n_runs=1000,
+                      variance_reduction=True)
+    return 1, None
+
+def bench_bb_chain_tail_stockpile(scale: float) -> Tuple[int, Optional[int]]:
+    steps = sim_bb.iter_chain(**BB_SETUP, target_eggs=int(10**9 * scale), inventory=BB_STOCKPILE, verbose=False, expand_cycles=False)
+    n_stages, _ = sim_bb.chain_tail(steps)
+    return n_stages, None
+
+def bench_bb_evaluate_policies(scale: float) -> Tuple[int, Optional[int]]:
+    precomp = sim_bb.expected_yields(**BB_SETUP)
+    policies = sim_bb.policy_grid(range(5000, 40001, 2500), range(50, 501, 50), range(50, 501, 50))
+    n_policies = max(1, int(len(policies) * scale))
+    sim_bb.evaluate_policies(precomp, 20 * BB_TARGET_EGGS, BB_INVENTORY, policies[:n_policies])
+    return n_policies, None
+
+def bench_bb_simulate_chains(scale: float) -> Tuple[int, Optional[int]]:
+    n_chains = max(1, int(10000 * scale))
+    chains = sim_bb.simulate_chains(**BB_SETUP, target_eggs=BB_TARGET_EGGS, inventory=BB_INVENTORY, n_chains=n_chains, seed=SEED)
+    return n_chains, int(np.sum(chains["hunts"]))
+
+BENCHMARKS: Dict[str, Benchmark] = {
+    "toc.simulate_writing": bench_toc_simulate_writing,
+    "toc.MC": bench_toc_mc,
+    "toc.MC_vec": bench_toc_mc_vec,
+    "toc.MC_vr": bench_toc_mc_vr,
+    "toc.solve_exact": bench_toc_solve_exact,
+    "bb.MiceData.get_mouse": bench_bb_get_mouse,
+    "bb.MiceData.catch_rate": bench_bb_catch_rate,
+    "bb.do_sim": bench_bb_do_sim,
+    "bb.do_sim_batch": bench_bb_do_sim_batch,
+    "bb.simulate_beanstalk": bench_bb_simulate_beanstalk,
+    "bb.simulate_r1r (Dungeon)": bench_bb_simulate_r1r_dungeon,
+    "bb.simulate_r1r (Ballroom)": bench_bb_simulate_r1r_ballroom,
+    "bb.simulate_r1r_batch (Dungeon)": bench_bb_simulate_r1r_batch_dungeon,
+    "bb.simulate_r1r_batch (Ballroom)": bench_bb_simulate_r1r_batch_ballroom,
+    "bb.simulate_farm (Harps)": bench_bb_simulate_farm_harps,
+    "bb.simulate_farm (Magic)": bench_bb_simulate_farm_magic,
+    "bb.simulate_farm_batch (Harps)": bench_bb_simulate_farm_batch_harps,
+    "bb.simulate_farm_batch (Magic)": bench_bb_simulate_farm_batch_magic,
+    "bb.simulate_greathall": bench_bb_simulate_greathall,
+    "bb.expected_yields": bench_bb_expected_yields,
+    "bb.plan_chain": bench_bb_plan_chain,
+    "bb.plan_chain (MC)": bench_bb_plan_chain_mc,
+    "bb.plan_chain (MC, VR)": bench_bb_plan_chain_mc_vr,
+    "bb.chain_tail (stockpile)": bench_bb_chain_tail_stockpile,
+    "bb.simulate_chains": bench_bb_simulate_chains,
+    "bb.evaluate_policies": bench_bb_evaluate_policies,
+}
+
+# Time a benchmark, keeping the best of several repeats
+def run_benchmark(bench: Benchmark, scale: float, repeat: int) -> Dict[str, Optional[float]]:
+    best = float("inf")
+    runs, hunts = 0, None
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        runs, hunts = bench(scale)
+        best = min(best, time.perf_counter() - start)
+    best = max(best, 1e-9)
+    return {"seconds": best, "runs": runs, "runs_per_s": runs / best,
+            "hunts": hunts, "hunts_per_s": None if hunts is None else hunts / best}
+
+# Run the selected benchmarks
+def run_all(names: List[str], scale: float = 1.0, repeat: int = 3) -> Dict:
+    results = {}
+    for name in names:
+        # The full plan is slow enough that a single pass is representative
+        results[name] = run_benchmark(BENCHMARKS[name], scale, 1 if name.startswith("bb.plan_chain") else repeat)
+        print(_format_row(name, results[name]), file=sys.stderr)
+    return {"meta": {"python": platform.python_version(), "numpy": np.__version__,
+                     "machine": platform.machine(), "platform": platform.platform(),
+                     "scale": scale, "repeat": repeat, "seed": SEED,
+                     "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+            "results": results}
+
+def _format_row(name: str, res: Dict[str, Optional[float]]) -> str:
+    hunts_per_s = "-" if res["hunts_per_s"] is None else f"{res['hunts_per_s']:,.0f}"
+    return f"{name:32} | {res['seconds']:10.4f} s | {res['runs_per_s']:14,.2f} runs/s | {hunts_per_s:>14} hunts/s"
+
+# Compare against a saved baseline, returning the names that got slower than the threshold
+def compare(current: Dict, baseline: Dict, threshold: float = 0.10) -> List[str]:
+    regressions = []
+    print(f"\n{'Benchmark':32} | {'baseline':>10} | {'current':>10} | {'speedup':>8}")
+    print("-" * 72)
+    for name, res in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            print(f"{name:32} | {'-':>10} | {res['seconds']:10.4f} | {'new':>8}")
+            continue
+        # Compare throughput so that a changed scale does not skew the ratio
+        speedup = res["runs_per_s"] / base["runs_per_s"]
+        flag = ""
+        if speedup < 1 - threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:32} | {base['seconds']:10.4f} | {res['seconds']:10.4f} | {speedup:7.2f}x{flag}")
+    return regressions
+
+# Command line
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the hot paths of sim_toc and sim_bb")
+    parser.add_argument("--only", default=None, help="comma separated benchmark names or prefixes (e.g. toc.,bb.do_sim)")
+    parser.add_argument("--scale", type=float, default=1.0, help="scale the work done by each benchmark")
+    parser.add_argument("--repeat", type=int, default=3, help="repeats per benchmark, the best time is kept")
+    parser.add_argument("--save", default=None, help="save results as JSON (e.g. a new baseline)")
+    parser.add_argument("--compare", default=None, help="baseline JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative slowdown reported as a regression")
+    parser.add_argument("--list", action="store_true", help="list benchmark names and exit")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        print("\n".join(BENCHMARKS))
+        return 0
+
+    names = list(BENCHMARKS)
+    if args.only:
+        prefixes = args.only.split(",")
+        names = [name for name in names if any(name.startswith(p) for p in prefixes)]
+
+    current = run_all(names, args.scale, args.repeat)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(current, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(current, baseline, args.threshold):
+            return 1
+    return 0
+
+# Main
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
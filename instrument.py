@@ -0,0 +1,147 @@
+from typing import Dict, Iterator, Optional, Tuple, Union
+import contextlib
+import json
+import time
+import numpy as np
+
+# Opt-in counters and timers for the simulators
+# Every hook checks the module flag first, so a run with instrumentation off only pays that check once per call
+enabled = False
+
+# Counter values and timer totals keyed by (metric, label)
+_counts: Dict[Tuple[str, str], float] = {}
+_seconds: Dict[Tuple[str, str], float] = {}
+_calls: Dict[Tuple[str, str], int] = {}
+
+# Help text of every metric, for the Prometheus report
+METRICS = {
+    "hunts": "Hunts simulated",
+    "runs": "Runs simulated",
+    "rng_draws": "Values drawn from the random generator",
+    "rooms": "Rooms rolled",
+    "boss_attempts": "Hunts spent on boss fights"}
+
+# Turn instrumentation on or off, optionally clearing what was recorded so far
+def enable(reset_counts: bool = True) -> None:
+    global enabled
+    enabled = True
+    if reset_counts:
+        reset()
+
+def disable() -> None:
+    global enabled
+    enabled = False
+
+def reset() -> None:
+    _counts.clear()
+    _seconds.clear()
+    _calls.clear()
+
+# Add to a counter, label being the simulator or stage it belongs to
+def count(metric: str, value: Union[int, float, np.integer], label: str = "") -> None:
+    key = (metric, label)
+    _counts[key] = _counts.get(key, 0) + int(value)
+
+# Time the wrapped block and count its calls, only when instrumentation is on
+@contextlib.contextmanager
+def timed(metric: str, label: str = "") -> Iterator[None]:
+    if not enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        key = (metric, label)
+        _seconds[key] = _seconds.get(key, 0.0) + time.perf_counter() - start
+        _calls[key] = _calls.get(key, 0) + 1
+
+# Generator sharing the bit generator of another, counting every value drawn from it under its label
+# The stream is unchanged, so results are the same with instrumentation on or off
+class CountingGenerator(np.random.Generator):
+    label = ""
+
+    def _counted(self, values):
+        count("rng_draws", np.size(values), self.label)
+        return values
+
+    def random(self, size=None, dtype=np.float64, out=None):
+        return self._counted(super().random(size, dtype, out))
+
+    def integers(self, *args, **kwargs):
+        return self._counted(super().integers(*args, **kwargs))
+
+    def binomial(self, *args, **kwargs):
+        return self._counted(super().binomial(*args, **kwargs))
+
+    def geometric(self, *args, **kwargs):
+        return self._counted(super().geometric(*args, **kwargs))
+
+    def choice(self, *args, **kwargs):
+        return self._counted(super().choice(*args, **kwargs))
+
+# Random stream from a seed or an existing Generator, counting its draws when instrumentation is on
+# A stream that is already counted keeps its label, so draws go to the outermost simulator
+def rng(seed: Union[int, np.random.Generator, None] = None, label: str = "") -> np.random.Generator:
+    gen = np.random.default_rng(seed)
+    if not enabled or isinstance(gen, CountingGenerator):
+        return gen
+    gen = CountingGenerator(gen.bit_generator)
+    gen.label = label
+    return gen
+
+# Everything recorded so far, to send back from a worker process and merge into the parent
+def snapshot() -> Tuple[Dict, Dict, Dict]:
+    return dict(_counts), dict(_seconds), dict(_calls)
+
+def merge(snap: Tuple[Dict, Dict, Dict]) -> None:
+    for totals, values in zip((_counts, _seconds, _calls), snap):
+        for key, vals in values.items():
+            totals[key] = totals.get(key, 0) + vals
+
+# Run a function in a worker process with instrumentation on, returning its result and what it recorded
+def run_instrumented(fn, *args) -> Tuple[object, Tuple[Dict, Dict, Dict]]:
+    was_enabled = enabled
+    saved = snapshot()
+    enable()
+    try:
+        return fn(*args), snapshot()
+    finally:
+        reset()
+        merge(saved)
+        if not was_enabled:
+            disable()
+
+# Report of the counters and timers as nested dicts, {metric: {label: value}}
+def report() -> Dict[str, Dict]:
+    counters, timers = {}, {}
+    for (metric, label), vals in sorted(_counts.items()):
+        counters.setdefault(metric, {})[label] = vals
+    for (metric, label), vals in sorted(_seconds.items()):
+        timers.setdefault(metric, {})[label] = {"seconds": vals, "calls": _calls[(metric, label)]}
+    return {"counters": counters, "timers": timers}
+
+# Report in the Prometheus text exposition format
+def prometheus(prefix: str = "sim") -> str:
+    lines = []
+    data = report()
+    for metric, labels in data["counters"].items():
+        name = f"{prefix}_{metric}_total"
+        lines.append(f"# HELP {name} {METRICS.get(metric, metric)}")
+        lines.append(f"# TYPE {name} counter")
+        lines += [f'{name}{{source="{label}"}} {vals}' for label, vals in labels.items()]
+    for suffix, field, help_text in (("seconds_total", "seconds", "Wall time spent"), ("calls_total", "calls", "Timed calls")):
+        if not data["timers"]:
+            break
+        name = f"{prefix}_{suffix}"
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        for metric, labels in data["timers"].items():
+            lines += [f'{name}{{timer="{metric}",source="{label}"}} {vals[field]}' for label, vals in labels.items()]
+    return "\n".join(lines) + "\n"
+
+# Write the report to a file, as Prometheus text for a .prom file and JSON otherwise
+def write_report(path: str, fmt: Optional[str] = None) -> None:
+    fmt = fmt or ("prometheus" if path.endswith(".prom") else "json")
+    with open(path, "w") as f:
+        f.write(prometheus() if fmt == "prometheus" else json.dumps(report(), indent=2) + "\n")
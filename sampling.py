@@ -0,0 +1,117 @@
+from typing import Iterator, List, Sequence, Tuple, Union
+import itertools
+import math
+import numpy as np
+import instrument
+
+# Random draws shared by the simulators
+
+# Pre-generated uniforms served one at a time, drawn from rng in blocks of size
+class UniformBuffer:
+    def __init__(self, rng: Union[int, np.random.Generator, None] = None, size: int = 4096):
+        self.rng = instrument.rng(rng, "uniform_buffer")
+        self.size = size
+        self._stream = itertools.chain.from_iterable(self._blocks())
+
+    def _blocks(self) -> Iterator[list]:
+        while True:
+            yield self.rng.random(self.size).tolist()
+
+    def next(self) -> float:
+        return next(self._stream)
+
+    # Iterator over the same uniforms, whose __next__ is the fastest way to take them one at a time in a loop
+    def __iter__(self) -> Iterator[float]:
+        return self._stream
+
+# One uniform per run, runs 2k and 2k+1 taking u and 1 - u when antithetic (taken modulo 1 to stay in [0, 1))
+# An odd last run gets a plain uniform of its own
+def antithetic_uniforms(rng: np.random.Generator, n_runs: int, antithetic: bool = False) -> np.ndarray:
+    if not antithetic:
+        return rng.random(n_runs)
+    u = rng.random((n_runs + 1) // 2)
+    return np.stack([u, (1 - u) % 1.0], axis=1).ravel()[:n_runs]
+
+# Mean of every pair of rows 2k and 2k+1, an odd last row counting as a sample of its own
+def _pair_means(rows: np.ndarray) -> np.ndarray:
+    n_pairs = len(rows) // 2
+    return np.concatenate([rows[:2 * n_pairs].reshape(n_pairs, 2, rows.shape[1]).mean(axis=1), rows[2 * n_pairs:]])
+
+# Running mean of every column of values with its standard error, merged chunk by chunk in constant memory
+# Paired runs (see antithetic_uniforms) count as one sample per pair, and every column is regressed on the zero-mean
+# controls first, which removes the part of its variance they explain while keeping the mean unbiased (control variates)
+# Only the count, the means and the centered cross products of the controls and values are kept (Chan update)
+class RunningEstimate:
+    def __init__(self, paired: bool = False):
+        self.paired = paired
+        self.n = 0
+        self.k = 0
+        self.mean = np.zeros(0)
+        self.cross = np.zeros((0, 0))
+
+    # Merge a chunk of runs given as columns of values and of controls, the same columns for every chunk
+    # Paired chunks hold an even number of runs, only the last one may be odd
+    def update(self, values: Sequence[np.ndarray], controls: Sequence[np.ndarray] = ()) -> None:
+        rows = np.column_stack([*controls, *values]).astype(np.float64)
+        if self.paired:
+            rows = _pair_means(rows)
+        if len(rows) == 0:
+            return
+        n_chunk = len(rows)
+        mean_chunk = rows.mean(axis=0)
+        centered = rows - mean_chunk
+        cross_chunk = centered.T @ centered
+        if self.n == 0:
+            self.n, self.k, self.mean, self.cross = n_chunk, len(controls), mean_chunk, cross_chunk
+            return
+        n_total = self.n + n_chunk
+        delta = mean_chunk - self.mean
+        self.mean = self.mean + delta * n_chunk / n_total
+        self.cross = self.cross + cross_chunk + np.outer(delta, delta) * self.n * n_chunk / n_total
+        self.n = n_total
+
+    # Mean of every column of values with its standard error
+    # With no more samples than controls plus one the regression cannot be fitted, and the plain means are returned
+    def estimate(self) -> List[Tuple[float, float]]:
+        n, k = self.n, self.k
+        means = self.mean[k:]
+        residuals = np.diag(self.cross[k:, k:]).copy()
+        if n <= k + 1:
+            k = 0
+        elif k:
+            cross_xy = self.cross[:k, k:]
+            beta = np.linalg.lstsq(self.cross[:k, :k], cross_xy, rcond=None)[0]
+            means = means - self.mean[:k] @ beta
+            residuals -= np.sum(beta * cross_xy, axis=0)
+        ses = np.sqrt(np.maximum(residuals, 0) / (n - 1 - k) / n) if n > 1 + k else np.full(len(means), np.nan)
+        return [(float(m), float(se)) for m, se in zip(means, ses)]
+
+# Mean of every column of values with its standard error, see RunningEstimate
+def vr_estimate(values: Sequence[np.ndarray], controls: Sequence[np.ndarray] = (), paired: bool = False) -> List[Tuple[float, float]]:
+    running = RunningEstimate(paired)
+    running.update(values, controls)
+    return running.estimate()
+
+# Mirrored uniforms for a shrinking set of runs (sorted indices), runs 2k and 2k+1 taking u and 1 - u while both remain
+# One uniform is drawn per pair left, so a few runs left of many cost only a few draws
+class AntitheticUniforms:
+    def __init__(self, rng: np.random.Generator, runs: np.ndarray):
+        self.rng = rng
+        self.select(runs)
+
+    # Keep drawing for these runs only, after some of the previous ones are done
+    def select(self, runs: np.ndarray) -> None:
+        pairs = runs // 2
+        first = np.ones(len(runs), dtype=bool)
+        first[1:] = pairs[1:] != pairs[:-1]
+        self._n_pairs = int(np.count_nonzero(first))
+        # Position of every run among the mirrored uniforms of the pairs left, None while they line up
+        index = 2 * (np.cumsum(first) - 1) + runs % 2
+        self._n_runs = len(runs)
+        self._index = None if (index == np.arange(len(runs))).all() else index
+
+    # One uniform per run
+    def draw(self) -> np.ndarray:
+        u = self.rng.random(self._n_pairs)
+        mirrored = np.stack([u, (1 - u) % 1.0], axis=1).ravel()
+        return mirrored[:self._n_runs] if self._index is None else mirrored[self._index]
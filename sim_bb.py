@@ -1,131 +1,151 @@
-from dataclasses import dataclass
-from typing import Dict, List, Optional
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple, Union
+from concurrent.futures import Executor, ProcessPoolExecutor
 import numpy as np
-import random
+import bisect
+import itertools
+import functools
 import math
-import pdb
+import json
+import argparse
+import contextlib
+import hashlib
+import sqlite3
 import sys
-
-# Mice Data taken from tsitu's CRE
+import os
+import types
+import instrument
+import batch
+from sampling import UniformBuffer, antithetic_uniforms, vr_estimate
+
+# Cumulative probability edges for inverse-CDF draws (the final 1.0 is dropped)
+def _cdf_edges(weights: List[float]) -> List[float]:
+    cum = list(itertools.accumulate(weights))
+    return [c / cum[-1] for c in cum[:-1]]
+
+# Cumulative edges of Binomial(n, p) for inverse-CDF catch counts
+@functools.lru_cache(maxsize=None)
+def _binomial_edges(n: int, p: float) -> Tuple[float, ...]:
+    pmf = [math.comb(n, k) * p**k * (1 - p)**(n - k) for k in range(n + 1)]
+    return tuple(_cdf_edges(pmf))
+
+# Number of attempts up to and including the first success, by inversion of the uniforms
+# A success that never happens has no number of attempts, so zero probability targets are refused
+def _geometric_attempts(uniforms: np.ndarray, p: float) -> np.ndarray:
+    if p <= 0:
+        raise ValueError(f"Success probability is {p}, the attempts would never end")
+    if p >= 1:
+        return np.ones(len(uniforms), dtype=np.int64)
+    return np.maximum(1, np.ceil(np.log1p(-uniforms) / math.log1p(-p))).astype(np.int64)
+
+# Mouse pool of a (cheese, zone) compiled for a given trap setup
+@dataclass
+class MouseTable:
+    edges: List[float]
+    catch: List[float]
+    probs: np.ndarray
+
+    # Draw a mouse and roll the catch
+    def hunt(self, uniforms: UniformBuffer) -> bool:
+        idx = bisect.bisect_right(self.edges, uniforms.next()) if self.edges else 0
+        return uniforms.next() < self.catch[idx]
+
+    # Chance that a single hunt attracts and catches a mouse from the pool
+    @property
+    def p_catch(self) -> float:
+        return float(np.dot(self.probs, self.catch))
+
+    # Number of catches out of n_hunts for each of n_runs, Binomial(n_hunts, p_catch) with one uniform per run
+    def catch_counts(self, rng: np.random.Generator, n_runs: int, n_hunts: int, antithetic: bool = False) -> np.ndarray:
+        return np.searchsorted(_binomial_edges(n_hunts, self.p_catch), antithetic_uniforms(rng, n_runs, antithetic), side="right")
+
+# Mouse data file, taken from tsitu's CRE
+MICE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mice.json")
+
+# Mouse database: every mouse of every pool in contiguous read-only arrays, the mice of a
+# (cheese, zone) pool being the slice pools[(cheese, zone)] of them, and a hash of the data
+@dataclass(frozen=True, eq=False)
+class MouseDB:
+    attractions: np.ndarray
+    powers: np.ndarray
+    effects: np.ndarray
+    names: Tuple[str, ...]
+    pools: Mapping[Tuple[str, str], slice]
+    content_hash: str
+
+# Load the mouse database of a data file, once per path however it is spelled or passed
+def load_mice(path: str = MICE_PATH) -> MouseDB:
+    return _read_mice(os.path.abspath(path))
+
+# Pools without attractions (the bosses) attract their only mouse every hunt
+@functools.lru_cache(maxsize=None)
+def _read_mice(path: str) -> MouseDB:
+    with open(path) as f:
+        data = json.load(f)
+    pools, attractions, powers, effects, names = {}, [], [], [], []
+    for pool in data["pools"]:
+        start = len(powers)
+        attractions += pool.get("attractions", [1.0] * len(pool["powers"]))
+        powers += pool["powers"]
+        effects += pool["effects"]
+        names += pool["names"]
+        pools[(pool["cheese"], pool["zone"])] = slice(start, len(powers))
+    arrays = [np.array(vals, dtype=float) for vals in (attractions, powers, effects)]
+    for vals in arrays:
+        vals.setflags(write=False)
+    content_hash = hashlib.sha256(json.dumps(data["pools"], sort_keys=True).encode()).hexdigest()
+    return MouseDB(*arrays, tuple(names), types.MappingProxyType(pools), content_hash)
+
+# Attraction edges of every pool of a database for inverse-CDF draws of its mice, the same for every trap setup
+@functools.lru_cache(maxsize=None)
+def _pool_edges(db: MouseDB) -> Dict[Tuple[str, str], List[float]]:
+    return {pool: _cdf_edges(db.attractions[rows].tolist()) for pool, rows in db.pools.items()}
+
+# Mouse pools of a database compiled for a trap setup, shared by every MiceData of that database
+@functools.lru_cache(maxsize=1024)
+def _compile_pools(db: MouseDB, trap_power: int, trap_luck: int) -> Dict[Tuple[str, str], MouseTable]:
+    # Catch rate of every mouse at once
+    effects = db.effects
+    catch = np.minimum(1, (trap_power*effects + 2*(np.floor(trap_luck*np.minimum(effects, 1.4))**2)) / (db.powers + trap_power*effects))
+    edges = _pool_edges(db)
+    tables = {}
+    for pool, rows in db.pools.items():
+        ar = db.attractions[rows]
+        tables[pool] = MouseTable(edges=edges[pool], catch=catch[rows].tolist(), probs=ar / ar.sum())
+    return tables
+
+# Mice Data taken from tsitu's CRE, loaded once from path
 class MiceData:
-    def __init__(self):
-        # Mice attraction rate
-        self.mice_dict = {}
-
-        # SB mice
-        self.mice_dict = {
-                # Normal mice
-                # Beanstalk
-                ("SB","Beanstalk"): {
-                    "attractions": [0.4829, 0.4686, 0.0485],
-                    "powers": [12000,13000,4000],
-                    "effects": [1,1,1],
-                    "names": ["Budrich Thomborn",
-                              "Leafton Beanwell",
-                              "Herbaceous Bravestalk"]},
-                # Dungeon
-                ("SB","Dungeon"): {
-                    "attractions": [0.2594, 0.3474, 0.3932],
-                    "powers": [15000,20000,30000],
-                    "effects": [1,1,1],
-                    "names": ["Peaceful Prisoner",
-                              "Diminutive Detainee",
-                              "Smug Smuggler"]},
-                ("Beanster","Dungeon"): {
-                    "attractions": [0.3090, 0.4448, 0.2462],
-                    "powers": [16200,17300,19040],
-                    "effects": [1,1,1],
-                    "names": ["Cell Sweeper",
-                              "Jovial Jailor",
-                              "Lethargic Guard"]},
-                ("Lavish","Dungeon"): {
-                    "attractions": [0.5070, 0.4930],
-                    "powers": [25185,23140],
-                    "effects": [1,1],
-                    "names": ["Gate Keeper",
-                              "Key Master"]},
-                ("Royal","Dungeon"): {
-                    "attractions": [1.0],
-                    "powers": [70300],
-                    "effects": [1.5],
-                    "names": ["Wrathful Warden"]},
-                # Ballroom
-                ("SB","Ballroom"): {
-                    "attractions": [0.2642, 0.3423, 0.3935],
-                    "powers": [22000,24000,33000],
-                    "effects": [1,1,1],
-                    "names": ["Whimsical Waltzer",
-                              "Sassy Salsa Dancer",
-                              "Baroque Dancer"]},
-                ("Beanster","Ballroom"): {
-                    "attractions": [0.3092, 0.3956, 0.2952],
-                    "powers": [19000,21000,23000],
-                    "effects": [1,1,1],
-                    "names": ["Obstinate Oboist",
-                              "Peevish Piccoloist",
-                              "Sultry Saxophonist"]},
-                ("Lavish","Ballroom"): {
-                    "attractions": [0.5051, 0.4949],
-                    "powers": [33090,30520],
-                    "effects": [1,1],
-                    "names": ["Violent Violinist",
-                              "Chafed Cellist"]},
-                ("Royal","Ballroom"): {
-                    "attractions": [1.0],
-                    "powers": [77925],
-                    "effects": [1.5],
-                    "names": ["Treacherous Tubaist"]},
-                # Great Hall
-                ("SB","Great Hall"): {
-                    "attractions": [0.2515, 0.3464, 0.4021],
-                    "powers": [28000,32000,38000],
-                    "effects": [1,1,1],
-                    "names": ["Clumsy Cupbearer",
-                              "Plotting Page",
-                              "Scheming Squire"]},
-                ("Beanster","Great Hall"): {
-                    "attractions": [0.2635, 0.3903, 0.3462],
-                    "powers": [25000,31000,29000],
-                    "effects": [1,1,1],
-                    "names": ["Vindictive Viscount",
-                              "Baroness von Bean",
-                              "Cagey Countess"]},
-                ("Lavish","Great Hall"): {
-                    "attractions": [0.5046, 0.4954],
-                    "powers": [34550,36600],
-                    "effects": [1,1],
-                    "names": ["Dastardly Duchess",
-                              "Malicious Marquis"]},
-                ("Royal","Great Hall"): {
-                    "attractions": [1.0],
-                    "powers": [86363],
-                    "effects": [1.5],
-                    "names": ["Pernicious Prince"]},
-                # Boss mice
-                ("Boss","Beanstalk"): {
-                    "powers": [80900],
-                    "effects": [4],
-                    "names": ["Vinneus Stalkhome"]},
-                ("Boss","Dungeon"): {
-                    "powers": [104250],
-                    "effects": [3],
-                    "names": ["Dungeon Master"]},
-                ("Boss","Ballroom"): {
-                    "powers": [184600],
-                    "effects": [4],
-                    "names": ["Malevolent Maestro"]},
-                ("Boss","Great Hall"): {
-                    "powers": [222150],
-                    "effects": [3],
-                    "names": ["Mythical Giant King"]}
-            }
-    
-    # Randomly draw a mice from the AR pool
-    def get_mouse(self, cheese, zone):
-        data = self.mice_dict[(cheese,zone)]
-        ar = data["attractions"]
-        idx = np.random.choice(len(ar), p=np.array(ar)/sum(ar))
-        return (data["powers"][idx], data["effects"][idx], data["names"][idx])
+    def __init__(self, path: str = MICE_PATH):
+        self.db = load_mice(path)
+        self._rng: Optional[np.random.Generator] = None
+
+    # Pools as a nested dict of lists, {(cheese, zone): {"attractions", "powers", "effects", "names"}}, built on first use
+    @functools.cached_property
+    def mice_dict(self) -> Dict[Tuple[str, str], Dict[str, list]]:
+        return {pool: {"attractions": self.db.attractions[rows].tolist(), "powers": self.db.powers[rows].tolist(),
+                       "effects": self.db.effects[rows].tolist(), "names": list(self.db.names[rows])}
+                for pool, rows in self.db.pools.items()}
+
+    # Attraction edges of a pool, for inverse-CDF draws of its mice
+    def pool_edges(self, cheese, zone) -> List[float]:
+        return _pool_edges(self.db)[(cheese, zone)]
+
+    # Randomly draw a mice from the AR pool, with the given Generator (or seed), or a stream kept by this MiceData
+    def get_mouse(self, cheese, zone, rng: Union[int, np.random.Generator, None] = None):
+        if rng is None:
+            if self._rng is None:
+                self._rng = np.random.default_rng()
+            rng = self._rng
+        elif not isinstance(rng, np.random.Generator):
+            rng = np.random.default_rng(rng)
+        rows = self.db.pools[(cheese,zone)]
+        idx = rows.start + bisect.bisect_right(self.pool_edges(cheese, zone), rng.random())
+        return (float(self.db.powers[idx]), float(self.db.effects[idx]), self.db.names[idx])
+
+    # Compile every mouse pool into attraction edges and catch rates for a trap setup
+    def compile(self, trap_power, trap_luck) -> Dict[Tuple[str, str], MouseTable]:
+        return _compile_pools(self.db, trap_power, trap_luck)
 
     # Get the boss
     def get_boss(self, zone):
@@ -135,16 +155,96 @@ class MiceData:
     def catch_rate(self, trap_power, trap_luck, mouse_power, mouse_eff):
         return min(1, (trap_power*mouse_eff + 2*(math.floor(trap_luck*min(mouse_eff,1.4))**2)) / (mouse_power + trap_power*mouse_eff))
 
-# Result Storage
+# Integer type of every result column
+RESULT_DTYPE = np.int32
+
+# Result Storage, one column of n_runs integers for hunts and for every loot key
+# Optionally with zero-mean control variates of every run, and paired when runs 2k and 2k+1 are antithetic
 @dataclass
 class SimResult:
-    hunts: List[int]
-    loot: Dict[str, List[int]]
-
-    def mean(self) -> Dict[str, float]:
-        return {key: float(np.mean(vals)) for key, vals in {**self.loot, "hunts": self.hunts}.items()}
+    hunts: np.ndarray
+    loot: Dict[str, np.ndarray]
+    controls: Dict[str, np.ndarray] = field(default_factory=dict)
+    paired: bool = False
+
+    def __post_init__(self):
+        self.hunts = np.asarray(self.hunts, dtype=RESULT_DTYPE)
+        self.loot = {key: np.asarray(vals, dtype=RESULT_DTYPE) for key, vals in self.loot.items()}
+        self.controls = {key: np.asarray(vals, dtype=np.float64) for key, vals in self.controls.items()}
+
+    # Concatenate the runs of several results, a key missing from some of them counts as 0 there
+    # Only the controls every result has are kept, and the merge is paired when every result is
+    # The unpaired last run of an odd paired result moves to the end, so that the pairs after it stay aligned
+    @classmethod
+    def merge(cls, *results: "SimResult") -> "SimResult":
+        keys = list(dict.fromkeys(key for r in results for key in r.loot))
+        controls = [key for key in (results[0].controls if results else {}) if all(key in r.controls for r in results)]
+        paired = bool(results) and all(r.paired for r in results)
+        merged = cls(np.concatenate([r.hunts for r in results]) if results else np.zeros(0, dtype=RESULT_DTYPE),
+                     {key: np.concatenate([r.loot.get(key, np.zeros(len(r), dtype=RESULT_DTYPE)) for r in results]) for key in keys},
+                     {key: np.concatenate([r.controls[key] for r in results]) for key in controls},
+                     paired=paired)
+        singles = np.cumsum([len(r) for r in results])[[len(r) % 2 == 1 for r in results]] - 1 if paired else []
+        if len(singles) == 0 or (len(singles) == 1 and singles[0] == len(merged) - 1):
+            return merged
+        order = np.concatenate([np.delete(np.arange(len(merged)), singles), singles])
+        return cls(merged.hunts[order], {key: vals[order] for key, vals in merged.loot.items()},
+                   {key: vals[order] for key, vals in merged.controls.items()}, paired=True)
+
+    def __len__(self) -> int:
+        return len(self.hunts)
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        return {**self.loot, "hunts": self.hunts}
+
+    def mean(self, control_variates: bool = False) -> Dict[str, float]:
+        if control_variates:
+            return {key: vals[0] for key, vals in self.estimate().items()}
+        return {key: float(np.mean(vals)) for key, vals in self.columns().items()}
     def std(self) -> Dict[str, float]:
-        return {key: float(np.std(vals)) for key, vals in {**self.loot, "hunts": self.hunts}.items()}
+        return {key: float(np.std(vals)) for key, vals in self.columns().items()}
+
+    # Standard error of the mean of every column, see estimate
+    def sem(self, control_variates: bool = False) -> Dict[str, float]:
+        return {key: vals[1] for key, vals in self.estimate(control_variates).items()}
+
+    # Mean of every column with its standard error, see vr_estimate
+    # Paired runs count as one sample per pair, and with control_variates every column is regressed on the controls
+    def estimate(self, control_variates: bool = True) -> Dict[str, Tuple[float, float]]:
+        cols = self.columns()
+        controls = list(self.controls.values()) if control_variates else []
+        return dict(zip(cols, vr_estimate(list(cols.values()), controls, self.paired)))
+
+    # Percentiles q in [0, 100] of every column, a float per key for a single q, otherwise an array
+    def percentile(self, q: Union[float, Iterable[float]]) -> Dict[str, Union[float, np.ndarray]]:
+        return self.quantile(np.asarray(q, dtype=float) / 100)
+
+    # Quantiles q in [0, 1] of every column, a float per key for a single q, otherwise an array
+    def quantile(self, q: Union[float, Iterable[float]]) -> Dict[str, Union[float, np.ndarray]]:
+        q = np.asarray(q, dtype=float)
+        return {key: float(vals) if q.ndim == 0 else vals for key, vals in
+                ((key, np.quantile(vals, q)) for key, vals in self.columns().items())}
+
+# Loot keys of a hunt
+LOOT_KEYS = ["beans", "ferts", "harps",
+             "mbean", "lbean", "rbean", "mysts",
+             "norms", "bster", "llavi", "royal",
+             "geggs", "noise", "harps_spent"]
+
+# Cheese counted per catch
+CHEESE_KEYS = {"SB": "norms", "Beanster": "bster", "Lavish": "llavi", "Royal": "royal"}
+
+# Loot credited per catch for a zone and room type
+def _zone_loot_key(zone: str, room_type: Optional[str]) -> Optional[str]:
+    if zone == "Beanstalk":
+        return "beans"
+    elif zone == "Dungeon":
+        return {"lavish": "lbean", "magic": "mbean", "mysteries": "mysts"}.get(room_type)
+    elif zone == "Ballroom":
+        return {"royal": "rbean", "harps": "harps", "mysteries": "mysts"}.get(room_type)
+    elif zone == "Great Hall":
+        return "geggs"
+    return None
 
 # Do hunt simulation
 def do_sim(mice: MiceData,
@@ -155,42 +255,62 @@ def do_sim(mice: MiceData,
            zone: str,
            loot_multi: int,
            room_type: Optional[str] = None,
+           rng: Optional[np.random.Generator] = None,
+           uniforms: Optional[UniformBuffer] = None,
            ) -> Dict[str, List[int]]:
-    
+    # Uniform draws from a seed or an existing Generator, in one block of the at most 2 uniforms each hunt takes
+    if uniforms is None:
+        uniforms = UniformBuffer(instrument.rng(rng, "do_sim"), size=max(1, 2 * n_hunts))
+    table = mice.compile(trap_power, trap_luck)[(cheese, zone)]
+
     # Result dictionary
-    out = {"beans": 0, "ferts": 0, "harps": 0,
-           "mbean": 0, "lbean": 0, "rbean": 0, "mysts": 0, 
-           "norms": 0, "bster": 0, "llavi": 0, "royal": 0,
-           "geggs": 0, "noise": 0, "harps_spent": 0}
-    
-    # Loop over runs
+    out = {keys: 0 for keys in LOOT_KEYS}
+
+    # Count the catches, loot only depends on how many there are
+    catches = 0
     for _ in range(n_hunts):
-        m_pow, m_eff, _ = mice.get_mouse(cheese, zone)
-        if random.random() < mice.catch_rate(trap_power, trap_luck, m_pow, m_eff):
-            # Generic counters
-            ## Count cheese spent for Beanstalk run
-            if cheese == "SB": out["norms"] += 1
-            ## Count cheese spent for Castle run
-            if cheese == "Beanster": out["bster"] += 1
-            if cheese == "Lavish": out["llavi"] += 1
-            if cheese == "Royal": out["royal"] += 1
-
-            # Zone specific counters
-            if zone == "Beanstalk":
-                out["beans"] += loot_multi
-            elif zone == "Dungeon":
-                if room_type == "lavish": out["lbean"] += loot_multi
-                elif room_type == "magic": out["mbean"] += loot_multi
-                elif room_type == "mysteries": out["mysts"] += loot_multi
-            elif zone == "Ballroom":
-                if room_type == "royal": out["rbean"] += loot_multi
-                elif room_type == "harps": out["harps"] += loot_multi
-                elif room_type == "mysteries": out["mysts"] += loot_multi
-            elif zone == "Great Hall":
-                out["geggs"] += loot_multi
-            
+        if table.hunt(uniforms):
+            catches += 1
+    _add_catch_loot(out, catches, cheese, zone, loot_multi, room_type)
+    if instrument.enabled:
+        instrument.count("hunts", n_hunts, "do_sim")
+
+    return out
+
+# Do hunt simulation for many runs at once, returning one array per loot key
+def do_sim_batch(mice: MiceData,
+                 trap_power: int,
+                 trap_luck: int,
+                 n_hunts: int,
+                 cheese: str,
+                 zone: str,
+                 loot_multi: Union[int, np.ndarray],
+                 room_type: Optional[str] = None,
+                 n_runs: int = 1,
+                 rng: Union[int, np.random.Generator, None] = None,
+                 antithetic: bool = False,
+                 ) -> Dict[str, np.ndarray]:
+    rng = instrument.rng(rng, "do_sim_batch")
+    table = mice.compile(trap_power, trap_luck)[(cheese, zone)]
+
+    # Result dictionary
+    out = {keys: np.zeros(n_runs, dtype=np.int64) for keys in LOOT_KEYS}
+    _add_catch_loot(out, table.catch_counts(rng, n_runs, n_hunts, antithetic), cheese, zone, loot_multi, room_type)
+    if instrument.enabled:
+        instrument.count("hunts", n_hunts * n_runs, "do_sim_batch")
+
     return out
 
+# Credit cheese and loot for a number of catches (scalars or arrays)
+def _add_catch_loot(out: Dict, catches, cheese: str, zone: str, loot_multi, room_type: Optional[str]) -> None:
+    ## Count cheese spent
+    if cheese in CHEESE_KEYS:
+        out[CHEESE_KEYS[cheese]] += catches
+    ## Zone specific counters
+    loot_key = _zone_loot_key(zone, room_type)
+    if loot_key is not None:
+        out[loot_key] += catches * loot_multi
+
 # Merge the result
 def merge_loot(*dicts: Dict[str, int]) -> Dict[str, int]:
     out = {}
@@ -201,80 +321,92 @@ def merge_loot(*dicts: Dict[str, int]) -> Dict[str, int]:
             out[keys] += vals
     return out
 
+# Beanstalk room parameters
+BEANSTALK_ROOMS = dict(
+    room_types = ["Standard", "Super", "Extreme", "Ultimate"],
+    room_probs = [0.05, 0.18, 0.70, 0.07],
+    room_multi = {"Standard": 1, "Super": 2, "Extreme": 4, "Ultimate": 8})
+
+# Great Hall room parameters (always use key in Great Hall)
+GREATHALL_ROOMS = dict(
+    room_types = ["Super", "Extreme", "Ultimate"],
+    room_probs = [0.580, 0.245, 0.175],
+    room_multi = {"Super": 2, "Extreme": 4, "Ultimate": 8})
+
 # Simulator for Beanstalk 
-def simulate_beanstalk(trap_power: int, trap_luck: int, use_ref: bool, n_runs: int=1000) -> SimResult:
+# With variance_reduction, runs of every stage simulator come in antithetic pairs with control variates (see SimResult.estimate)
+def simulate_beanstalk(trap_power: int, trap_luck: int, use_ref: bool, n_runs: int=1000, rng: Union[int, np.random.Generator, None]=None,
+                       variance_reduction: bool=False) -> SimResult:
     # Fetch mice data
     mice = MiceData()
-
-    # Initialize results dictionary
-    results = {
-        "hunts": [],
-        "beans": [],
-        "ferts": []}
+    rng = instrument.rng(rng, "beanstalk")
+    tables = mice.compile(trap_power, trap_luck)
+    boss = tables[("Boss", "Beanstalk")]
 
     # Room distribution
-    room_types = ["Standard", "Super", "Extreme", "Ultimate"]
-    room_probs = [0.05, 0.18, 0.70, 0.07]
-    room_multi = {"Standard": 1, "Super": 2, "Extreme": 4, "Ultimate": 8}
-
-    for _ in range(n_runs):
-        run_loot = {keys: 0 for keys in results if keys != "hunts"}
-        hunts = 0
-
-        # Pick a room
-        room = np.random.choice(room_types, p=np.array(room_probs)/sum(room_probs))
-        multiplier = room_multi[room]
-
-        # 20 guaranteed hunts
-        hunts += 20
-        loot = do_sim(mice, trap_power, trap_luck, 20, "SB", "Beanstalk", multiplier)
-        run_loot = merge_loot(run_loot, loot)
-
-        # Boss fight
-        boss = mice.get_boss("Beanstalk")
-        b_pow, b_eff = boss["powers"][0], boss["effects"][0]
-        boss_caught = False
-        while not boss_caught:
-            hunts += 1
-            if random.random() < mice.catch_rate(trap_power, trap_luck, b_pow, b_eff):
-                run_loot["beans"] += multiplier + 20
-                run_loot["ferts"] += 1
-                boss_caught = True
-
-        # If using refractor base, double ferts
-        if use_ref:
-            run_loot["ferts"] *= 2
-
-        # Append results
-        results["hunts"].append(run_loot.get("hunts", hunts))
-        for keys, vals in run_loot.items():
-            results.setdefault(keys, []).append(vals)
-
-    return SimResult(results["hunts"], {keys: results[keys] for keys in results if keys != "hunts"})
+    room_types, room_probs, room_multi = BEANSTALK_ROOMS["room_types"], BEANSTALK_ROOMS["room_probs"], BEANSTALK_ROOMS["room_multi"]
+
+    # Pick a room for every run
+    rooms = np.searchsorted(_cdf_edges(room_probs), antithetic_uniforms(rng, n_runs, variance_reduction), side="right")
+    multipliers = np.array([room_multi[room] for room in room_types])[rooms]
+
+    # 20 guaranteed hunts for every run
+    loot = do_sim_batch(mice, trap_power, trap_luck, 20, "SB", "Beanstalk", multipliers, n_runs=n_runs, rng=rng, antithetic=variance_reduction)
+
+    # Boss fight, hunting until caught
+    boss_attempts = _geometric_attempts(antithetic_uniforms(rng, n_runs, variance_reduction), boss.catch[0])
+    hunts = 20 + boss_attempts
+    controls = {}
+    if variance_reduction:
+        # Zero-mean controls: catches, boss attempts, room multiplier and catches times multiplier minus their expected values
+        p_sb = tables[("SB", "Beanstalk")].p_catch
+        mean_multi = np.dot(np.array(room_probs) / sum(room_probs), [room_multi[room] for room in room_types])
+        controls = {"catches": loot["norms"] - 20 * p_sb,
+                    "boss_attempts": boss_attempts - 1 / boss.catch[0],
+                    "multiplier": multipliers - mean_multi,
+                    "room_catches": multipliers * loot["norms"] - 20 * p_sb * mean_multi}
+
+    loot["beans"] += multipliers + 20
+    loot["ferts"] += 1
+
+    # If using refractor base, double ferts
+    if use_ref:
+        loot["ferts"] *= 2
+
+    if instrument.enabled:
+        instrument.count("hunts", np.sum(hunts), "beanstalk")
+        instrument.count("runs", n_runs, "beanstalk")
+        instrument.count("rooms", n_runs, "beanstalk")
+        instrument.count("boss_attempts", np.sum(hunts) - 20 * n_runs, "beanstalk")
+    return SimResult(hunts, loot, controls, paired=variance_reduction)
 
 # Simulator for Room 1 Retreat
 def simulate_r1r(mice: MiceData, trap_power: int, trap_luck: int, 
                 room_types: List[str], room_probs: List[float], room_dicts: Dict[str, List[float]],
                 denom_names: List[str], denom_mults: List[int],
-                loot_keys: Dict[str, str], boss_reward: Dict[str, int], noise_cap: int, zone: str) -> Dict[str, int]:
+                loot_keys: Dict[str, str], boss_reward: Dict[str, int], noise_cap: int, zone: str,
+                rng: Optional[np.random.Generator] = None, uniforms: Optional[UniformBuffer] = None) -> Dict[str, int]:
     # Initialize results dictionary
     results = {
         "hunts": 0, "mbean": 0, "lbean": 0, "rbean": 0, "harps": 0, "mysts": 0, 
         "ferts": 0, "bster": 0, "llavi": 0, "royal": 0, "noise": 0, "harps_spent": 0}
     boss_caught = False
+    if uniforms is None:
+        uniforms = UniformBuffer(instrument.rng(rng, "r1r"))
+    tables = mice.compile(trap_power, trap_luck)
+    lavish, beanster, boss = tables[("Lavish", zone)], tables[("Beanster", zone)], tables[("Boss", zone)]
 
     # Roll for the room
-    room_type = np.random.choice(room_types, p=np.array(room_probs)/sum(room_probs))
-    denom = np.random.choice(denom_names, p=np.array(room_dicts[room_type])/sum(room_dicts[room_type]))
-    multiplier = denom_mults[denom_names.index(denom)]
+    room_type = room_types[bisect.bisect_right(_cdf_edges(room_probs), uniforms.next())]
+    denom_idx = bisect.bisect_right(_cdf_edges(room_dicts[room_type]), uniforms.next())
+    multiplier = denom_mults[denom_idx]
 
     # Leaping lavish cheese for 4 hunts
     for _ in range(4):
         results["hunts"] += 1
         results["llavi"] += 1
         results["noise"] += 4 * multiplier # 4 from (leaping) lavish
-        m_pow, m_eff, _ = mice.get_mouse("Lavish", zone)
-        if random.random() < mice.catch_rate(trap_power, trap_luck, m_pow, m_eff):
+        if lavish.hunt(uniforms):
             results[loot_keys[room_type]] += 4 * multiplier
     # Expend harps to fill noise meter
     results["harps_spent"] += (noise_cap - results["noise"])
@@ -283,21 +415,84 @@ def simulate_r1r(mice: MiceData, trap_power: int, trap_luck: int,
     for _ in range(19):
         results["hunts"] += 1
         results["bster"] += 1
-        m_pow, m_eff, _ = mice.get_mouse("Beanster", zone)
-        if random.random() < mice.catch_rate(trap_power, trap_luck, m_pow, m_eff):
+        if beanster.hunt(uniforms):
             results[loot_keys[room_type]] += 2 * multiplier # 1 from beanster, 1 from chase 
 
     # Boss fight
-    boss = mice.get_boss(zone)
     while not boss_caught:
         results["hunts"] += 1
         results["bster"] += 1
-        if random.random() < mice.catch_rate(trap_power, trap_luck, boss["powers"][0], boss["effects"][0]):
+        if uniforms.next() < boss.catch[0]:
             for k, v in boss_reward.items():
                 results[k] += v
             results[loot_keys[room_type]] += 2 * multiplier
             boss_caught = True
-        
+
+    if instrument.enabled:
+        instrument.count("hunts", results["hunts"], "r1r")
+        instrument.count("runs", 1, "r1r")
+        instrument.count("rooms", 1, "r1r")
+        instrument.count("boss_attempts", results["hunts"] - 23, "r1r")
+    return results
+
+# Simulate Room 1 Retreat for many runs at once, returning one array per loot key
+# Every run draws its (room, denomination) pair in one go, catches of each phase are binomial and the boss fight is geometric
+# With antithetic, runs 2k and 2k+1 use mirrored uniforms; a controls dict receives the zero-mean control variates of
+# every run: the catches of each phase, the boss attempts and the room loot multiplier of each loot key minus their expected values
+def simulate_r1r_batch(mice: MiceData, trap_power: int, trap_luck: int,
+                       room_types: List[str], room_probs: List[float], room_dicts: Dict[str, List[float]],
+                       denom_names: List[str], denom_mults: List[int],
+                       loot_keys: Dict[str, str], boss_reward: Dict[str, int], noise_cap: int, zone: str,
+                       n_runs: int = 1, rng: Union[int, np.random.Generator, None] = None,
+                       antithetic: bool = False, controls: Optional[Dict[str, np.ndarray]] = None) -> Dict[str, np.ndarray]:
+    rng = instrument.rng(rng, "r1r_batch")
+    tables = mice.compile(trap_power, trap_luck)
+    lavish, beanster, boss = tables[("Lavish", zone)], tables[("Beanster", zone)], tables[("Boss", zone)]
+    results = {keys: np.zeros(n_runs, dtype=np.int64) for keys in
+               ["hunts", "mbean", "lbean", "rbean", "harps", "mysts", "ferts", "bster", "llavi", "royal", "noise", "harps_spent"]}
+
+    # Roll for the room of every run
+    probs = _room_denom_probs(room_types, room_probs, room_dicts)
+    pairs = list(probs)
+    rooms = np.searchsorted(_cdf_edges(list(probs.values())), antithetic_uniforms(rng, n_runs, antithetic), side="right")
+    multipliers = np.array([denom_mults[idx] for _, idx in pairs])[rooms]
+    room_keys = np.array([loot_keys[room] for room, _ in pairs])[rooms]
+
+    # Leaping lavish cheese for 4 hunts, then harps fill the noise meter
+    lavish_catches = lavish.catch_counts(rng, n_runs, 4, antithetic)
+    results["llavi"] += 4
+    results["noise"] += 16 * multipliers # 4 from (leaping) lavish
+    results["harps_spent"] += noise_cap - results["noise"]
+
+    # Beanster cheese for 19 hunts
+    beanster_catches = beanster.catch_counts(rng, n_runs, 19, antithetic)
+    results["bster"] += 19
+
+    # Boss fight
+    boss_attempts = _geometric_attempts(antithetic_uniforms(rng, n_runs, antithetic), boss.catch[0])
+    results["bster"] += boss_attempts
+    for keys, vals in boss_reward.items():
+        results[keys] += vals
+
+    # Loot of the room, 4 per lavish catch, 2 per beanster catch (1 from beanster, 1 from chase) and 2 from the boss
+    loot = multipliers * (4 * lavish_catches + 2 * beanster_catches + 2)
+    for keys in set(loot_keys.values()):
+        results[keys] += np.where(room_keys == keys, loot, 0)
+
+    if controls is not None:
+        controls["lavish_catches"] = lavish_catches - 4 * lavish.p_catch
+        controls["beanster_catches"] = beanster_catches - 19 * beanster.p_catch
+        controls["boss_attempts"] = boss_attempts - 1 / boss.catch[0]
+        for keys in dict.fromkeys(loot_keys.values()):
+            mean_multi = sum(p * denom_mults[idx] for (room, idx), p in probs.items() if loot_keys[room] == keys)
+            controls[f"multiplier_{keys}"] = np.where(room_keys == keys, multipliers, 0) - mean_multi
+
+    results["hunts"] = 23 + boss_attempts
+    if instrument.enabled:
+        instrument.count("hunts", np.sum(results["hunts"]), "r1r_batch")
+        instrument.count("runs", n_runs, "r1r_batch")
+        instrument.count("rooms", n_runs, "r1r_batch")
+        instrument.count("boss_attempts", np.sum(boss_attempts), "r1r_batch")
     return results
 
 # Simulator for farming a specific loot
@@ -305,17 +500,24 @@ def simulate_farm(mice: MiceData, trap_power: int, trap_luck: int,
                   room_types: List[str], room_probs: List[float], room_dicts: Dict[str, List[float]],
                   denom_names: List[str], denom_mults: List[int],
                   loot_keys: Dict[str, str], boss_reward: Dict[str, int],
-                  target_loot: Optional[str], zone: str) -> Dict[str, int]:
+                  target_loot: Optional[str], zone: str,
+                  rng: Optional[np.random.Generator] = None, uniforms: Optional[UniformBuffer] = None) -> Dict[str, int]:
     # Initialize results dictionary
     results = {
         "hunts": 0, "mbean": 0, "lbean": 0, "rbean": 0, "harps": 0, "mysts": 0, 
         "ferts": 0, "bster": 0, "llavi": 0, "royal": 0, "noise": 0, "harps_spent": 0}
     boss_caught = False
+    if uniforms is None:
+        uniforms = UniformBuffer(instrument.rng(rng, "farm"))
+    tables = mice.compile(trap_power, trap_luck)
+    lavish, royal, boss = tables[("Lavish", zone)], tables[("Royal", zone)], tables[("Boss", zone)]
+    room_edges = _cdf_edges(room_probs)
+    denom_edges = {room: _cdf_edges(probs) for room, probs in room_dicts.items()}
 
     while not boss_caught:
         # Roll for the room
-        room_type = np.random.choice(room_types, p=np.array(room_probs)/sum(room_probs))
-        denom = np.random.choice(denom_names, p=np.array(room_dicts[room_type])/sum(room_dicts[room_type]))
+        room_type = room_types[bisect.bisect_right(room_edges, uniforms.next())]
+        denom = denom_names[bisect.bisect_right(denom_edges[room_type], uniforms.next())]
         multiplier = denom_mults[denom_names.index(denom)]
 
         # Leaping lavish cheese for 4 hunts
@@ -323,8 +525,7 @@ def simulate_farm(mice: MiceData, trap_power: int, trap_luck: int,
             results["hunts"] += 1
             results["llavi"] += 1
             results["noise"] += 16 * multiplier # 4 from (leaping) lavish, 4 from feather and quill
-            m_pow, m_eff, _ = mice.get_mouse("Lavish", zone)
-            if random.random() < mice.catch_rate(trap_power, trap_luck, m_pow, m_eff):
+            if lavish.hunt(uniforms):
                 results[loot_keys[room_type]] += 16 * multiplier
 
         # Spend harps to erase noise
@@ -337,258 +538,410 @@ def simulate_farm(mice: MiceData, trap_power: int, trap_luck: int,
             for _ in range(20):
                 results["hunts"] += 1
                 results["royal"] += 1
-                m_pow, m_eff, _ = mice.get_mouse("Royal", zone)
-                if random.random() < mice.catch_rate(trap_power, trap_luck, m_pow, m_eff):
+                if royal.hunt(uniforms):
                     results[loot_keys[room_type]] += 1024 # 16 from cheese, 2 from CC, 4 from feather and quill
             # Giant chase
             for _ in range(19):
                 results["hunts"] += 1
                 results["royal"] += 1
-                m_pow, m_eff, _ = mice.get_mouse("Royal", zone)
-                if random.random() < mice.catch_rate(trap_power, trap_luck, m_pow, m_eff):
+                if royal.hunt(uniforms):
                     results[loot_keys[room_type]] += 2048
             # Boss fight
-            boss = mice.get_boss(zone)
             while not boss_caught:
                 results["hunts"] += 1
                 results["royal"] += 1
-                if random.random() < mice.catch_rate(trap_power, trap_luck, boss["powers"][0], boss["effects"][0]):
+                if uniforms.next() < boss.catch[0]:
                     for keys, vals in boss_reward.items():
                         results[keys] += vals
                     results[loot_keys[room_type]] += 2048
                     boss_caught = True
 
+    if instrument.enabled:
+        instrument.count("hunts", results["hunts"], "farm")
+        instrument.count("runs", 1, "farm")
+        instrument.count("rooms", results["llavi"] // 4, "farm")
+        instrument.count("boss_attempts", results["royal"] - 39, "farm")
     return results
 
+# Probability of each (room, denomination index) pair, normalizing the weights like the simulators do
+def _room_denom_probs(room_types: List[str], room_probs: List[float], room_dicts: Dict[str, List[float]]) -> Dict[Tuple[str, int], float]:
+    probs = {}
+    for room, p_room in zip(room_types, room_probs):
+        weights = room_dicts[room]
+        for idx, w in enumerate(weights):
+            probs[(room, idx)] = p_room / sum(room_probs) * w / sum(weights)
+    return probs
+
+# Simulate farming for many runs at once, returning one array per loot key
+# The number of rooms until the target Ultimate room is geometric, so only the other rooms are drawn,
+# from the room distribution conditioned on not being the target, and their catches are counted in bulk
+# With antithetic, runs 2k and 2k+1 use mirrored uniforms for every per-run draw (the bulk rooms stay independent);
+# a controls dict receives the zero-mean control variates of every run: the number of rooms, the catches of
+# each phase of the target room, the boss attempts and the multipliers of the other rooms minus their expected values
+def simulate_farm_batch(mice: MiceData, trap_power: int, trap_luck: int,
+                        room_types: List[str], room_probs: List[float], room_dicts: Dict[str, List[float]],
+                        denom_names: List[str], denom_mults: List[int],
+                        loot_keys: Dict[str, str], boss_reward: Dict[str, int],
+                        target_loot: str, zone: str, n_runs: int = 1,
+                        rng: Union[int, np.random.Generator, None] = None,
+                        antithetic: bool = False, controls: Optional[Dict[str, np.ndarray]] = None) -> Dict[str, np.ndarray]:
+    rng = instrument.rng(rng, "farm_batch")
+    tables = mice.compile(trap_power, trap_luck)
+    lavish, royal, boss = tables[("Lavish", zone)], tables[("Royal", zone)], tables[("Boss", zone)]
+    results = {keys: np.zeros(n_runs, dtype=np.int64) for keys in dict.fromkeys(
+               ["mbean", "lbean", "rbean", "harps", "mysts", "ferts", "bster", "llavi", "royal", "noise", "harps_spent", *loot_keys.values()])}
+
+    # Rooms are (room, denomination) pairs, the target one ends the search
+    probs = _room_denom_probs(room_types, room_probs, room_dicts)
+    pairs = list(probs)
+    target = pairs.index((target_loot, denom_names.index("Ultimate")))
+    other_probs = [p for i, p in enumerate(probs.values()) if i != target]
+    other_pairs = [pair for i, pair in enumerate(pairs) if i != target]
+    n_rooms = _geometric_attempts(antithetic_uniforms(rng, n_runs, antithetic), probs[pairs[target]])
+
+    # Draw every non-target room of every run at once
+    run_idx = np.repeat(np.arange(n_runs), n_rooms - 1)
+    if other_pairs and len(run_idx):
+        rooms = np.searchsorted(_cdf_edges(other_probs), rng.random(len(run_idx)), side="right")
+        multipliers = np.array([denom_mults[idx] for _, idx in other_pairs])[rooms]
+        catches = np.searchsorted(_binomial_edges(4, lavish.p_catch), rng.random(len(run_idx)), side="right")
+        harps_spent = np.bincount(run_idx, 64 * multipliers, minlength=n_runs)
+        results["harps_spent"] += harps_spent.astype(np.int64)
+        # Leaping lavish cheese for 4 hunts, 4 from (leaping) lavish, 4 from feather and quill
+        room_keys = np.array([loot_keys[room] for room, _ in other_pairs])[rooms]
+        for keys in set(loot_keys.values()):
+            mask = room_keys == keys
+            results[keys] += np.bincount(run_idx[mask], 16 * multipliers[mask] * catches[mask], minlength=n_runs).astype(np.int64)
+
+    # Target Ultimate room: 4 leaping lavish hunts, 20 royal hunts, 19 hunts of chase, then the boss
+    multiplier = denom_mults[pairs[target][1]]
+    target_key = loot_keys[target_loot]
+    results["harps_spent"] += 64 * multiplier
+    lavish_catches = lavish.catch_counts(rng, n_runs, 4, antithetic)
+    royal_catches = royal.catch_counts(rng, n_runs, 20, antithetic)
+    chase_catches = royal.catch_counts(rng, n_runs, 19, antithetic)
+    results[target_key] += 16 * multiplier * lavish_catches
+    results[target_key] += 1024 * royal_catches # 16 from cheese, 2 from CC, 4 from feather and quill
+    results[target_key] += 2048 * chase_catches
+    boss_attempts = _geometric_attempts(antithetic_uniforms(rng, n_runs, antithetic), boss.catch[0])
+    results[target_key] += 2048
+    for keys, vals in boss_reward.items():
+        results[keys] += vals
+
+    if controls is not None:
+        p_other = 1 - probs[pairs[target]]
+        controls["rooms"] = n_rooms - 1 / probs[pairs[target]]
+        controls["lavish_catches"] = lavish_catches - 4 * lavish.p_catch
+        controls["royal_catches"] = royal_catches - 20 * royal.p_catch
+        controls["chase_catches"] = chase_catches - 19 * royal.p_catch
+        controls["boss_attempts"] = boss_attempts - 1 / boss.catch[0]
+        # Sums over the other rooms, minus their expected value given the number of rooms: the multipliers
+        # (harps spent) and the multipliers times lavish catches of each loot key (loot)
+        if other_pairs:
+            drawn = len(run_idx) > 0
+            mean_multi = np.dot(other_probs, [denom_mults[idx] for _, idx in other_pairs]) / p_other
+            controls["multipliers"] = (harps_spent / 64 if drawn else 0) - (n_rooms - 1) * mean_multi
+            for keys in dict.fromkeys(loot_keys.values()):
+                mean_loot = 4 * lavish.p_catch * sum(p * denom_mults[idx] for (room, idx), p in zip(other_pairs, other_probs)
+                                                     if loot_keys[room] == keys) / p_other
+                room_loot = np.bincount(run_idx, np.where(room_keys == keys, multipliers * catches, 0), minlength=n_runs) if drawn else 0
+                controls[f"loot_{keys}"] = room_loot - (n_rooms - 1) * mean_loot
+
+    results["llavi"] += 4 * n_rooms
+    results["royal"] += 39 + boss_attempts
+    results["hunts"] = results["llavi"] + results["royal"]
+    if instrument.enabled:
+        instrument.count("hunts", np.sum(results["hunts"]), "farm_batch")
+        instrument.count("runs", n_runs, "farm_batch")
+        instrument.count("rooms", np.sum(n_rooms), "farm_batch")
+        instrument.count("boss_attempts", np.sum(boss_attempts), "farm_batch")
+    return results
+
+# Dungeon Room 1 Retreat parameters
+DUNGEON_R1R_PARAMS = dict(
+    room_types = ["lavish", "magic", "mysteries"],
+    room_probs = [0.706, 0.152, 0.141],
+    room_dicts = {
+        "lavish": [0.043, 0.261, 0.272, 0.130],
+        "magic": [0.065, 0.043, 0.022, 0.022],
+        "mysteries": [0.087, 0.054, 0.0, 0.0]},
+    denom_names = ["Standard", "Super", "Extreme", "Ultimate"],
+    denom_mults = [1, 2, 4, 8],
+    loot_keys = {"lavish": "lbean", "magic": "mbean", "mysteries": "mysts"},
+    boss_reward = {"mbean": 20, "ferts": 5},
+    noise_cap = 200)
+
+# Dungeon Ultimate Target Farming parameters
+DUNGEON_FARM_PARAMS = dict(
+    room_types = ["lavish", "magic", "mysteries"],
+    room_probs = [0.861, 0.093, 0.046],
+    room_dicts = {
+        "lavish": [0.287, 0.441, 0.133],
+        "magic": [0.062, 0.022, 0.009],
+        "mysteries": [0.037, 0.009, 0.0]},
+    denom_names = ["Super", "Extreme", "Ultimate"],
+    denom_mults = [2, 4, 8],
+    loot_keys = {"lavish": "lbean", "magic": "mbean", "mysteries": "mysts"},
+    boss_reward = {"mbean": 20, "ferts": 5})
+
+# Ballroom Room 1 Retreat parameters
+BALLROOM_R1R_PARAMS = dict(
+    room_types = ["royal", "harps", "mysteries"],
+    room_probs = [0.672, 0.184, 0.144],
+    room_dicts = {
+        "royal": [0.070, 0.334, 0.201, 0.067],
+        "harps": [0.070, 0.054, 0.070, 0.023],
+        "mysteries": [0.057, 0.020, 0.017, 0.017]},
+    denom_names = ["Standard", "Super", "Extreme", "Ultimate"],
+    denom_mults = [1, 2, 4, 8],
+    loot_keys = {"royal": "rbean", "harps": "harps", "mysteries": "mysts"},
+    boss_reward = {"ferts": 20},
+    noise_cap = 400)
+
+# Ballroom Ultimate Target Farming parameters
+BALLROOM_FARM_PARAMS = dict(
+    room_types = ["royal", "harps", "mysteries"],
+    room_probs = [0.509, 0.359, 0.132],
+    room_dicts = {
+        "royal": [0.417,0.250,0.083],
+        "harps": [0.067,0.088,0.029],
+        "mysteries": [0.025,0.021,0.020]},
+    denom_names = ["Super", "Extreme", "Ultimate"],
+    denom_mults = [2, 4, 8],
+    loot_keys = {"royal": "rbean", "harps": "harps", "mysteries": "mysts"},
+    boss_reward = {"ferts": 20})
+
 # Simulator for Dungeon
-def simulate_dungeon(trap_power: int, trap_luck: int, use_ref: bool, target_loot: Optional[str]=None, n_runs: int=1000) -> SimResult:
+def simulate_dungeon(trap_power: int, trap_luck: int, use_ref: bool, target_loot: Optional[str]=None, n_runs: int=1000, rng: Union[int, np.random.Generator, None]=None,
+                    variance_reduction: bool=False) -> SimResult:
     # Fetch mice data
     mice = MiceData()
-    
-    # Initialize results dictionary
-    results = {
-        "hunts": [], "lbean": [], "mbean": [], "mysts": [], "ferts": [],
-        "bster": [], "llavi": [], "royal": [], "noise": [], "harps_spent": []}
-
-    # Room 1 Retreat parameter
-    r1r_params = dict(
-        room_types = ["lavish", "magic", "mysteries"],
-        room_probs = [0.706, 0.152, 0.141],
-        room_dicts = {
-            "lavish": [0.043, 0.261, 0.272, 0.130],
-            "magic": [0.065, 0.043, 0.022, 0.022],
-            "mysteries": [0.087, 0.054, 0.0, 0.0]},
-        denom_names = ["Standard", "Super", "Extreme", "Ultimate"],
-        denom_mults = [1, 2, 4, 8],
-        loot_keys = {"lavish": "lbean", "magic": "mbean", "mysteries": "mysts"},
-        boss_reward = {"mbean": 20, "ferts": 5},
-        noise_cap = 200)
-    
-    # Ultimate Target Farming parameter
-    farm_params = dict(
-        room_types = ["lavish", "magic", "mysteries"],
-        room_probs = [0.861, 0.093, 0.046],
-        room_dicts = {
-            "lavish": [0.287, 0.441, 0.133],
-            "magic": [0.062, 0.022, 0.009],
-            "mysteries": [0.037, 0.009, 0.0]},
-        denom_names = ["Super", "Extreme", "Ultimate"],
-        denom_mults = [2, 4, 8],
-        loot_keys = {"lavish": "lbean", "magic": "mbean", "mysteries": "mysts"},
-        boss_reward = {"mbean": 20, "ferts": 5})
-
-    # Simulate run
-    for i in range(n_runs):
-        if target_loot is None:
-            # Default to R1R
-            run_loot = simulate_r1r(mice, trap_power, trap_luck, **r1r_params, zone = "Dungeon")
-        else:
-            # Find ultimate target room to farm
-            run_loot = simulate_farm(mice, trap_power, trap_luck, **farm_params, target_loot = target_loot, zone = "Dungeon")
-    
-        # Double ferts if using refractor base
-        if use_ref:
-            run_loot["ferts"] *= 2
-
-        # Append results
-        results["hunts"].append(run_loot.get("hunts"))
-        for keys, vals in run_loot.items():
-            results.setdefault(keys, []).append(vals)
-
-    return SimResult(results["hunts"], {keys: results[keys] for keys in results if keys != "hunts"})
+    controls = {} if variance_reduction else None
+
+    # Find ultimate target rooms to farm, or default to R1R, for all runs at once
+    if target_loot is not None:
+        batch = simulate_farm_batch(mice, trap_power, trap_luck, **DUNGEON_FARM_PARAMS, target_loot=target_loot, zone="Dungeon", n_runs=n_runs, rng=rng,
+                                    antithetic=variance_reduction, controls=controls)
+    else:
+        batch = simulate_r1r_batch(mice, trap_power, trap_luck, **DUNGEON_R1R_PARAMS, zone="Dungeon", n_runs=n_runs, rng=rng,
+                                   antithetic=variance_reduction, controls=controls)
+    hunts = batch.pop("hunts")
+    # Double ferts if using refractor base
+    if use_ref:
+        batch["ferts"] *= 2
+    return SimResult(hunts, batch, controls or {}, paired=variance_reduction)
 
 # Simulator for Ballroom
-def simulate_ballroom(trap_power: int, trap_luck: int, use_ref: bool, target_loot: Optional[str]=None, n_runs: int=1000) -> SimResult:
+def simulate_ballroom(trap_power: int, trap_luck: int, use_ref: bool, target_loot: Optional[str]=None, n_runs: int=1000, rng: Union[int, np.random.Generator, None]=None,
+                    variance_reduction: bool=False) -> SimResult:
     # Fetch mice data
     mice = MiceData()
-
-    # Initialize results dictionary
-    results = {
-        "hunts": [], "rbean": [], "harps": [], "mysts": [], "ferts": [],
-        "bster": [], "llavi": [], "royal": [], "noise": [], "harps_spent": []}
-
-    # Room 1 Retreat parameters
-    r1r_params = dict(
-        room_types = ["royal", "harps", "mysteries"],
-        room_probs = [0.672, 0.184, 0.144],
-        room_dicts = {
-            "royal": [0.070, 0.334, 0.201, 0.067],
-            "harps": [0.070, 0.054, 0.070, 0.023],
-            "mysteries": [0.057, 0.020, 0.017, 0.017]},
-        denom_names = ["Standard", "Super", "Extreme", "Ultimate"],
-        denom_mults = [1, 2, 4, 8],
-        loot_keys = {"royal": "rbean", "harps": "harps", "mysteries": "mysts"},
-        boss_reward = {"ferts": 20},
-        noise_cap = 400)
-    
-    # Ultimate Target Farming parameters
-    farm_params = dict(
-        room_types = ["royal", "harps", "mysteries"],
-        room_probs = [0.509, 0.359, 0.132],
-        room_dicts = {
-            "royal": [0.417,0.250,0.083],
-            "harps": [0.067,0.088,0.029],
-            "mysteries": [0.025,0.021,0.020]},
-        denom_names = ["Super", "Extreme", "Ultimate"],
-        denom_mults = [2, 4, 8],
-        loot_keys = {"royal": "rbean", "harps": "harps", "mysteries": "mysts"},
-        boss_reward = {"ferts": 20})
-    
-    # Simulate runs
-    for _ in range(n_runs):
-        if target_loot is None:
-            # Default to R1R
-            run_loot = simulate_r1r(mice, trap_power, trap_luck, **r1r_params, zone = "Ballroom")
-        else:
-            # Find ultimate target room to farm
-            run_loot = simulate_farm(mice, trap_power, trap_luck, **farm_params, target_loot = target_loot, zone = "Ballroom")
-    
-        # Double ferts if using refractor base
-        if use_ref:
-            run_loot["ferts"] *= 2
-
-        # Append results
-        results["hunts"].append(run_loot.get("hunts"))
-        for keys, vals in run_loot.items():
-            results.setdefault(keys, []).append(vals)
-
-    return SimResult(results["hunts"], {keys: results[keys] for keys in results if keys != "hunts"})
+    controls = {} if variance_reduction else None
+
+    # Find ultimate target rooms to farm, or default to R1R, for all runs at once
+    if target_loot is not None:
+        batch = simulate_farm_batch(mice, trap_power, trap_luck, **BALLROOM_FARM_PARAMS, target_loot=target_loot, zone="Ballroom", n_runs=n_runs, rng=rng,
+                                    antithetic=variance_reduction, controls=controls)
+    else:
+        batch = simulate_r1r_batch(mice, trap_power, trap_luck, **BALLROOM_R1R_PARAMS, zone="Ballroom", n_runs=n_runs, rng=rng,
+                                   antithetic=variance_reduction, controls=controls)
+    hunts = batch.pop("hunts")
+    # Double ferts if using refractor base
+    if use_ref:
+        batch["ferts"] *= 2
+    return SimResult(hunts, batch, controls or {}, paired=variance_reduction)
 
 # Simulator for Great Hall
-def simulate_greathall(trap_power: int, trap_luck: int, use_ref: bool, n_runs: int=1000) -> SimResult:
+def simulate_greathall(trap_power: int, trap_luck: int, use_ref: bool, n_runs: int=1000, rng: Union[int, np.random.Generator, None]=None,
+                       variance_reduction: bool=False) -> SimResult:
     # Fetch mice data
     mice = MiceData()
+    controls = {} if variance_reduction else None
+
+    # Loop until boss caught (i.e. ultimate room found and completed), a single room type whose denominations are the rooms
+    batch = simulate_farm_batch(mice, trap_power, trap_luck,
+                                room_types=["geggs"], room_probs=[1.0], room_dicts={"geggs": GREATHALL_ROOMS["room_probs"]},
+                                denom_names=GREATHALL_ROOMS["room_types"],
+                                denom_mults=[GREATHALL_ROOMS["room_multi"][room] for room in GREATHALL_ROOMS["room_types"]],
+                                loot_keys={"geggs": "geggs"},
+                                boss_reward={"mbean": 100, "lbean": 100, "rbean": 100}, # 10 ferts disabled as fert from MGK is not guaranteed
+                                target_loot="geggs", zone="Great Hall", n_runs=n_runs, rng=rng,
+                                antithetic=variance_reduction, controls=controls)
+
+    # Double ferts if using refractor base
+    if use_ref:
+        batch["ferts"] *= 2
+
+    keys = ["mbean", "lbean", "rbean", "geggs", "ferts", "llavi", "royal", "noise", "harps_spent"]
+    return SimResult(batch["hunts"], {k: batch[k] for k in keys}, controls or {}, paired=variance_reduction)
+
+# Stages of a chain with the simulator and target loot used to precompute each of them
+STAGES = {
+    "Beanstalk": ("beanstalk", None),
+    "Dungeon (R1R)": ("dungeon", None),
+    "Ballroom (R1R)": ("ballroom", None),
+    "Dungeon (Lapis)": ("dungeon", "lavish"),
+    "Dungeon (Magic)": ("dungeon", "magic"),
+    "Ballroom (Royal)": ("ballroom", "royal"),
+    "Ballroom (Harps)": ("ballroom", "harps"),
+    "Great Hall": ("greathall", None)}
+
+# Simulator and its leading arguments for a stage
+def _stage_simulator(stage: str, trap_power: int, trap_luck: int, use_ref: bool) -> Tuple[Callable[..., SimResult], tuple]:
+    zone, target_loot = STAGES[stage]
+    if zone == "beanstalk":
+        return simulate_beanstalk, (trap_power, trap_luck, use_ref)
+    elif zone == "dungeon":
+        return simulate_dungeon, (trap_power, trap_luck, use_ref, target_loot)
+    elif zone == "ballroom":
+        return simulate_ballroom, (trap_power, trap_luck, use_ref, target_loot)
+    return simulate_greathall, (trap_power, trap_luck, use_ref)
+
+# Runs per shard of a parallel simulation: the default 1000 runs make 8 shards per stage to spread over the cores,
+# each still large enough for the batch simulators to amortize the cost of sending it to a worker
+SHARD_SIZE = 125
+
+# Simulate every stage in shards of its own random stream, all shards of all stages going to one pool
+def simulate_stages(trap_power: int, trap_luck: int, use_ref: bool, n_runs: int = 1000,
+                    seed: Union[int, np.random.Generator, None] = None, workers: Optional[int] = 1,
+                    executor: Optional[Executor] = None, shard_size: int = SHARD_SIZE,
+                    variance_reduction: bool = False) -> Dict[str, SimResult]:
+    streams = np.random.default_rng(seed).spawn(len(STAGES))
+    stage_shards = {stage: _make_shards(*_stage_simulator(stage, trap_power, trap_luck, use_ref), n_runs, shard_size, stream,
+                                        variance_reduction=variance_reduction)
+                    for stage, stream in zip(STAGES, streams)}
+    shards = [shard for stage_shard in stage_shards.values() for shard in stage_shard]
+    results = iter(_map_shards(shards, workers, executor))
+    return {stage: merge_results(*[next(results) for _ in stage_shard]) for stage, stage_shard in stage_shards.items()}
+
+# Simulate every stage for several trap setups with common random numbers
+# All setups share the seed, so every stage sees the same room rolls, catch uniforms and boss uniforms in each of them:
+# the batch simulators draw as many uniforms whatever the setup, and catches and boss fights invert the same uniforms
+# Returns, per stage and per loot key, the mean of every setup and its paired difference to the first one with its standard error,
+# next to the standard error two independent simulations would have
+def compare_setups(setups: List[Tuple[int, int, bool]], n_runs: int = 1000,
+                   seed: Union[int, np.random.Generator, None] = None, workers: Optional[int] = 1,
+                   executor: Optional[Executor] = None) -> Dict[str, Dict[str, Dict[str, List[float]]]]:
+    seed = int(np.random.default_rng(seed).integers(2**63))
+    results = [simulate_stages(trap_power, trap_luck, use_ref, n_runs, seed, workers=workers, executor=executor)
+               for trap_power, trap_luck, use_ref in setups]
+    comparison = {}
+    for stage in STAGES:
+        columns = [result[stage].columns() for result in results]
+        comparison[stage] = {}
+        for keys in dict.fromkeys(keys for cols in columns for keys in cols):
+            vals = [cols.get(keys, np.zeros(n_runs, dtype=RESULT_DTYPE)).astype(np.float64) for cols in columns]
+            base = vals[0]
+            comparison[stage][keys] = {
+                "mean": [float(np.mean(v)) for v in vals],
+                "diff": [float(np.mean(v - base)) for v in vals],
+                "se": [float(np.std(v - base, ddof=1) / math.sqrt(n_runs)) for v in vals],
+                "se_independent": [float(math.sqrt((np.var(v, ddof=1) + np.var(base, ddof=1)) / n_runs)) for v in vals]}
+    return comparison
+
+# Expected loot of a Room 1 Retreat run
+def _expected_r1r(tables: Dict[Tuple[str, str], MouseTable], room_types: List[str], room_probs: List[float],
+                  room_dicts: Dict[str, List[float]], denom_names: List[str], denom_mults: List[int],
+                  loot_keys: Dict[str, str], boss_reward: Dict[str, int], noise_cap: int, zone: str) -> Dict[str, float]:
+    p_lavish = tables[("Lavish", zone)].p_catch
+    p_beanster = tables[("Beanster", zone)].p_catch
+    boss_attempts = 1 / tables[("Boss", zone)].catch[0]
+
+    results = {keys: 0.0 for keys in ["mbean", "lbean", "rbean", "harps", "mysts", "ferts", "bster", "llavi", "royal", "noise", "harps_spent"]}
+    results["llavi"] = 4
+    results["bster"] = 19 + boss_attempts
+    for (room, idx), p in _room_denom_probs(room_types, room_probs, room_dicts).items():
+        multiplier = denom_mults[idx]
+        results["noise"] += p * 16 * multiplier
+        # 4 per lavish catch, 2 per beanster catch and 2 from the boss
+        results[loot_keys[room]] += p * multiplier * (16 * p_lavish + 38 * p_beanster + 2)
+    results["harps_spent"] = noise_cap - results["noise"]
+    for keys, vals in boss_reward.items():
+        results[keys] += vals
+    results["hunts"] = 23 + boss_attempts
+    return results
 
-    # Initialize results dictionary
-    results = {
-        "hunts": [], "mbean": [], "lbean": [], "rbean": [],
-        "geggs": [], "ferts": [], "llavi": [], "royal": [],
-        "noise": [], "harps_spent": []}
-
-    # Room setup (always use key in Great Hall)
-    room_types = ["Super", "Extreme", "Ultimate"]
-    room_probs = [0.580, 0.245, 0.175]
-    room_multi = {"Super": 2, "Extreme": 4, "Ultimate": 8}
-
-    for _ in range(n_runs):
-        run_loot = {keys: 0 for keys in results if keys != "hunts"}
-        hunts = 0
-        boss_caught = False
-
-        # Loop until boss caught (i.e. ultimate room found and completed)
-        while not boss_caught:
-            # Pick a room
-            denom = np.random.choice(room_types, p=np.array(room_probs)/sum(room_probs))
-            room_multiplier = room_multi[denom]
-
-            # Leaping lavish cheese for 4 hunts
-            for _ in range(4):
-                hunts += 1
-                run_loot["llavi"] += 1
-                run_loot["noise"] += 16 * room_multiplier # 4 from (leaping) lavish, 4 from feather and quill
-                m_pow, m_eff, _ = mice.get_mouse("Lavish", "Great Hall")
-                if random.random() < mice.catch_rate(trap_power, trap_luck, m_pow, m_eff):
-                    run_loot["geggs"] += 16 * room_multiplier
-            
-            # Reduce noise with harps
-            run_loot["harps_spent"] += run_loot["noise"]
-            run_loot["noise"] = 0
-
-            # If Ultimate room, do 20 hunts with royal cheese, 20 hunts of chase, then boss
-            if denom == "Ultimate":
-                # 20 hunts with royal cheese
-                for _ in range(20):
-                    hunts += 1
-                    run_loot["royal"] += 1
-                    m_pow, m_eff, _ = mice.get_mouse("Royal", "Great Hall")
-                    if random.random() < mice.catch_rate(trap_power, trap_luck, m_pow, m_eff):
-                        run_loot["geggs"] += 1024
-                
-                # Giant chase: another 19 hunts with royal cheese
-                for _ in range(19):
-                    hunts += 1
-                    run_loot["royal"] += 1
-                    m_pow, m_eff, _ = mice.get_mouse("Royal", "Great Hall")
-                    if random.random() < mice.catch_rate(trap_power, trap_luck, m_pow, m_eff):
-                        run_loot["geggs"] += 2048
-
-                # Boss fight
-                boss = mice.get_boss("Great Hall")
-                while not boss_caught:
-                    hunts += 1
-                    run_loot["royal"] += 1
-                    if random.random() < mice.catch_rate(trap_power, trap_luck, boss["powers"][0], boss["effects"][0]):
-                        run_loot["mbean"] += 100
-                        run_loot["lbean"] += 100
-                        run_loot["rbean"] += 100
-                        #run_loot["ferts"] += 10 # Disabled as fert from MGK is not guaranteed
-                        run_loot["geggs"] += 2048
-                        boss_caught = True
-
-        # Double ferts if using refractor base
-        if use_ref:
-            run_loot["ferts"] *= 2
-
-        # Append results
-        results["hunts"].append(run_loot.get("hunts", hunts))
-        for keys, vals in run_loot.items():
-            results.setdefault(keys, []).append(vals)
-
-    return SimResult(results["hunts"], {keys: results[keys] for keys in results if keys != "hunts"})
-
-# Plan a chain of stages
-def plan_chain(trap_power: int, trap_luck: int, use_ref: bool, target_eggs: int, inventory: Dict[str, int]) -> List[Dict[str, int]]:
-    # Precompute average runs for each stage
-    beanstalk = simulate_beanstalk(trap_power, trap_luck, use_ref, 1000)
-    r1r_dungeon = simulate_dungeon(trap_power, trap_luck, use_ref, None, 1000)
-    r1r_ballroom = simulate_ballroom(trap_power, trap_luck, use_ref, None, 1000)
-    lbean_farm = simulate_dungeon(trap_power, trap_luck, use_ref, "lavish", 1000)
-    mbean_farm = simulate_dungeon(trap_power, trap_luck, use_ref, "magic", 1000)
-    rbean_farm = simulate_ballroom(trap_power, trap_luck, use_ref, "royal", 1000)
-    harps_farm = simulate_ballroom(trap_power, trap_luck, use_ref, "harps", 1000)
-    run_greathall = simulate_greathall(trap_power, trap_luck, use_ref, 1000)
-
-    # Store precomputed average
-    avg_beanstalk = beanstalk.mean()
-    avg_r1r_dungeon = r1r_dungeon.mean()
-    avg_r1r_ballroom = r1r_ballroom.mean()
-    avg_lbean_farm = lbean_farm.mean()
-    avg_mbean_farm = mbean_farm.mean()
-    avg_rbean_farm = rbean_farm.mean()
-    avg_harps_farm = harps_farm.mean()
-    avg_run_greathall = run_greathall.mean()
-
-    # Print out averages for reference
-    precomp = {
-        "Beanstalk": avg_beanstalk,
-        "Dungeon (R1R)": avg_r1r_dungeon,
-        "Ballroom (R1R)": avg_r1r_ballroom,
-        "Dungeon (Lapis)": avg_lbean_farm,
-        "Dungeon (Magic)": avg_mbean_farm,
-        "Ballroom (Royal)": avg_rbean_farm,
-        "Ballroom (Harps)": avg_harps_farm,
-        "Great Hall": avg_run_greathall}
+# Expected loot of farming rooms until the Ultimate room of the target loot
+def _expected_farm(tables: Dict[Tuple[str, str], MouseTable], room_types: List[str], room_probs: List[float],
+                   room_dicts: Dict[str, List[float]], denom_names: List[str], denom_mults: List[int],
+                   loot_keys: Dict[str, str], boss_reward: Dict[str, int], target_loot: str, zone: str) -> Dict[str, float]:
+    p_lavish = tables[("Lavish", zone)].p_catch
+    p_royal = tables[("Royal", zone)].p_catch
+    boss_attempts = 1 / tables[("Boss", zone)].catch[0]
+    probs = _room_denom_probs(room_types, room_probs, room_dicts)
+
+    # The number of rooms is geometric, so by Wald's identity every room total is its per-room mean over p_target
+    p_target = probs[(target_loot, denom_names.index("Ultimate"))]
+    results = {keys: 0.0 for keys in ["mbean", "lbean", "rbean", "harps", "mysts", "ferts", "bster", "llavi", "royal", "noise", "harps_spent"]}
+    results["llavi"] = 4 / p_target
+    for (room, idx), p in probs.items():
+        multiplier = denom_mults[idx]
+        results["harps_spent"] += p * 64 * multiplier / p_target
+        results[loot_keys[room]] += p * 64 * multiplier * p_lavish / p_target
+
+    # Ultimate room: 20 royal hunts, 19 hunts of chase, then the boss
+    results["royal"] = 39 + boss_attempts
+    results[loot_keys[target_loot]] += 20 * 1024 * p_royal + 19 * 2048 * p_royal + 2048
+    for keys, vals in boss_reward.items():
+        results[keys] += vals
+    results["hunts"] = results["llavi"] + results["royal"]
+    return results
 
+# Exact average yield per run of every stage, computed from the catch rates without sampling
+def expected_yields(trap_power: int, trap_luck: int, use_ref: bool) -> Dict[str, Dict[str, float]]:
+    tables = MiceData().compile(trap_power, trap_luck)
+    precomp = {}
+
+    # Beanstalk: 20 hunts in a random room, then the boss
+    room_probs = BEANSTALK_ROOMS["room_probs"]
+    room_multi = [BEANSTALK_ROOMS["room_multi"][room] for room in BEANSTALK_ROOMS["room_types"]]
+    multiplier = sum(p * m for p, m in zip(room_probs, room_multi)) / sum(room_probs)
+    p_sb = tables[("SB", "Beanstalk")].p_catch
+    beanstalk = {keys: 0.0 for keys in LOOT_KEYS}
+    beanstalk["beans"] = 20 * p_sb * multiplier + multiplier + 20
+    beanstalk["ferts"] = 1
+    beanstalk["norms"] = 20 * p_sb
+    beanstalk["hunts"] = 20 + 1 / tables[("Boss", "Beanstalk")].catch[0]
+    precomp["Beanstalk"] = beanstalk
+
+    # Castle stages
+    params = {"dungeon": (DUNGEON_R1R_PARAMS, DUNGEON_FARM_PARAMS, "Dungeon"),
+              "ballroom": (BALLROOM_R1R_PARAMS, BALLROOM_FARM_PARAMS, "Ballroom")}
+    for stage, (zone, target_loot) in STAGES.items():
+        if zone in params:
+            r1r_params, farm_params, zone_name = params[zone]
+            if target_loot is None:
+                precomp[stage] = _expected_r1r(tables, **r1r_params, zone=zone_name)
+            else:
+                precomp[stage] = _expected_farm(tables, **farm_params, target_loot=target_loot, zone=zone_name)
+
+    # Great Hall: rooms until an Ultimate one, then 20 royal hunts, 19 hunts of chase and the boss
+    room_probs = GREATHALL_ROOMS["room_probs"]
+    room_multi = [GREATHALL_ROOMS["room_multi"][room] for room in GREATHALL_ROOMS["room_types"]]
+    p_ultimate = room_probs[GREATHALL_ROOMS["room_types"].index("Ultimate")] / sum(room_probs)
+    multiplier = sum(p * m for p, m in zip(room_probs, room_multi)) / sum(room_probs)
+    p_lavish = tables[("Lavish", "Great Hall")].p_catch
+    p_royal = tables[("Royal", "Great Hall")].p_catch
+    boss_attempts = 1 / tables[("Boss", "Great Hall")].catch[0]
+    greathall = {keys: 0.0 for keys in ["mbean", "lbean", "rbean", "geggs", "ferts", "llavi", "royal", "noise", "harps_spent"]}
+    greathall["mbean"] = greathall["lbean"] = greathall["rbean"] = 100
+    greathall["llavi"] = 4 / p_ultimate
+    greathall["royal"] = 39 + boss_attempts
+    greathall["harps_spent"] = 64 * multiplier / p_ultimate
+    greathall["geggs"] = 64 * multiplier * p_lavish / p_ultimate + 20 * 1024 * p_royal + 19 * 2048 * p_royal + 2048
+    greathall["hunts"] = greathall["llavi"] + greathall["royal"]
+    precomp["Great Hall"] = greathall
+
+    # Double ferts if using refractor base
+    if use_ref:
+        for loot in precomp.values():
+            loot["ferts"] *= 2
+
+    # Order the stages like the chain planner lists them
+    return {stage: precomp[stage] for stage in STAGES}
+
+# Print out averages for reference
+def print_precomp(precomp: Dict[str, Dict[str, float]]) -> None:
     print("\n========== Print Average Yield per Run ==========")
     header = f"{'Stage':17} | {'royal':5} | {'llavi':5} | {'bster':5} | {'mbean':5} | {'lbean':5} | {'rbean':5} | {'harps+':5} | {'harps-':5}"
     print(header)
@@ -604,161 +957,758 @@ def plan_chain(trap_power: int, trap_luck: int, use_ref: bool, target_eggs: int,
         harps_spent = int(loot.get("harps_spent", 0))
         print(f"{stage:17} | {royal:<5} | {llavi:<5} | {bster:<5} | {mbean:<5} | {lbean:<5} | {rbean:<5} | {harps:<5} | {harps_spent:<5}")    
 
-    # Setup initial inventory
-    inv = inventory.copy()
-    egg_count = inv.get("geggs", 0)
-    chain: List[Dict[str, int]] = []
-
-    # Fert costs
-    fert_costs = {"Dungeon": 1, "Ballroom": 12, "Great Hall": 100}
-
-    # Stage count
-    stage_counts = {}
+# Merge the results of several shards
+def merge_results(*results: SimResult) -> SimResult:
+    return SimResult.merge(*results)
+
+# Stage a simulator and its arguments run, or the simulator name when it is not one of STAGES
+def _stage_label(simulator: Callable[..., SimResult], args: tuple) -> str:
+    zone = simulator.__name__.replace("simulate_", "")
+    target_loot = args[3] if zone in ("dungeon", "ballroom") and len(args) > 3 else None
+    return next((stage for stage, vals in STAGES.items() if vals == (zone, target_loot)), simulator.__name__)
+
+# Run one shard of a parallel simulation
+def _run_shard(shard) -> SimResult:
+    simulator, args, n_runs, rng, kwargs = shard
+    if instrument.enabled:
+        with instrument.timed("stage", _stage_label(simulator, args)):
+            return simulator(*args, n_runs=n_runs, rng=rng, **kwargs)
+    return simulator(*args, n_runs=n_runs, rng=rng, **kwargs)
+
+# Run one shard in a worker process with instrumentation on, sending back what it recorded
+def _run_shard_instrumented(shard) -> Tuple[SimResult, tuple]:
+    return instrument.run_instrumented(_run_shard, shard)
+
+# Split the runs of a simulator into shards with child streams of seed, so results do not depend on the workers
+# With variance_reduction, shards hold an even number of runs so that pairs never straddle two of them
+def _make_shards(simulator: Callable[..., SimResult], args: tuple, n_runs: int, shard_size: int,
+                 seed: Union[int, np.random.Generator, None], **kwargs) -> List[tuple]:
+    if kwargs.get("variance_reduction"):
+        shard_size += shard_size % 2
+    n_shards = max(1, math.ceil(n_runs / shard_size))
+    streams = np.random.default_rng(seed).spawn(n_shards)
+    return [(simulator, args, min(shard_size, n_runs - i*shard_size), streams[i], kwargs) for i in range(n_shards)]
+
+# Run shards on the given executor, inline for a single worker, otherwise across a new process pool
+def _map_shards(shards: List[tuple], workers: Optional[int] = None, executor: Optional[Executor] = None) -> List[SimResult]:
+    # Worker processes send back what they recorded along with their results
+    if instrument.enabled and (executor is not None or workers != 1):
+        pool = executor if executor is not None else ProcessPoolExecutor(max_workers=workers)
+        try:
+            outputs = list(pool.map(_run_shard_instrumented, shards))
+        finally:
+            if executor is None:
+                pool.shutdown()
+        for _, snap in outputs:
+            instrument.merge(snap)
+        return [result for result, _ in outputs]
+    if executor is not None:
+        return list(executor.map(_run_shard, shards))
+    if workers == 1:
+        return [_run_shard(shard) for shard in shards]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_run_shard, shards))
+
+# Run a simulator across processes, in shards (see _make_shards)
+def run_parallel(simulator: Callable[..., SimResult], *args, n_runs: int = 1000, shard_size: int = SHARD_SIZE,
+                 workers: Optional[int] = None, seed: Union[int, np.random.Generator, None] = None,
+                 executor: Optional[Executor] = None) -> SimResult:
+    return merge_results(*_map_shards(_make_shards(simulator, args, n_runs, shard_size, seed), workers, executor))
+
+# Bump when a simulator changes how it samples, so that cached yields are not reused
+YIELD_CACHE_VERSION = 2
+
+# Hash of the mouse data and room parameters the stage simulators depend on
+def params_hash(mice: Optional[MiceData] = None) -> str:
+    mice = MiceData() if mice is None else mice
+    data = {"version": YIELD_CACHE_VERSION,
+            "mice": mice.db.content_hash,
+            "rooms": [BEANSTALK_ROOMS, GREATHALL_ROOMS, DUNGEON_R1R_PARAMS, DUNGEON_FARM_PARAMS, BALLROOM_R1R_PARAMS, BALLROOM_FARM_PARAMS],
+            "stages": STAGES}
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+# Persistent cache of Monte Carlo stage yield tables in SQLite, evicting the least recently used beyond max_entries
+class YieldCache:
+    def __init__(self, path: str, max_entries: int = 256):
+        self.path = path
+        self.max_entries = max_entries
+        self._hash = params_hash()
+        with contextlib.closing(sqlite3.connect(self.path)) as db, db:
+            db.execute("CREATE TABLE IF NOT EXISTS yields (key TEXT PRIMARY KEY, precomp TEXT NOT NULL, used INTEGER NOT NULL)")
+
+    # Cache key of a setup, None unless seeded with an int, as an unseeded or Generator run must draw fresh samples
+    def key(self, trap_power: int, trap_luck: int, use_ref: bool, n_runs: int,
+            seed: Union[int, np.random.Generator, None] = None, variance_reduction: bool = False) -> Optional[str]:
+        if not isinstance(seed, (int, np.integer)):
+            return None
+        return f"{trap_power}:{trap_luck}:{int(use_ref)}:{n_runs}:{seed}:{self._hash}" + (":vr" if variance_reduction else "")
+
+    def get(self, key: Optional[str]) -> Optional[Dict[str, Dict[str, float]]]:
+        if key is None:
+            return None
+        with contextlib.closing(sqlite3.connect(self.path)) as db, db:
+            row = db.execute("SELECT precomp FROM yields WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE yields SET used = (SELECT MAX(used) + 1 FROM yields) WHERE key = ?", (key,))
+        return json.loads(row[0])
+
+    def put(self, key: Optional[str], precomp: Dict[str, Dict[str, float]]) -> None:
+        if key is None:
+            return
+        with contextlib.closing(sqlite3.connect(self.path)) as db, db:
+            db.execute("INSERT OR REPLACE INTO yields VALUES (?, ?, (SELECT COALESCE(MAX(used), 0) + 1 FROM yields))",
+                       (key, json.dumps(precomp)))
+            db.execute("DELETE FROM yields WHERE key NOT IN (SELECT key FROM yields ORDER BY used DESC LIMIT ?)", (self.max_entries,))
+
+    def __len__(self) -> int:
+        with contextlib.closing(sqlite3.connect(self.path)) as db:
+            return db.execute("SELECT COUNT(*) FROM yields").fetchone()[0]
 
-    # Loop until target eggs reached
-    while egg_count < target_eggs:
-        stage = None
-        loot = None
-        fert_spent = 0
-
-        # Define threshold
-        threshold_harps = 15000
-        threshold_royal = 150
-        threshold_llavi = 250
-
-        # Threshold breakdown
-        # Royal beanster check
-        craftable_royal = min(inv["rbean"] // 128, inv["lbean"] // 64)
-        if craftable_royal > 0 and inv["royal"] < threshold_royal:
-            inv["royal"] += craftable_royal * 2
-            inv["rbean"] -= craftable_royal * 128
-            inv["lbean"] -= craftable_royal * 64
-        deficit_royal = max(threshold_royal - inv["royal"], 0)
-        deficit_royal_rbean = deficit_royal * 128
-        deficit_royal_lbean = deficit_royal * 64
-        # Leaping lavish beanster check
-        max_llavi_harps = max((inv["harps"] - threshold_harps) // 64, 0)
-        craftable_llavi = min(inv["lbean"] // 16, max_llavi_harps)
-        if craftable_llavi > 0 and inv["llavi"] < threshold_llavi:
-            inv["llavi"] += craftable_llavi * 2
-            inv["harps"] -= craftable_llavi * 64
-            inv["lbean"] -= craftable_llavi * 16
-        deficit_llavi = max(threshold_llavi - inv["llavi"], 0)
-        deficit_llavi_harps = deficit_llavi * 64
-        deficit_llavi_lbean = deficit_llavi * 16
-
-        # Farming run logic
-        # Check for royal beanster deficit
-        if inv["rbean"] < deficit_royal_rbean or inv["lbean"] < deficit_royal_lbean:
-            if inv["rbean"] < deficit_royal_rbean:
-                if inv["ferts"] < fert_costs["Dungeon"]:
-                    stage = "Beanstalk"
-                    loot = avg_beanstalk
-                    fert_spent = 0
-                elif inv["ferts"] < fert_costs["Ballroom"]:
-                    stage = "Dungeon (R1R)"
-                    loot = avg_r1r_dungeon
-                    fert_spent = fert_costs["Dungeon"]
-                else:
-                    stage = "Ballroom (Royal)"
-                    loot = avg_rbean_farm
-                    fert_spent = fert_costs["Ballroom"]
+# Plan a chain of stages
+def plan_chain(trap_power: int, trap_luck: int, use_ref: bool, target_eggs: int, inventory: Dict[str, int], verbose: bool = True,
+               seed: Union[int, np.random.Generator, None] = None, n_runs: Optional[int] = None,
+               workers: Optional[int] = 1, executor: Optional[Executor] = None,
+               cache: Optional[YieldCache] = None, threshold_harps: int = 15000, threshold_royal: int = 150,
+               threshold_llavi: int = 250, variance_reduction: bool = False) -> List[Dict[str, int]]:
+    return list(iter_chain(trap_power, trap_luck, use_ref, target_eggs, inventory, verbose, seed, n_runs, workers, executor, cache,
+                           threshold_harps=threshold_harps, threshold_royal=threshold_royal, threshold_llavi=threshold_llavi,
+                           variance_reduction=variance_reduction))
+
+# Fert cost of every stage
+STAGE_FERTS = {"Beanstalk": 0, "Dungeon (R1R)": 1, "Ballroom (R1R)": 12, "Dungeon (Lapis)": 1,
+               "Dungeon (Magic)": 1, "Ballroom (Royal)": 12, "Ballroom (Harps)": 12, "Great Hall": 100}
+
+# Fert cost of entering each zone, the one the stage choice checks
+ZONE_FERTS = {"Dungeon": STAGE_FERTS["Dungeon (R1R)"], "Ballroom": STAGE_FERTS["Ballroom (R1R)"], "Great Hall": STAGE_FERTS["Great Hall"]}
+
+# Index of every stage in STAGES and its fert cost in that order, for the vectorized policy
+STAGE_INDEX = {stage: idx for idx, stage in enumerate(STAGES)}
+STAGE_FERT_COSTS = np.array([STAGE_FERTS[stage] for stage in STAGES])
+
+# Pick the next stage for an inventory, crafting cheese in place first
+# Also returns the outcome of every comparison the choice depends on. Each is a linear comparison, or a
+# floor of a linear function, of the inventory, so it can change at most once along a linear drift of it
+def _choose_stage(inv: Dict[str, int], threshold_harps: int, threshold_royal: int, threshold_llavi: int) -> Tuple[str, tuple]:
+    fert_costs = ZONE_FERTS
+
+    # Threshold breakdown
+    # Royal beanster check
+    craftable_royal = min(inv["rbean"] // 128, inv["lbean"] // 64)
+    if craftable_royal > 0 and inv["royal"] < threshold_royal:
+        features = [(True, inv["rbean"] // 128, inv["lbean"] // 64)]
+        inv["royal"] += craftable_royal * 2
+        inv["rbean"] -= craftable_royal * 128
+        inv["lbean"] -= craftable_royal * 64
+    elif inv["royal"] < threshold_royal:
+        features = [(True, inv["rbean"] >= 128, inv["lbean"] >= 64)]
+    else:
+        features = [(False,)]
+    deficit_royal = max(threshold_royal - inv["royal"], 0)
+    deficit_royal_rbean = deficit_royal * 128
+    deficit_royal_lbean = deficit_royal * 64
+    features.append((inv["royal"] < threshold_royal, inv["rbean"] < deficit_royal_rbean, inv["lbean"] < deficit_royal_lbean))
+    # Leaping lavish beanster check
+    max_llavi_harps = max((inv["harps"] - threshold_harps) // 64, 0)
+    craftable_llavi = min(inv["lbean"] // 16, max_llavi_harps)
+    if craftable_llavi > 0 and inv["llavi"] < threshold_llavi:
+        features.append((True, (inv["harps"] - threshold_harps) // 64, inv["lbean"] // 16))
+        inv["llavi"] += craftable_llavi * 2
+        inv["harps"] -= craftable_llavi * 64
+        inv["lbean"] -= craftable_llavi * 16
+    elif inv["llavi"] < threshold_llavi:
+        features.append((True, inv["harps"] - threshold_harps >= 64, inv["lbean"] >= 16))
+    else:
+        features.append((False,))
+    deficit_llavi = max(threshold_llavi - inv["llavi"], 0)
+    deficit_llavi_harps = deficit_llavi * 64
+    deficit_llavi_lbean = deficit_llavi * 16
+    features.append((inv["llavi"] < threshold_llavi, inv["harps"] < deficit_llavi_harps, inv["lbean"] < deficit_llavi_lbean,
+                     inv["harps"] < threshold_harps, inv["ferts"] < fert_costs["Dungeon"],
+                     inv["ferts"] < fert_costs["Ballroom"], inv["ferts"] < fert_costs["Great Hall"]))
+
+    # Farming run logic
+    # Check for royal beanster deficit
+    if inv["rbean"] < deficit_royal_rbean or inv["lbean"] < deficit_royal_lbean:
+        if inv["rbean"] < deficit_royal_rbean:
+            if inv["ferts"] < fert_costs["Dungeon"]:
+                stage = "Beanstalk"
+            elif inv["ferts"] < fert_costs["Ballroom"]:
+                stage = "Dungeon (R1R)"
             else:
-                if inv["ferts"] < fert_costs["Dungeon"]:
-                    stage = "Beanstalk"
-                    loot = avg_beanstalk
-                    fert_spent = 0
-                else:
-                    stage = "Dungeon (Lapis)"
-                    loot = avg_lbean_farm
-                    fert_spent = fert_costs["Dungeon"]
-        # Check for leaping lavish beanster deficit
-        elif inv["harps"] < deficit_llavi_harps or inv["lbean"] < deficit_llavi_lbean:
-            if inv["harps"] < deficit_llavi_harps:
-                if inv["ferts"] < fert_costs["Dungeon"]:
-                    stage = "Beanstalk"
-                    loot = avg_beanstalk
-                    fert_spent = 0
-                elif inv["ferts"] < fert_costs["Ballroom"]:
-                    stage = "Dungeon (R1R)"
-                    loot = avg_r1r_dungeon
-                    fert_spent = fert_costs["Dungeon"]
-                else:
-                    stage = "Ballroom (Harps)"
-                    loot = avg_harps_farm
-                    fert_spent = fert_costs["Ballroom"]
+                stage = "Ballroom (Royal)"
+        else:
+            if inv["ferts"] < fert_costs["Dungeon"]:
+                stage = "Beanstalk"
             else:
-                if inv["ferts"] < fert_costs["Dungeon"]:
-                    stage = "Beanstalk"
-                    loot = avg_beanstalk
-                    fert_spent = 0
-                else:
-                    stage = "Dungeon (Lapis)"
-                    loot = avg_lbean_farm
-                    fert_spent = fert_costs["Dungeon"]
-        # Check for harps
-        elif inv["harps"] < threshold_harps:
+                stage = "Dungeon (Lapis)"
+    # Check for leaping lavish beanster deficit
+    elif inv["harps"] < deficit_llavi_harps or inv["lbean"] < deficit_llavi_lbean:
+        if inv["harps"] < deficit_llavi_harps:
             if inv["ferts"] < fert_costs["Dungeon"]:
                 stage = "Beanstalk"
-                loot = avg_beanstalk
-                fert_spent = 0
             elif inv["ferts"] < fert_costs["Ballroom"]:
                 stage = "Dungeon (R1R)"
-                loot = avg_r1r_dungeon
-                fert_spent = fert_costs["Dungeon"]
             else:
                 stage = "Ballroom (Harps)"
-                loot = avg_harps_farm
-                fert_spent = fert_costs["Ballroom"]
-        # If we have enough resources, go to Greathall
         else:
             if inv["ferts"] < fert_costs["Dungeon"]:
                 stage = "Beanstalk"
-                loot = avg_beanstalk
-                fert_spent = 0
-            elif inv["ferts"] < fert_costs["Ballroom"]:
-                stage = "Dungeon (R1R)"
-                loot = avg_r1r_dungeon
-                fert_spent = fert_costs["Dungeon"]
-            elif inv["ferts"] < fert_costs["Great Hall"]:
-                stage = "Ballroom (R1R)"
-                loot = avg_r1r_ballroom
-                fert_spent = fert_costs["Ballroom"]
             else:
-                stage = "Great Hall"
-                loot = avg_run_greathall
-                fert_spent = fert_costs["Great Hall"]
+                stage = "Dungeon (Lapis)"
+    # Check for harps
+    elif inv["harps"] < threshold_harps:
+        if inv["ferts"] < fert_costs["Dungeon"]:
+            stage = "Beanstalk"
+        elif inv["ferts"] < fert_costs["Ballroom"]:
+            stage = "Dungeon (R1R)"
+        else:
+            stage = "Ballroom (Harps)"
+    # If we have enough resources, go to Greathall
+    else:
+        if inv["ferts"] < fert_costs["Dungeon"]:
+            stage = "Beanstalk"
+        elif inv["ferts"] < fert_costs["Ballroom"]:
+            stage = "Dungeon (R1R)"
+        elif inv["ferts"] < fert_costs["Great Hall"]:
+            stage = "Ballroom (R1R)"
+        else:
+            stage = "Great Hall"
+
+    return stage, tuple(features)
+
+# A cycle of chain steps repeated more times, each repeat shifting inventory, eggs and stage counts by the same deltas
+@dataclass
+class ChainCycle:
+    steps: List[Dict]
+    repeats: int
+    delta: Dict[str, int]
+    eggs: int
+    counts: Dict[str, int]
+
+    # Step j of repeat c (1 to repeats)
+    def step(self, c: int, j: int) -> Dict:
+        base = self.steps[j]
+        return {**base, "eggs": base["eggs"] + c * self.eggs,
+                "inv": {keys: base["inv"].get(keys, 0) + c * vals for keys, vals in self.delta.items()},
+                "summary": {stage: base["summary"].get(stage, 0) + c * self.counts.get(stage, 0) for stage in self.steps[-1]["summary"]}}
+
+    def __iter__(self) -> Iterator[Dict]:
+        for c in range(1, self.repeats + 1):
+            for j in range(len(self.steps)):
+                yield self.step(c, j)
+
+    def __len__(self) -> int:
+        return self.repeats * len(self.steps)
+
+# Longest cycle of stages looked for when fast-forwarding
+MAX_CYCLE = 32
+
+# Stages in a row without an egg after which a chain is given up as unable to reach its target
+MAX_IDLE_STAGES = 10000
+
+# Number of further repeats of a cycle that provably make the same choices as its last pass
+# Every comparison the choices depend on changes at most once along the drift, so checking the last repeat is enough
+def _cycle_repeats(history: List[tuple], delta: Dict[str, int], egg_count: int, eggs: int, target_eggs: int,
+                   thresholds: Tuple[int, int, int]) -> int:
+    if eggs <= 0:
+        return 0
+    # Every skipped repeat must still start below the target
+    max_repeats = (target_eggs - 1 - egg_count) // eggs
+
+    def valid(c: int) -> bool:
+        for _, features, pre_inv in history:
+            inv = {keys: pre_inv.get(keys, 0) + c * vals for keys, vals in delta.items()}
+            if _choose_stage(inv, *thresholds)[1] != features:
+                return False
+        return True
+
+    # Gallop up to the first failing count, then bisect
+    lo, hi = 0, 1
+    while hi <= max_repeats and valid(hi):
+        lo, hi = hi, hi * 2
+    hi = min(hi, max_repeats + 1)
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if valid(mid):
+            lo = mid
+        else:
+            hi = mid
+    return lo
+
+# Monte Carlo average yield of every stage over n_runs runs with its standard error, {stage: {key: (mean, se)}}
+# With variance_reduction, runs come in antithetic pairs and the averages are corrected by control variates
+def stage_estimates(trap_power: int, trap_luck: int, use_ref: bool, n_runs: int = 1000,
+                    seed: Union[int, np.random.Generator, None] = None, workers: Optional[int] = 1,
+                    executor: Optional[Executor] = None, variance_reduction: bool = True) -> Dict[str, Dict[str, Tuple[float, float]]]:
+    stages = simulate_stages(trap_power, trap_luck, use_ref, n_runs, seed, workers=workers, executor=executor,
+                             variance_reduction=variance_reduction)
+    return {stage: result.estimate(variance_reduction) for stage, result in stages.items()}
+
+# Average yield of every stage: exact by default, or Monte Carlo averages over n_runs runs when n_runs is given,
+# simulated across workers processes or the given executor and looked up in cache first
+# With variance_reduction, the Monte Carlo averages come from stage_estimates
+def stage_yields(trap_power: int, trap_luck: int, use_ref: bool, n_runs: Optional[int] = None,
+                 seed: Union[int, np.random.Generator, None] = None, workers: Optional[int] = 1,
+                 executor: Optional[Executor] = None, cache: Optional[YieldCache] = None,
+                 variance_reduction: bool = False) -> Dict[str, Dict[str, float]]:
+    if n_runs is None:
+        return expected_yields(trap_power, trap_luck, use_ref)
+    key = None if cache is None else cache.key(trap_power, trap_luck, use_ref, n_runs, seed, variance_reduction)
+    precomp = None if cache is None else cache.get(key)
+    if precomp is None:
+        if variance_reduction:
+            estimates = stage_estimates(trap_power, trap_luck, use_ref, n_runs, seed, workers, executor)
+            precomp = {stage: {keys: mean for keys, (mean, _) in est.items()} for stage, est in estimates.items()}
+        else:
+            stages = simulate_stages(trap_power, trap_luck, use_ref, n_runs, seed, workers=workers, executor=executor)
+            precomp = {stage: result.mean() for stage, result in stages.items()}
+        if cache is not None:
+            cache.put(key, precomp)
+    return precomp
+
+# Yield the stages of a chain one at a time, each with the inventory and stage counts after it
+# Stage yields come from stage_yields, and cheese is crafted or farmed below the given thresholds
+# Once the stages repeat a cycle, as many repeats as provably unchanged are skipped in one jump; with
+# expand_cycles=False these are yielded as a single ChainCycle instead of step by step
+def iter_chain(trap_power: int, trap_luck: int, use_ref: bool, target_eggs: int, inventory: Dict[str, int], verbose: bool = True,
+               seed: Union[int, np.random.Generator, None] = None, n_runs: Optional[int] = None,
+               workers: Optional[int] = 1, executor: Optional[Executor] = None,
+               cache: Optional[YieldCache] = None, fast_forward: bool = True,
+               expand_cycles: bool = True, threshold_harps: int = 15000, threshold_royal: int = 150,
+               threshold_llavi: int = 250, variance_reduction: bool = False) -> Iterator[Union[Dict[str, int], ChainCycle]]:
+    # Precompute average runs for each stage
+    with instrument.timed("stage_yields"):
+        precomp = stage_yields(trap_power, trap_luck, use_ref, n_runs, seed, workers, executor, cache, variance_reduction)
+
+    # Print out averages for reference
+    if verbose:
+        print_precomp(precomp)
+
+    # Setup initial inventory
+    inv = inventory.copy()
+    egg_count = inv.get("geggs", 0)
+
+    # Define threshold
+    thresholds = (threshold_harps, threshold_royal, threshold_llavi)
+
+    # Stage count
+    stage_counts = {}
+
+    # Recent (stage, features, inventory before the stage) and steps, and where each (stage, features) was seen in them
+    history = []
+    steps = []
+    choices = []
+    seen = {}
+    n_seen = 0
+
+    # Whole loot of every stage, split into the cheese used, harps spent and loot gained
+    consumed = {"royal", "llavi"}
+    stage_loot = {}
+    for stage, loot in precomp.items():
+        stage_loot[stage] = ({keys: int(vals) for keys, vals in loot.items() if keys in consumed},
+                             int(loot.get("harps_spent", 0)),
+                             {keys: int(vals) for keys, vals in loot.items() if keys not in consumed and keys != "harps_spent" and keys != "hunts"},
+                             {keys: int(vals) for keys, vals in loot.items() if keys not in ("hunts", "harps_spent")})
+
+    # Stages since the last egg
+    idle_stages = 0
+
+    # Loop until target eggs reached
+    while egg_count < target_eggs:
+        pre_inv = inv.copy()
+        stage, features = _choose_stage(inv, *thresholds)
+        used, harps_spent, gained, step_loot = stage_loot[stage]
+        fert_spent = STAGE_FERTS[stage]
 
         # Deduct fert spent
         inv["ferts"] -= fert_spent
         
         # Update inventory
-        consumed = {"royal", "llavi"}
-        if loot:
-            # Subtract the used cheese
-            for keys, vals in loot.items():
-                if keys in consumed:
-                    inv[keys] -= int(vals)
-            # Subtract harps spent
-            if "harps_spent" in loot:
-                inv["harps"] -= int(loot["harps_spent"])
-            # Add the loot gained
-            for keys, vals in loot.items():
-                if keys not in consumed and keys != "harps_spent" and keys != "hunts":
-                    inv[keys] = inv.get(keys, 0) + int(vals)
-            # Update egg count
-            if "geggs" in loot:
-                egg_count += int(loot["geggs"])
+        # Subtract the used cheese
+        for keys, vals in used.items():
+            inv[keys] -= vals
+        # Subtract harps spent
+        inv["harps"] -= harps_spent
+        # Add the loot gained
+        for keys, vals in gained.items():
+            inv[keys] = inv.get(keys, 0) + vals
+        # Update egg count
+        egg_count += gained.get("geggs", 0)
+        idle_stages = 0 if gained.get("geggs", 0) > 0 else idle_stages + 1
+        if idle_stages > MAX_IDLE_STAGES:
+            raise ValueError(f"No eggs gained in {MAX_IDLE_STAGES} stages, stuck on {stage} short of {target_eggs} eggs")
         # Append stage counts
         stage_counts[stage] = stage_counts.get(stage, 0) + 1
 
-        # Append result
-        chain.append({"stage": stage, "eggs": egg_count, "harps_spent": int(loot.get("harps_spent", 0)), **{keys: int(vals) for keys, vals in loot.items() if keys not in ("hunts", "harps_spent")}, "inv": inv.copy(), "summary": stage_counts})
-        
-    return chain
+        # Yield result
+        step = {"stage": stage, "eggs": egg_count, "harps_spent": harps_spent, **step_loot, "inv": inv.copy(), "summary": stage_counts.copy()}
+        yield step
+        if not fast_forward:
+            continue
+
+        # Look for the last stages repeating the ones before them, trying every earlier time this choice was made
+        history.append((stage, features, pre_inv))
+        steps.append(step)
+        choices.append((stage, features))
+        if len(history) > 2 * MAX_CYCLE:
+            del history[0], steps[0], choices[0]
+        seen_at = seen.setdefault(choices[-1], [])
+        while seen_at and n_seen - seen_at[0] > len(history) // 2:
+            del seen_at[0]
+        lengths = [n_seen - i for i in reversed(seen_at)]
+        seen_at.append(n_seen)
+        n_seen += 1
+        if len(seen) > 4 * MAX_CYCLE:
+            seen = {key: [i for i in at if i >= n_seen - MAX_CYCLE] for key, at in seen.items() if at[-1] >= n_seen - MAX_CYCLE}
+        length = next((length for length in lengths
+                       if (length == 1 or choices[-2] == choices[-2 - length]) and choices[-length:] == choices[-2 * length:-length]), 0)
+        # A cycle without eggs cannot reach the target, so it is left to run step by step
+        if length == 0 or egg_count == steps[-length - 1]["eggs"]:
+            continue
+
+        # Jump over as many repeats of the last cycle as provably unchanged
+        delta = {keys: inv[keys] - history[-length][2].get(keys, 0) for keys in inv}
+        eggs = egg_count - steps[-length - 1]["eggs"]
+        repeats = _cycle_repeats(history[-length:], delta, egg_count, eggs, target_eggs, thresholds)
+        if repeats > 0:
+            cycle = ChainCycle(steps[-length:], repeats, delta, eggs, {})
+            for base in cycle.steps:
+                cycle.counts[base["stage"]] = cycle.counts.get(base["stage"], 0) + 1
+            if expand_cycles:
+                yield from cycle
+            else:
+                yield cycle
+            inv = {keys: vals + repeats * delta[keys] for keys, vals in inv.items()}
+            egg_count += repeats * eggs
+            for stage_name, count in cycle.counts.items():
+                stage_counts[stage_name] += repeats * count
+            history.clear()
+            steps.clear()
+            choices.clear()
+            seen.clear()
+
+# Number of stages and the last step of a chain given by iter_chain
+def chain_tail(items: Iterable[Union[Dict, ChainCycle]]) -> Tuple[int, Optional[Dict]]:
+    n_stages, last = 0, None
+    for item in items:
+        if isinstance(item, ChainCycle):
+            n_stages += len(item)
+            last = item.step(item.repeats, len(item.steps) - 1)
+        else:
+            n_stages += 1
+            last = item
+    return n_stages, last
+
+# Row of the columnar chain log: stage index into STAGES, eggs, loot, inventory and stage counts after the step
+CHAIN_LOG_DTYPE = np.dtype([
+    ("stage", np.uint8),
+    ("eggs", np.int64),
+    ("harps_spent", np.int64),
+    ("loot", [(keys, np.int64) for keys in LOOT_KEYS if keys != "harps_spent"]),
+    ("inv", [(keys, np.int64) for keys in ["llavi", "royal", "lbean", "mbean", "rbean", "harps", "geggs", "ferts"]]),
+    ("summary", np.int32, (len(STAGES),))])
+
+# Collect chain steps (e.g. from iter_chain) into a structured array with one row per stage
+# Cycles from iter_chain(..., expand_cycles=False) are filled in bulk
+def chain_log(steps: Iterable[Union[Dict, ChainCycle]]) -> np.ndarray:
+    blocks = []
+    pending = []
+    for step in steps:
+        if not isinstance(step, ChainCycle):
+            pending.append(step)
+            if len(pending) == 4096:
+                blocks.append(_log_rows(pending))
+                pending = []
+            continue
+        if pending:
+            blocks.append(_log_rows(pending))
+            pending = []
+        # Repeat c of the cycle is its rows shifted c times
+        c = np.repeat(np.arange(1, step.repeats + 1), len(step.steps))
+        rows = np.tile(_log_rows(step.steps), step.repeats)
+        rows["eggs"] += c * step.eggs
+        for keys in CHAIN_LOG_DTYPE["inv"].names:
+            rows["inv"][keys] += c * step.delta.get(keys, 0)
+        rows["summary"] += c[:, None] * np.array([step.counts.get(stage, 0) for stage in STAGES], dtype=np.int32)
+        blocks.append(rows)
+    blocks.append(_log_rows(pending))
+    return np.concatenate(blocks)
+
+# Chain log rows of a list of steps, filled column by column
+def _log_rows(steps: List[Dict]) -> np.ndarray:
+    stage_idx = {stage: i for i, stage in enumerate(STAGES)}
+    rows = np.zeros(len(steps), dtype=CHAIN_LOG_DTYPE)
+    rows["stage"] = [stage_idx[step["stage"]] for step in steps]
+    rows["eggs"] = [step["eggs"] for step in steps]
+    rows["harps_spent"] = [step["harps_spent"] for step in steps]
+    for keys in CHAIN_LOG_DTYPE["loot"].names:
+        rows["loot"][keys] = [step.get(keys, 0) for step in steps]
+    for keys in CHAIN_LOG_DTYPE["inv"].names:
+        rows["inv"][keys] = [step["inv"].get(keys, 0) for step in steps]
+    rows["summary"] = np.array([[step["summary"].get(stage, 0) for stage in STAGES] for step in steps]).reshape(-1, len(STAGES))
+    return rows
+
+# Stage picked by plan_chain's policy for every inventory at once, crafting cheese in place first
+def _policy_step(inv: Dict[str, np.ndarray], threshold_harps: int = 15000, threshold_royal: int = 150,
+                 threshold_llavi: int = 250) -> np.ndarray:
+    # Royal beanster check
+    craftable_royal = np.minimum(inv["rbean"] // 128, inv["lbean"] // 64)
+    craft = np.where((craftable_royal > 0) & (inv["royal"] < threshold_royal), craftable_royal, 0)
+    inv["royal"] += craft * 2
+    inv["rbean"] -= craft * 128
+    inv["lbean"] -= craft * 64
+    deficit_royal = np.maximum(threshold_royal - inv["royal"], 0)
+    # Leaping lavish beanster check
+    max_llavi_harps = np.maximum((inv["harps"] - threshold_harps) // 64, 0)
+    craftable_llavi = np.minimum(inv["lbean"] // 16, max_llavi_harps)
+    craft = np.where((craftable_llavi > 0) & (inv["llavi"] < threshold_llavi), craftable_llavi, 0)
+    inv["llavi"] += craft * 2
+    inv["harps"] -= craft * 64
+    inv["lbean"] -= craft * 16
+    deficit_llavi = np.maximum(threshold_llavi - inv["llavi"], 0)
+
+    # Farming run logic, the same branches as plan_chain
+    royal_short = (inv["rbean"] < deficit_royal * 128) | (inv["lbean"] < deficit_royal * 64)
+    royal_rbean = inv["rbean"] < deficit_royal * 128
+    llavi_short = ~royal_short & ((inv["harps"] < deficit_llavi * 64) | (inv["lbean"] < deficit_llavi * 16))
+    llavi_harps = inv["harps"] < deficit_llavi * 64
+    harps_short = ~royal_short & ~llavi_short & (inv["harps"] < threshold_harps)
+    lapis = (royal_short & ~royal_rbean) | (llavi_short & ~llavi_harps)
+    greathall = ~royal_short & ~llavi_short & ~harps_short
+    idx = STAGE_INDEX
+    farm = np.where(royal_short, idx["Ballroom (Royal)"], np.where(greathall, idx["Great Hall"], idx["Ballroom (Harps)"]))
+
+    ferts = inv["ferts"]
+    return np.where(ferts < ZONE_FERTS["Dungeon"], idx["Beanstalk"],
+           np.where(lapis, idx["Dungeon (Lapis)"],
+           np.where(ferts < ZONE_FERTS["Ballroom"], idx["Dungeon (R1R)"],
+           np.where(greathall & (ferts < ZONE_FERTS["Great Hall"]), idx["Ballroom (R1R)"], farm))))
+
+# Sample whole chains at once, every stage drawing the loot of a random run of its simulated yield table
+# Returns per chain arrays of stages done, hunts, cheese consumed, eggs, stage counts and whether the target was reached
+def simulate_chains(trap_power: int, trap_luck: int, use_ref: bool, target_eggs: int, inventory: Dict[str, int],
+                    n_chains: int = 10000, n_runs: int = 1000, max_stages: int = 10000,
+                    seed: Union[int, np.random.Generator, None] = None, workers: Optional[int] = 1,
+                    executor: Optional[Executor] = None, threshold_harps: int = 15000, threshold_royal: int = 150,
+                    threshold_llavi: int = 250) -> Dict[str, np.ndarray]:
+    table_seed, chain_seed = np.random.default_rng(seed).spawn(2)
+    tables = simulate_stages(trap_power, trap_luck, use_ref, n_runs, table_seed, workers=workers, executor=executor)
+    return run_chains(tables, target_eggs, inventory, n_chains, max_stages, chain_seed,
+                      threshold_harps, threshold_royal, threshold_llavi)
+
+# Stage yield tables as one (key, stage, run) array
+def _chain_table(tables: Dict[str, SimResult]) -> Tuple[List[str], np.ndarray]:
+    keys = list(dict.fromkeys(keys for result in tables.values() for keys in [*result.loot, "hunts"]))
+    n_runs = min(len(result.hunts) for result in tables.values())
+    table = np.zeros((len(keys), len(STAGES), n_runs), dtype=np.int64)
+    for i, stage in enumerate(STAGES):
+        columns = tables[stage].columns()
+        for k, keys_name in enumerate(keys):
+            if keys_name in columns:
+                table[k, i] = columns[keys_name][:n_runs]
+    return keys, table
+
+# Run chains against stage yield tables, following plan_chain's policy
+# Thresholds are either one value for all chains or one per chain
+def run_chains(tables: Dict[str, SimResult], target_eggs: int, inventory: Dict[str, int], n_chains: int = 10000,
+               max_stages: int = 10000, rng: Union[int, np.random.Generator, None] = None,
+               threshold_harps: Union[int, np.ndarray] = 15000, threshold_royal: Union[int, np.ndarray] = 150,
+               threshold_llavi: Union[int, np.ndarray] = 250) -> Dict[str, np.ndarray]:
+    rng = np.random.default_rng(rng)
+    thresholds = [np.broadcast_to(np.asarray(vals, dtype=np.int64), n_chains)
+                  for vals in (threshold_harps, threshold_royal, threshold_llavi)]
+    keys, table = _chain_table(tables)
+    row = {keys_name: k for k, keys_name in enumerate(keys)}
+    gained = [keys_name for keys_name in INVENTORY_KEYS if keys_name in row and keys_name not in ("royal", "llavi")]
+
+    # Inventory and totals of every chain
+    inv = {keys_name: np.full(n_chains, inventory.get(keys_name, 0), dtype=np.int64) for keys_name in INVENTORY_KEYS}
+    totals = {keys_name: np.zeros(n_chains, dtype=np.int64) for keys_name in ["hunts", "royal", "llavi", "bster", "norms", "harps_spent"]}
+    stage_counts = np.zeros((n_chains, len(STAGES)), dtype=np.int64)
+    active = np.flatnonzero(inv["geggs"] < target_eggs)
+
+    for _ in range(max_stages):
+        if len(active) == 0:
+            break
+        sub = {keys_name: vals[active] for keys_name, vals in inv.items()}
+        stage = _policy_step(sub, *(vals[active] for vals in thresholds))
+        loot = table[:, stage, rng.integers(table.shape[2], size=len(active))]
+
+        # Deduct fert spent, used cheese and harps spent, then add the loot gained
+        sub["ferts"] -= STAGE_FERT_COSTS[stage]
+        for keys_name in ("royal", "llavi"):
+            sub[keys_name] -= loot[row[keys_name]]
+        sub["harps"] -= loot[row["harps_spent"]]
+        for keys_name in gained:
+            sub[keys_name] += loot[row[keys_name]]
+        for keys_name, vals in totals.items():
+            if keys_name in row:
+                vals[active] += loot[row[keys_name]]
+        stage_counts[active, stage] += 1
+        for keys_name, vals in sub.items():
+            inv[keys_name][active] = vals
+
+        # Drop the chains that reached the target
+        active = active[sub["geggs"] < target_eggs]
+
+    return {"stages": stage_counts.sum(axis=1), "stage_counts": stage_counts, "eggs": inv["geggs"],
+            "reached": inv["geggs"] >= target_eggs, **totals, "inv": inv}
+
+# Summarize sampled chains: mean, standard deviation and percentiles of stages, hunts and cheese consumed
+# Chains cut off by the stage cap are censored, so they are only counted as unfinished and the stats cover the others (NaN if none)
+def chain_report(chains: Dict[str, np.ndarray], percentiles: Tuple[int, ...] = (5, 25, 50, 75, 95)) -> Dict:
+    reached = np.asarray(chains["reached"], dtype=bool)
+    done = int(np.sum(reached))
+    report = {"chains": len(reached), "reached": float(np.mean(reached)), "unfinished": len(reached) - done}
+    for keys in ["stages", "hunts", "royal", "llavi", "bster", "norms", "harps_spent"]:
+        vals = np.asarray(chains[keys])[reached]
+        if done:
+            report[keys] = {"mean": float(np.mean(vals)), "std": float(np.std(vals)),
+                            **{f"p{q}": float(np.percentile(vals, q)) for q in percentiles}}
+        else:
+            report[keys] = {"mean": math.nan, "std": math.nan, **{f"p{q}": math.nan for q in percentiles}}
+    means = np.mean(chains["stage_counts"][reached], axis=0) if done else np.full(len(STAGES), math.nan)
+    report["stage_counts"] = {stage: float(mean) for stage, mean in zip(STAGES, means)}
+    return report
+
+# Chance that a chain reaches the target within n_stages stages
+def prob_within(chains: Dict[str, np.ndarray], n_stages: int) -> float:
+    return float(np.mean(chains["reached"] & (chains["stages"] <= n_stages)))
+
+# Threshold combinations as rows of (harps, royal, llavi), every harps value with every royal and llavi value
+def policy_grid(harps: Iterable[int], royal: Iterable[int], llavi: Iterable[int]) -> np.ndarray:
+    return np.array(list(itertools.product(harps, royal, llavi)), dtype=np.int64).reshape(-1, 3)
+
+# Plan one chain per policy at once from average stage yields, the same chain plan_chain gives for its thresholds
+# Returns per policy arrays of stages, expected hunts, stage counts and whether the target was reached
+def evaluate_policies(precomp: Dict[str, Dict[str, float]], target_eggs: int, inventory: Dict[str, int],
+                      policies: np.ndarray, max_stages: int = 10000) -> Dict[str, np.ndarray]:
+    # One-run tables holding the yields plan_chain steps by
+    tables = {stage: SimResult([int(loot.get("hunts", 0))], {keys: [int(vals)] for keys, vals in loot.items() if keys != "hunts"})
+              for stage, loot in precomp.items()}
+    policies = np.asarray(policies, dtype=np.int64).reshape(-1, 3)
+    chains = run_chains(tables, target_eggs, inventory, len(policies), max_stages, 0, *policies.T)
+    chains["hunts"] = chains["stage_counts"] @ np.array([precomp[stage].get("hunts", 0) for stage in STAGES])
+    return chains
+
+# Search threshold combinations for the one reaching target_eggs in the fewest expected hunts
+# Stage yields are computed once (see stage_yields) and every policy of the grid is evaluated against them together
+def optimize_policy(trap_power: int, trap_luck: int, use_ref: bool, target_eggs: int, inventory: Dict[str, int],
+                    harps: Iterable[int] = range(5000, 40001, 2500), royal: Iterable[int] = range(50, 501, 50),
+                    llavi: Iterable[int] = range(50, 501, 50), n_runs: Optional[int] = None,
+                    seed: Union[int, np.random.Generator, None] = None, workers: Optional[int] = 1,
+                    executor: Optional[Executor] = None, cache: Optional[YieldCache] = None,
+                    max_stages: int = 10000, variance_reduction: bool = False) -> Dict:
+    precomp = stage_yields(trap_power, trap_luck, use_ref, n_runs, seed, workers, executor, cache, variance_reduction)
+    policies = policy_grid(harps, royal, llavi)
+    chains = evaluate_policies(precomp, target_eggs, inventory, policies, max_stages)
+    hunts = np.where(chains["reached"], chains["hunts"], np.inf)
+    best = int(np.argmin(hunts))
+    if not np.isfinite(hunts[best]):
+        return {"error": f"No policy reaches {target_eggs} eggs within {max_stages} stages"}
+    return {"threshold_harps": int(policies[best, 0]), "threshold_royal": int(policies[best, 1]),
+            "threshold_llavi": int(policies[best, 2]), "hunts": float(hunts[best]), "stages": int(chains["stages"][best]),
+            "policies": policies, "policy_hunts": hunts}
+
+# Inventory keys read by plan_chain
+INVENTORY_KEYS = ["llavi", "royal", "lbean", "mbean", "rbean", "harps", "geggs", "ferts"]
+
+# Run a single scenario given as a dict and return the results as a dict
+def run_scenario(scenario: Dict, executor: Optional[Executor] = None, cache: Optional[YieldCache] = None) -> Dict:
+    trap_power = int(scenario["trap_power"])
+    trap_luck = int(scenario["trap_luck"])
+    use_ref = bool(scenario.get("use_ref", False))
+    target_eggs = int(scenario["target_eggs"])
+    inventory = {keys: int(scenario.get("inventory", {}).get(keys, 0)) for keys in INVENTORY_KEYS}
+    thresholds = {keys: int(scenario[keys]) for keys in ("threshold_harps", "threshold_royal", "threshold_llavi") if keys in scenario}
+
+    n_runs = scenario.get("n_runs")
+    include_chain = scenario.get("include_chain", False)
+    variance_reduction = bool(scenario.get("variance_reduction", False))
+    items = list(iter_chain(trap_power, trap_luck, use_ref, target_eggs, inventory, verbose=False, seed=scenario.get("seed"),
+                            n_runs=None if n_runs is None else int(n_runs), executor=executor, cache=cache,
+                            expand_cycles=include_chain, variance_reduction=variance_reduction, **thresholds))
+    n_stages, last = chain_tail(items)
+
+    result = {"trap_power": trap_power, "trap_luck": trap_luck, "use_ref": use_ref,
+              "target_eggs": target_eggs, "inventory": inventory, **thresholds,
+              "stages": n_stages,
+              "summary": dict(last["summary"]) if last else {},
+              "final_inventory": last["inv"] if last else inventory}
+    if "id" in scenario:
+        result = {"id": scenario["id"], **result}
+    if "chains" in scenario:
+        chains = simulate_chains(trap_power, trap_luck, use_ref, target_eggs, inventory, n_chains=int(scenario["chains"]),
+                                 n_runs=1000 if n_runs is None else int(n_runs), seed=scenario.get("seed"), executor=executor,
+                                 **thresholds)
+        result["chain_mc"] = {**chain_report(chains), "p_within_plan": prob_within(chains, n_stages)}
+    if scenario.get("optimize"):
+        grid = {keys: scenario["optimize"][keys] for keys in ("harps", "royal", "llavi")
+                if isinstance(scenario["optimize"], dict) and keys in scenario["optimize"]}
+        policy = optimize_policy(trap_power, trap_luck, use_ref, target_eggs, inventory, **grid, seed=scenario.get("seed"),
+                                 n_runs=None if n_runs is None else int(n_runs), executor=executor, cache=cache,
+                                 variance_reduction=variance_reduction)
+        result["policy"] = {keys: vals for keys, vals in policy.items() if keys not in ("policies", "policy_hunts")}
+    if include_chain:
+        result["chain"] = [{keys: vals for keys, vals in step.items() if keys != "summary"} for step in items]
+    return result
+
+# Command line for headless batches: one JSON scenario per input line, one JSON result per output line
+def batch_main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(prog="sim_bb.py batch", description="Plan Bountiful Beanstalk chains from JSON lines")
+    batch.add_arguments(parser)
+    parser.add_argument("--workers", type=int, default=1, help="processes simulating Monte Carlo stages (0 = all cores)")
+    parser.add_argument("--cache", default=None, help="SQLite file caching Monte Carlo stage yields across runs")
+    parser.add_argument("--cache-size", type=int, default=256, help="setups kept in the cache, least recently used are evicted")
+    args = parser.parse_args(argv)
+    cache = None if args.cache is None else YieldCache(args.cache, args.cache_size)
+
+    # One pool shared by every scenario of the batch
+    pool = None if args.workers == 1 else ProcessPoolExecutor(max_workers=args.workers or None)
+    try:
+        batch.run(args, functools.partial(run_scenario, executor=pool, cache=cache))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+# Command line comparing trap setups stage by stage with common random numbers
+def compare_main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(prog="sim_bb.py compare", description="Compare trap setups with common random numbers")
+    parser.add_argument("setups", nargs="+", help="setups as POWER,LUCK,REF (REF 1 or 0), the first one is the baseline")
+    parser.add_argument("--runs", type=int, default=1000, help="runs per stage and setup")
+    parser.add_argument("--seed", type=int, default=None, help="seed shared by every setup")
+    parser.add_argument("--workers", type=int, default=1, help="processes simulating stages (0 = all cores)")
+    parser.add_argument("--json", action="store_true", help="print the full comparison as JSON")
+    args = parser.parse_args(argv)
+    setups = [(int(power), int(luck), bool(int(ref))) for power, luck, ref in (setup.split(",") for setup in args.setups)]
+
+    comparison = compare_setups(setups, args.runs, args.seed, workers=args.workers or None)
+    if args.json:
+        print(json.dumps(batch.json_safe({"setups": args.setups, "n_runs": args.runs, "stages": comparison}), allow_nan=False))
+        return
+    header = f"{'Stage':17} | {'key':11} | {'baseline':>9} | " + " | ".join(f"{setup:>24}" for setup in args.setups[1:])
+    print(header)
+    print("-" * len(header))
+    for stage, keys in comparison.items():
+        for key, stats in keys.items():
+            if not any(stats["mean"]):
+                continue
+            diffs = " | ".join(f"{d:+10.2f} ± {se:<5.2f} ({si:<5.2f})" for d, se, si in
+                               zip(stats["diff"][1:], stats["se"][1:], stats["se_independent"][1:]))
+            print(f"{stage:17} | {key:11} | {stats['mean'][0]:9.2f} | {diffs}")
+    print("Differences are paired ± standard error (standard error of independent runs)")
 
 # Main
 if __name__ == "__main__":
+    # Non-interactive modes
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        batch_main(sys.argv[2:])
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "compare":
+        compare_main(sys.argv[2:])
+        sys.exit(0)
+
     # Input parameter
     # Setup
     print(f"========== Input your setup ==========")
@@ -783,7 +1733,11 @@ if __name__ == "__main__":
     goal = int(input("Number of target eggs: "))
     
     # Plan the chain run
-    chain = plan_chain(trap_power, trap_luck, use_ref, goal, inventory)
+    try:
+        chain = plan_chain(trap_power, trap_luck, use_ref, goal, inventory)
+    except ValueError as e:
+        print(e)
+        exit(1)
 
     # Print result
     print("\n========== Plan Run Result ==========")
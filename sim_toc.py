@@ -1,7 +1,13 @@
-import random
 import math
+import sys
+import csv
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-import matplotlib.pyplot as plt
+import instrument
+import batch
+from sampling import AntitheticUniforms, RunningEstimate, UniformBuffer
 
 # Compute Bitter Grammarian Catch Rate
 def cr_bg(trap_power, trap_luck):
@@ -12,7 +18,12 @@ def cr_mw(trap_power, trap_luck):
     return min(1, (trap_power*7.5 + 2*(math.floor(trap_luck*min(7.5,1.4))**2)) / (200000 + trap_power*7.5))
 
 # Simulate Writing Session
-def simulate_writing(initial_hunts, initial_words, trap_power, trap_luck, word_multiplier):
+# Uniforms come from the given buffer, or from one sized for the session drawn from rng
+def simulate_writing(initial_hunts, initial_words, trap_power, trap_luck, word_multiplier, rng=None, uniforms=None):
+    if uniforms is None:
+        uniforms = UniformBuffer(rng, size=max(1, 2*initial_hunts))
+    uniform = iter(uniforms).__next__
+
     # Set initial number of hunts, words, and hunts done
     hunts_remaining = initial_hunts
     total_words = initial_words
@@ -38,7 +49,7 @@ def simulate_writing(initial_hunts, initial_words, trap_power, trap_luck, word_m
             mw = 0
         else:
             # BG or MW can appear
-            if random.random() <= 0.6:
+            if uniform() <= 0.6:
                 catch_prob = catch_bg
                 words = 250
                 bonus_hunts = 0
@@ -50,7 +61,7 @@ def simulate_writing(initial_hunts, initial_words, trap_power, trap_luck, word_m
                 mw = 1
 
         # Catch check
-        if random.random() <= catch_prob:
+        if uniform() <= catch_prob:
             total_words += round(words * word_multiplier)
             hunts_remaining += bonus_hunts
             mw_caught += mw
@@ -58,18 +69,26 @@ def simulate_writing(initial_hunts, initial_words, trap_power, trap_luck, word_m
     return hunts_done, total_words, mw_caught
 
 # Do Monte Carlo loop
-def MC(n_runs, initial_hunts, initial_words, trap_power, trap_luck, word_multiplier):
+def MC(n_runs, initial_hunts, initial_words, trap_power, trap_luck, word_multiplier, rng=None):
+    # Random stream shared by all runs, served in blocks
+    rng = instrument.rng(rng, "MC")
+    uniforms = UniformBuffer(rng)
+
     # Define array
     results_hunts = []
     results_words = []
     results_mws = []
 
     # Run loop
-    for _ in range(n_runs):
-        hunts, words, mws = simulate_writing(initial_hunts, initial_words, trap_power, trap_luck, word_multiplier)
-        results_hunts.append(hunts)
-        results_words.append(words)
-        results_mws.append(mws)
+    with instrument.timed("MC"):
+        for _ in range(n_runs):
+            hunts, words, mws = simulate_writing(initial_hunts, initial_words, trap_power, trap_luck, word_multiplier, uniforms=uniforms)
+            results_hunts.append(hunts)
+            results_words.append(words)
+            results_mws.append(mws)
+    if instrument.enabled:
+        instrument.count("runs", n_runs, "MC")
+        instrument.count("hunts", sum(results_hunts), "MC")
 
     # Compute the average
     avg_hunts = np.mean(results_hunts)
@@ -78,8 +97,599 @@ def MC(n_runs, initial_hunts, initial_words, trap_power, trap_luck, word_multipl
 
     return avg_hunts, avg_words, avg_mws, results_hunts, results_words, results_mws
 
+# Simulate many writing sessions in lockstep
+# With antithetic, sessions 2k and 2k+1 see mirrored uniforms at every hunt, and an odd last session plain ones
+# With a controls dict, zero-mean control variates of every session are stored in it: the words caught minus
+# their expected value given the pool, the Mythweavers caught minus their expected value given the pool, and
+# the Mythweaver pools rolled minus their expected number once 4000 words are written
+def simulate_writing_batch(n_runs, initial_hunts, initial_words, catch_bg, catch_mw, word_multiplier, rng=None,
+                           antithetic=False, controls=None):
+    # Random stream from a seed or an existing Generator
+    rng = instrument.rng(rng, "simulate_writing_batch")
+
+    # Set initial number of hunts, words, and Mythweavers caught for every session
+    hunts_remaining = np.full(n_runs, initial_hunts, dtype=np.int64)
+    total_words = np.full(n_runs, initial_words, dtype=np.int64)
+    mw_caught = np.zeros(n_runs, dtype=np.int64)
+
+    # Words gained per catch after boosters
+    words_bg = round(250 * word_multiplier)
+    words_mw = round(1000 * word_multiplier)
+
+    # Keep a compact copy of the sessions that are still writing
+    active = np.flatnonzero(hunts_remaining > 0)
+    act_hunts = hunts_remaining[active]
+    act_words = total_words[active]
+    act_mws = mw_caught[active]
+    if controls is not None:
+        control_words = np.zeros(n_runs)
+        control_mws = np.zeros(n_runs)
+        control_pools = np.zeros(n_runs)
+    if antithetic:
+        mirrored = AntitheticUniforms(rng, active)
+
+    # Advance all active sessions by one hunt at a time
+    while active.size > 0:
+        act_hunts -= 1
+
+        # Uniforms of the active sessions, mirrored between the two sessions of a pair while both are active
+        if antithetic:
+            u_pool = mirrored.draw()
+            u_catch = mirrored.draw()
+        else:
+            u_pool = rng.random(active.size)
+            u_catch = rng.random(active.size)
+
+        # Determine mouse pool based on total words (only BG below 4000 words)
+        eligible = act_words >= 4000
+        is_mw = eligible & (u_pool > 0.6)
+
+        # Catch check
+        catch_prob = np.where(is_mw, catch_mw, catch_bg)
+        caught = u_catch <= catch_prob
+        caught_mw = caught & is_mw
+        if controls is not None:
+            words = np.where(is_mw, words_mw, words_bg)
+            control_words[active] += (caught - catch_prob) * words
+            control_mws[active] += is_mw * (caught - catch_mw)
+            control_pools[active] += is_mw - 0.4 * eligible
+        act_words += caught * np.where(is_mw, words_mw, words_bg)
+        act_hunts += 2 * caught_mw
+        act_mws += caught_mw
+
+        # Store finished sessions and drop them from the active set
+        done = act_hunts <= 0
+        if done.any():
+            total_words[active[done]] = act_words[done]
+            mw_caught[active[done]] = act_mws[done]
+            keep = ~done
+            active = active[keep]
+            act_hunts = act_hunts[keep]
+            act_words = act_words[keep]
+            act_mws = act_mws[keep]
+            if antithetic:
+                mirrored.select(active)
+
+    # Every session spends its initial hunts plus 2 bonus hunts per Mythweaver
+    hunts_done = np.where(initial_hunts > 0, initial_hunts, 0) + 2 * mw_caught
+    if instrument.enabled:
+        instrument.count("runs", n_runs, "simulate_writing_batch")
+        instrument.count("hunts", np.sum(hunts_done), "simulate_writing_batch")
+    if controls is not None:
+        controls.update(words=control_words, mws=control_mws, pools=control_pools)
+
+    return hunts_done, total_words, mw_caught
+
+# Do vectorized Monte Carlo loop
+def MC_vec(n_runs, initial_hunts, initial_words, trap_power, trap_luck, word_multiplier, rng=None):
+    # Run every session at once
+    with instrument.timed("MC_vec"):
+        results_hunts, results_words, results_mws = simulate_writing_batch(
+            n_runs, initial_hunts, initial_words, cr_bg(trap_power, trap_luck), cr_mw(trap_power, trap_luck), word_multiplier, rng)
+
+    # Compute the average
+    avg_hunts = np.mean(results_hunts)
+    avg_words = np.mean(results_words)
+    avg_mws = np.mean(results_mws)
+
+    return avg_hunts, avg_words, avg_mws, results_hunts, results_words, results_mws
+
+# Running mean, variance and extremes merged chunk by chunk (Welford/Chan update)
+class RunningStats:
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+
+    # Merge a chunk of samples
+    def update(self, values):
+        values = np.asarray(values)
+        if values.size == 0:
+            return
+        n_chunk = values.size
+        mean_chunk = float(values.mean())
+        m2_chunk = float(((values - mean_chunk)**2).sum())
+        n_total = self.n + n_chunk
+        delta = mean_chunk - self.mean
+        self.mean += delta * n_chunk / n_total
+        self.m2 += m2_chunk + delta**2 * self.n * n_chunk / n_total
+        self.n = n_total
+        self.min = values.min().item() if self.min is None else min(self.min, values.min().item())
+        self.max = values.max().item() if self.max is None else max(self.max, values.max().item())
+
+    # Merge statistics gathered elsewhere (e.g. by another process)
+    def merge(self, other):
+        if other.n == 0:
+            return
+        n_total = self.n + other.n
+        delta = other.mean - self.mean
+        self.mean += delta * other.n / n_total
+        self.m2 += other.m2 + delta**2 * self.n * other.n / n_total
+        self.n = n_total
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def var(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else 0.0
+    def std(self):
+        return math.sqrt(self.var())
+    def sem(self):
+        return math.sqrt(self.var() / self.n) if self.n > 0 else 0.0
+
+# Empty running statistics and volume histogram
+def _empty_stats():
+    return {"hunts": RunningStats(), "words": RunningStats(), "mws": RunningStats(), "volumes": RunningStats(),
+            "volume_counts": np.zeros(0, dtype=np.int64)}
+
+# Fold a chunk of sessions into the running statistics
+def _update_stats(stats, hunts, words, mws):
+    volumes = np.round(words/4000).astype(np.int64)
+    stats["hunts"].update(hunts)
+    stats["words"].update(words)
+    stats["mws"].update(mws)
+    stats["volumes"].update(volumes)
+    _add_counts(stats, np.bincount(volumes))
+
+# Add a volume histogram to the running one
+def _add_counts(stats, counts):
+    if counts.size > stats["volume_counts"].size:
+        stats["volume_counts"] = np.pad(stats["volume_counts"], (0, counts.size - stats["volume_counts"].size))
+    stats["volume_counts"][:counts.size] += counts
+
+# Do vectorized Monte Carlo loop in chunks with constant memory
+# With target_se set, n_runs is the run budget and the loop stops early once the
+# standard error of the average volumes drops to target_se
+def MC_stream(n_runs, initial_hunts, initial_words, trap_power, trap_luck, word_multiplier, chunk_size=100000,
+              target_se=None, pilot_runs=10000, rng=None):
+    # Compute the catch rate based on trap power and trap luck
+    catch_bg = cr_bg(trap_power, trap_luck)
+    catch_mw = cr_mw(trap_power, trap_luck)
+    rng = np.random.default_rng(rng)
+
+    # Running statistics and volume histogram
+    stats = _empty_stats()
+
+    # Run loop chunk by chunk
+    runs_done = 0
+    size = chunk_size if target_se is None else min(chunk_size, pilot_runs)
+    with instrument.timed("MC_stream"):
+        while runs_done < n_runs:
+            size = min(size, n_runs - runs_done)
+            _update_stats(stats, *simulate_writing_batch(size, initial_hunts, initial_words, catch_bg, catch_mw, word_multiplier, rng))
+            runs_done += size
+
+            # Stop once precise enough, otherwise size the next chunk from the observed variance
+            if target_se is not None:
+                if stats["volumes"].sem() <= target_se:
+                    break
+                needed = math.ceil(stats["volumes"].var() / target_se**2) - runs_done
+                size = max(1000, min(chunk_size, needed))
+    stats["runs"] = runs_done
+    stats["se"] = stats["volumes"].sem()
+
+    return stats["hunts"].mean, stats["words"].mean, stats["mws"].mean, stats
+
+# Simulate one shard of a parallel Monte Carlo run
+def _parallel_shard(shard):
+    size, initial_hunts, initial_words, catch_bg, catch_mw, word_multiplier, rng = shard
+    stats = _empty_stats()
+    _update_stats(stats, *simulate_writing_batch(size, initial_hunts, initial_words, catch_bg, catch_mw, word_multiplier, rng))
+    return stats
+
+# Do vectorized Monte Carlo loop across processes
+# Shards get child streams of seed, so results do not depend on the workers
+def MC_parallel(n_runs, initial_hunts, initial_words, trap_power, trap_luck, word_multiplier, chunk_size=100000,
+                workers=None, seed=None):
+    # Compute the catch rate based on trap power and trap luck
+    catch_bg = cr_bg(trap_power, trap_luck)
+    catch_mw = cr_mw(trap_power, trap_luck)
+
+    # Split the runs into shards with independent streams
+    n_shards = max(1, math.ceil(n_runs / chunk_size))
+    streams = np.random.default_rng(seed).spawn(n_shards)
+    shards = [(min(chunk_size, n_runs - i*chunk_size), initial_hunts, initial_words, catch_bg, catch_mw, word_multiplier, streams[i])
+              for i in range(n_shards)]
+
+    # Run inline for a single worker, otherwise fan out across processes
+    if workers == 1:
+        results = [_parallel_shard(shard) for shard in shards]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_parallel_shard, shards))
+
+    # Merge shards in order
+    stats = _empty_stats()
+    for shard_stats in results:
+        for keys in ("hunts", "words", "mws", "volumes"):
+            stats[keys].merge(shard_stats[keys])
+        _add_counts(stats, shard_stats["volume_counts"])
+    stats["runs"] = n_runs
+    stats["se"] = stats["volumes"].sem()
+
+    return stats["hunts"].mean, stats["words"].mean, stats["mws"].mean, stats
+
+# Do vectorized Monte Carlo loop with variance reduction: antithetic pairs of sessions and control variates
+# Runs chunk by chunk like MC_stream, stopping early once the standard error of the average volumes drops to target_se,
+# and every mean comes with its standard error in stats["estimates"]
+def MC_vr(n_runs, initial_hunts, initial_words, trap_power, trap_luck, word_multiplier, chunk_size=100000,
+          target_se=None, pilot_runs=10000, antithetic=True, control_variates=True, rng=None):
+    # Compute the catch rate based on trap power and trap luck
+    catch_bg = cr_bg(trap_power, trap_luck)
+    catch_mw = cr_mw(trap_power, trap_luck)
+    rng = np.random.default_rng(rng)
+
+    # Running statistics, and the running sums the control variates are fitted on
+    stats = _empty_stats()
+    keys = ("hunts", "words", "mws", "volumes")
+    running = RunningEstimate(antithetic)
+
+    # Run loop chunk by chunk, in even sizes so that antithetic pairs never straddle two chunks
+    # Only the last chunk can be odd, its last session then being the one left unpaired
+    runs_done = 0
+    size = chunk_size if target_se is None else min(chunk_size, pilot_runs)
+    size += size % 2
+    with instrument.timed("MC_vr"):
+        while runs_done < n_runs:
+            size = min(size, n_runs - runs_done)
+            controls = {} if control_variates else None
+            hunts, words, mws = simulate_writing_batch(size, initial_hunts, initial_words, catch_bg, catch_mw, word_multiplier, rng,
+                                                       antithetic=antithetic, controls=controls)
+            _update_stats(stats, hunts, words, mws)
+            running.update([hunts, words, mws, np.round(words/4000)], list((controls or {}).values()))
+            runs_done += size
+            estimates = dict(zip(keys, running.estimate()))
+
+            # Stop once precise enough, otherwise size the next chunk from the observed variance
+            # (a full chunk while too few samples give no standard error)
+            if target_se is not None and runs_done < n_runs:
+                se = estimates["volumes"][1]
+                if se <= target_se:
+                    break
+                needed = math.ceil(runs_done * (se / target_se)**2) - runs_done if math.isfinite(se) else chunk_size
+                size = max(1000, min(chunk_size, needed))
+            size += size % 2
+    stats["runs"] = runs_done
+    stats["estimates"] = estimates
+    stats["se"] = estimates["volumes"][1]
+
+    return estimates["hunts"][0], estimates["words"][0], estimates["mws"][0], stats
+
+# Compute word multiplier from boosters
+def compute_word_multiplier(condensed, silver, gold, rainbow):
+    word_multiplier = 1.0
+    if condensed:
+        word_multiplier *= 2.0
+    if silver:
+        word_multiplier *= 1.25
+    if gold:
+        word_multiplier *= 1.50
+    if rainbow:
+        word_multiplier *= 1.75
+    return word_multiplier
+
+# Log factorials used for exact binomial weights
+def _log_factorials(n):
+    return np.array([math.lgamma(k + 1) for k in range(n + 1)])
+
+# Binomial probability of k successes out of n trials (broadcasts over n and k)
+def _binom_pmf(n, k, p, log_fact):
+    n, k = np.broadcast_arrays(np.asarray(n), np.asarray(k))
+    pmf = np.zeros(n.shape)
+    valid = (k >= 0) & (k <= n)
+    if p <= 0:
+        pmf[valid & (k == 0)] = 1.0
+    elif p >= 1:
+        pmf[valid & (k == n)] = 1.0
+    else:
+        nv, kv = n[valid], k[valid]
+        pmf[valid] = np.exp(log_fact[nv] - log_fact[kv] - log_fact[nv - kv] + kv*np.log(p) + (nv - kv)*np.log1p(-p))
+    return pmf
+
+# Distribution of Mythweavers caught before the countdown ends, for each number of remaining hunts
+def _mw_catch_dist(remaining, q_mw, tol):
+    # Each hunt moves the countdown by -1, or by +1 when a Mythweaver is caught, so the number of
+    # catches before it hits zero follows the hitting time theorem:
+    # P(b | R) = R/(R+2b) * C(R+2b, b) * q^b * (1-q)^(R+b)
+    # The countdown drifts down only while q < 1/2, and the catches stay within a few multiples of R/(1-2q)^2
+    if q_mw >= 0.5:
+        raise ValueError(f"Mythweaver catch chance per hunt {q_mw} >= 0.5, the session never ends")
+    limit = 16 * (int(remaining.max(initial=0)) + 64) / (1 - 2*q_mw)**2
+    n_max = 64
+    missing_before = math.inf
+    while True:
+        b = np.arange(n_max + 1)
+        steps = remaining[:, None] + 2*b[None, :]
+        log_fact = _log_factorials(int(steps.max()))
+        dist = _binom_pmf(steps, b[None, :], q_mw, log_fact) * remaining[:, None] / np.maximum(steps, 1)
+        dist[remaining == 0] = 0.0
+        dist[remaining == 0, 0] = 1.0
+        missing = 1 - dist.sum(axis=1).min()
+        if q_mw <= 0 or missing <= tol:
+            break
+        # Past the bulk, the tail beyond n_max shrinks geometrically, so a small missing mass that stops halving is rounding of the pmf
+        if missing < 1e-6 and missing > missing_before / 2:
+            break
+        if n_max >= limit:
+            raise ValueError(f"Mythweaver catch distribution did not converge, {missing:.3g} of the mass is missing after {n_max} catches")
+        missing_before = missing
+        n_max *= 2
+
+    # Spread the rounding leftover over each row
+    return dist / dist.sum(axis=1, keepdims=True)
+
+# Solve the writing session exactly as a Markov chain
+def solve_exact(initial_hunts, initial_words, trap_power, trap_luck, word_multiplier, tol=1e-12):
+    # Compute the catch rate based on trap power and trap luck
+    catch_bg = cr_bg(trap_power, trap_luck)
+    catch_mw = cr_mw(trap_power, trap_luck)
+
+    # Words gained per catch after boosters
+    words_bg = round(250 * word_multiplier)
+    words_mw = round(1000 * word_multiplier)
+
+    # No hunts means nothing gets written
+    if initial_hunts <= 0:
+        return 0.0, float(initial_words), 0.0, {0: 1.0}, {initial_words: 1.0}, {0: 1.0}
+
+    # BG catches needed to leave the BG-only phase (< 4000 words)
+    needed = max(0, -(-(4000 - initial_words) // words_bg))
+    log_fact = _log_factorials(initial_hunts)
+
+    # Probability of reaching 4000 words on hunt t, which leaves initial_hunts - t hunts
+    if needed == 0:
+        remaining = np.array([initial_hunts])
+        weights = np.array([1.0])
+    else:
+        t = np.arange(needed, initial_hunts + 1)
+        remaining = initial_hunts - t
+        weights = catch_bg * _binom_pmf(t - 1, needed - 1, catch_bg, log_fact)
+    remaining = remaining[weights > tol*1e-3]
+    weights = weights[weights > tol*1e-3]
+
+    # Joint probability of (BG caught, MW caught)
+    q_bg = 0.6 * catch_bg
+    q_mw = 0.4 * catch_mw
+    mw_dist = _mw_catch_dist(remaining, q_mw, tol) * weights[:, None] if weights.size else np.zeros((0, 1))
+    n_mw = mw_dist.shape[1]
+    n_bg = needed + (int(remaining.max()) if remaining.size else 0) + n_mw
+    joint = np.zeros((n_bg, n_mw))
+
+    # Sessions that never leave the BG-only phase
+    if needed > 0:
+        bg = np.arange(min(needed, initial_hunts + 1))
+        joint[bg, 0] += _binom_pmf(initial_hunts, bg, catch_bg, log_fact)
+
+    # After 4000 words, the R + b hunts that are not Mythweaver catches each catch a BG with q_bg/(1-q_mw)
+    if remaining.size:
+        log_fact = _log_factorials(n_bg)
+        bg = np.arange(n_bg - needed)
+        for mw in range(n_mw):
+            w = mw_dist[:, mw]
+            if w.sum() <= tol*1e-3:
+                continue
+            pmf = _binom_pmf(remaining[:, None] + mw, bg[None, :], q_bg/(1 - q_mw), log_fact)
+            joint[needed:, mw] += w @ pmf
+
+    # Map (BG caught, MW caught) to hunts, words and Mythweavers
+    mws = np.arange(n_mw)
+    p_mws = joint.sum(axis=0)
+    hunts_pmf = {int(initial_hunts + 2*m): float(p) for m, p in zip(mws, p_mws) if p > 0}
+    mws_pmf = {int(m): float(p) for m, p in zip(mws, p_mws) if p > 0}
+    words = initial_words + np.arange(n_bg)[:, None]*words_bg + mws[None, :]*words_mw
+    values, inverse = np.unique(words.ravel(), return_inverse=True)
+    p_words = np.bincount(inverse, weights=joint.ravel())
+    words_pmf = {int(w): float(p) for w, p in zip(values, p_words) if p > 0}
+
+    # Compute the average
+    avg_hunts = sum(h*p for h, p in hunts_pmf.items())
+    avg_words = sum(w*p for w, p in words_pmf.items())
+    avg_mws = sum(m*p for m, p in mws_pmf.items())
+
+    return avg_hunts, avg_words, avg_mws, hunts_pmf, words_pmf, mws_pmf
+
+# Distribution of volumes written from a distribution of words
+def volume_pmf(words_pmf):
+    volumes = {}
+    for words, p in words_pmf.items():
+        vol = round(words/4000)
+        volumes[vol] = volumes.get(vol, 0.0) + p
+    return dict(sorted(volumes.items()))
+
+# Probability of writing at least k volumes
+def prob_volumes_at_least(words_pmf, k):
+    return sum(p for vol, p in volume_pmf(words_pmf).items() if vol >= k)
+
+# Simulate a single setup of the sweep
+def _sweep_setup(setup):
+    trap_power, trap_luck, initial_hunts, initial_words, word_multiplier, n_runs, percentiles, rng = setup
+
+    # Catch rates are computed once for the whole setup
+    catch_bg = cr_bg(trap_power, trap_luck)
+    catch_mw = cr_mw(trap_power, trap_luck)
+    _, words, _ = simulate_writing_batch(n_runs, initial_hunts, initial_words, catch_bg, catch_mw, word_multiplier, rng)
+    volumes = np.round(words/4000).astype(np.int64)
+
+    # Tabulate volumes and Gnawbel Prizes (always assume has Leather Bound Cover)
+    avg_vol = round(np.mean(words)/4000)
+    row = {"trap_power": trap_power, "trap_luck": trap_luck, "initial_hunts": initial_hunts,
+           "catch_bg": round(catch_bg, 6), "catch_mw": round(catch_mw, 6),
+           "avg_words": round(float(np.mean(words)), 2), "avg_volumes": avg_vol, "avg_gnawbel": avg_vol*54*2}
+    for q, vol in zip(percentiles, np.percentile(volumes, percentiles, method="lower")):
+        row[f"p{q}_volumes"] = int(vol)
+        row[f"p{q}_gnawbel"] = int(vol)*54*2
+    return row
+
+# Sweep trap power, trap luck and initial hunts across a process pool
+def sweep(trap_powers, trap_lucks, initial_hunts, initial_words=0, word_multiplier=1.0,
+          n_runs=100000, percentiles=(5, 25, 50, 75, 95), workers=None, seed=None):
+    grid = list(itertools.product(trap_powers, trap_lucks, initial_hunts))
+    streams = np.random.default_rng(seed).spawn(len(grid))
+    setups = [(power, luck, hunts, initial_words, word_multiplier, n_runs, tuple(percentiles), stream)
+              for (power, luck, hunts), stream in zip(grid, streams)]
+
+    # Run inline for a single worker, otherwise fan out one setup per task
+    if workers == 1:
+        return [_sweep_setup(setup) for setup in setups]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_sweep_setup, setups))
+
+# Parse a sweep range, either "start:stop:step" (inclusive) or "a,b,c"
+def _parse_range(text):
+    if ":" in text:
+        start, stop, step = (int(v) for v in text.split(":"))
+        return list(range(start, stop + 1, step))
+    return [int(v) for v in text.split(",")]
+
+# Command line for the sweep
+def sweep_main(argv):
+    parser = argparse.ArgumentParser(prog="sim_toc.py sweep", description="Sweep ToC setups and write volumes to CSV")
+    parser.add_argument("--power", required=True, help="trap power range, start:stop:step or a,b,c")
+    parser.add_argument("--luck", required=True, help="trap luck range, start:stop:step or a,b,c")
+    parser.add_argument("--hunts", required=True, help="initial hunts range, start:stop:step or a,b,c")
+    parser.add_argument("--words", type=int, default=0, help="initial words")
+    parser.add_argument("--condensed", action="store_true", help="use Condensed Creativity")
+    parser.add_argument("--silver", action="store_true", help="use Silver Quill")
+    parser.add_argument("--gold", action="store_true", help="use Gold Quill")
+    parser.add_argument("--rainbow", action="store_true", help="use Rainbow Quill")
+    parser.add_argument("--runs", type=int, default=100000, help="Monte Carlo runs per setup")
+    parser.add_argument("--percentiles", default="5,25,50,75,95", help="volume percentiles to report")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--seed", type=int, default=None, help="random seed for reproducible sweeps")
+    parser.add_argument("--out", default="-", help="output CSV file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    # Every range must give at least one value, otherwise there is nothing to sweep
+    ranges = {}
+    for name in ("power", "luck", "hunts", "percentiles"):
+        try:
+            ranges[name] = _parse_range(getattr(args, name))
+        except ValueError:
+            parser.error(f"--{name} must be start:stop:step or a,b,c, got {getattr(args, name)!r}")
+        if not ranges[name]:
+            parser.error(f"--{name} {getattr(args, name)!r} gives no values")
+
+    word_multiplier = compute_word_multiplier(args.condensed, args.silver, args.gold, args.rainbow)
+    rows = sweep(ranges["power"], ranges["luck"], ranges["hunts"],
+                 args.words, word_multiplier, args.runs, ranges["percentiles"], args.workers, args.seed)
+
+    # Write the table
+    out = sys.stdout if args.out == "-" else open(args.out, "w", newline="")
+    try:
+        writer = csv.DictWriter(out, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+# Plot the volume distribution, shown on screen or saved to a file
+def plot_volumes(volumes, path=None):
+    # Matplotlib is only imported when a plot is requested
+    import matplotlib
+    if path is not None:
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    plt.figure(figsize=(10,6))
+    plt.bar(list(volumes.keys()), list(volumes.values()), width=1.0, align='edge', edgecolor='black', alpha=0.7)
+    plt.title("Distribution of Volumes Written per Run")
+    plt.xlabel("Volumes Written")
+    plt.ylabel("Frequency")
+    plt.grid(axis='y', alpha=0.3)
+    plt.tight_layout()
+    if path is None:
+        plt.show()
+    else:
+        plt.savefig(path)
+        plt.close()
+
+# Run a single scenario given as a dict and return the results as a dict
+def run_scenario(scenario):
+    trap_power = int(scenario["trap_power"])
+    trap_luck = int(scenario["trap_luck"])
+    initial_hunts = int(scenario["initial_hunts"])
+    initial_words = int(scenario.get("initial_words", 0))
+    word_multiplier = scenario.get("word_multiplier")
+    if word_multiplier is None:
+        word_multiplier = compute_word_multiplier(scenario.get("condensed", 0), scenario.get("silver", 0),
+                                                  scenario.get("gold", 0), scenario.get("rainbow", 0))
+
+    result = {"trap_power": trap_power, "trap_luck": trap_luck, "initial_hunts": initial_hunts,
+              "initial_words": initial_words, "word_multiplier": word_multiplier,
+              "catch_bg": cr_bg(trap_power, trap_luck), "catch_mw": cr_mw(trap_power, trap_luck)}
+    if "id" in scenario:
+        result = {"id": scenario["id"], **result}
+
+    if scenario.get("exact", False):
+        # Solve the Markov chain exactly
+        avg_hunts, avg_words, avg_mws, hunts_dist, words_dist, mws_dist = solve_exact(initial_hunts, initial_words, trap_power, trap_luck, word_multiplier)
+        max_hunt, max_word, max_mws = max(hunts_dist), max(words_dist), max(mws_dist)
+        volumes = volume_pmf(words_dist)
+    else:
+        # Do Monte Carlo Runs, stopping early once target_se is reached (null runs all n_runs),
+        # with antithetic pairs and control variates when variance_reduction is set
+        mc = MC_vr if scenario.get("variance_reduction", False) else MC_stream
+        avg_hunts, avg_words, avg_mws, stats = mc(int(scenario.get("n_runs", 1000000)), initial_hunts, initial_words,
+                                                  trap_power, trap_luck, word_multiplier, target_se=scenario.get("target_se", 0.05),
+                                                  rng=scenario.get("seed"))
+        max_hunt, max_word, max_mws = stats["hunts"].max, stats["words"].max, stats["mws"].max
+        volumes = {vol: count/stats["runs"] for vol, count in enumerate(stats["volume_counts"]) if count > 0}
+        se = {keys: se for keys, (_, se) in stats["estimates"].items()} if "estimates" in stats else \
+             {keys: stats[keys].sem() for keys in ("hunts", "words", "mws", "volumes")}
+        result["runs"] = stats["runs"]
+        result.update({"se_hunts": se["hunts"], "se_words": se["words"], "se_mws": se["mws"], "se_volumes": se["volumes"]})
+
+    avg_vol = round(avg_words/4000)
+    max_vol = round(max_word/4000)
+    result.update({
+        "avg_hunts": float(avg_hunts), "avg_mws": float(avg_mws), "avg_words": float(avg_words),
+        "avg_volumes": avg_vol, "avg_gnawbel": avg_vol*54*2,
+        "max_hunts": int(max_hunt), "max_mws": int(max_mws), "max_words": int(max_word),
+        "max_volumes": max_vol, "max_gnawbel": max_vol*54*2,
+        "volumes": {str(vol): float(p) for vol, p in volumes.items()}})
+
+    if scenario.get("plot"):
+        plot_volumes(volumes, scenario["plot"])
+    return result
+
+# Command line for headless batches: one JSON scenario per input line, one JSON result per output line
+def batch_main(argv):
+    parser = argparse.ArgumentParser(prog="sim_toc.py batch", description="Run ToC scenarios from JSON lines")
+    batch.add_arguments(parser)
+    batch.run(parser.parse_args(argv), run_scenario)
+
 # Main
 if __name__ == "__main__":
+    # Non-interactive modes
+    if len(sys.argv) > 1 and sys.argv[1] == "sweep":
+        sweep_main(sys.argv[2:])
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        batch_main(sys.argv[2:])
+        sys.exit(0)
+
     # Input parameter
     trap_power = int(input("Enter Trap Power: "))
     trap_luck = int(input("Enter Trap Luck: "))
@@ -91,26 +701,29 @@ if __name__ == "__main__":
     silver = int(input("Silver Quill? (1=yes, 0=no): "))
     gold = int(input("Gold Quill? (1=yes, 0=no): "))
     rainbow = int(input("Rainbow Quill? (1=yes, 0=no): "))
+    exact = int(input("Exact solver instead of Monte Carlo? (1=yes, 0=no): "))
 
     # Compute word multiplier
-    word_multiplier = 1.0
-    if condensed:
-        word_multiplier *= 2.0
-    if silver:
-        word_multiplier *= 1.25
-    if gold:
-        word_multiplier *= 1.50
-    if rainbow:
-        word_multiplier *= 1.75
+    word_multiplier = compute_word_multiplier(condensed, silver, gold, rainbow)
 
-    # Do Monte Carlo Runs
-    n_runs = 100000
-    avg_hunts, avg_words, avg_mws, hunts_dist, words_dist, mws_dist = MC(n_runs, initial_hunts, initial_words, trap_power, trap_luck, word_multiplier)
+    if exact:
+        # Solve the Markov chain exactly
+        avg_hunts, avg_words, avg_mws, hunts_dist, words_dist, mws_dist = solve_exact(initial_hunts, initial_words, trap_power, trap_luck, word_multiplier)
+        max_hunt = max(hunts_dist)
+        max_word = max(words_dist)
+        max_mws = max(mws_dist)
+        volumes = volume_pmf(words_dist)
+    else:
+        # Do Monte Carlo Runs until the average volumes are precise enough
+        max_runs = 1000000
+        target_se = 0.05
+        avg_hunts, avg_words, avg_mws, stats = MC_stream(max_runs, initial_hunts, initial_words, trap_power, trap_luck, word_multiplier, target_se=target_se)
+        max_hunt = stats["hunts"].max
+        max_word = stats["words"].max
+        max_mws = stats["mws"].max
+        volumes = {vol: count/stats["runs"] for vol, count in enumerate(stats["volume_counts"]) if count > 0}
     avg_vol = round(avg_words/4000)
     avg_gpl = avg_vol*54*2 # Always assume has Leather Bound Cover 
-    max_hunt = max(hunts_dist)
-    max_word = max(words_dist)
-    max_mws = max(mws_dist)
     max_vol = round(max_word/4000)
     max_gpl = max_vol*54*2 # Always assume has Leather Bound Cover
 
@@ -130,14 +743,10 @@ if __name__ == "__main__":
     print(f"Max words observed: {max_word}")
     print(f"Max volumes written: {max_vol}")
     print(f"Max Gnawbel Prize rewarded: {max_gpl}")
+    if exact:
+        print(f"Chance of writing at least {avg_vol} volumes: {prob_volumes_at_least(words_dist, avg_vol):.2%}")
+    else:
+        print(f"Runs used: {stats['runs']} (standard error of average volumes: {stats['se']:.4f})")
 
     # Plot normalized distribution
-    volumes = [round(w/4000) for w in words_dist]
-    plt.figure(figsize=(10,6))
-    plt.hist(volumes, bins=range(min(volumes), max(volumes)+2), edgecolor='black', alpha=0.7, density=True)
-    plt.title("Distribution of Volumes Written per Run")
-    plt.xlabel("Volumes Written")
-    plt.ylabel("Frequency")
-    plt.grid(axis='y', alpha=0.3)
-    plt.tight_layout()
-    plt.show()
\ No newline at end of file
+    plot_volumes(volumes)
\ No newline at end of file
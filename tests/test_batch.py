@@ -0,0 +1,35 @@
+import json
+import batch
+import sim_bb
+import sim_toc
+
+def run_batch(main, tmp_path, scenarios, *args):
+    src = tmp_path / "scenarios.jsonl"
+    src.write_text("\n".join(scenarios) + "\n")
+    out = tmp_path / "results.jsonl"
+    metrics = tmp_path / "metrics.json"
+    main([str(src), "--out", str(out), "--metrics", str(metrics), *args])
+    assert "counters" in json.loads(metrics.read_text())
+    return [json.loads(line) for line in out.read_text().splitlines()]
+
+def test_json_safe():
+    assert batch.json_safe({"a": [1.0, float("nan")], "b": (float("inf"), "x")}) == {"a": [1.0, None], "b": [None, "x"]}
+
+# A failing scenario is written as an error, whatever it raised, and the batch goes on
+def test_toc_batch_errors(tmp_path):
+    good = json.dumps({"id": 1, "trap_power": 30000, "trap_luck": 40, "initial_hunts": 50, "n_runs": 200, "seed": 1})
+    bad_plot = json.dumps({"id": 2, "trap_power": 30000, "trap_luck": 40, "initial_hunts": 50, "n_runs": 200, "seed": 1,
+                           "plot": str(tmp_path / "missing" / "plot.png")})
+    results = run_batch(sim_toc.batch_main, tmp_path, [good, "{not json", bad_plot, json.dumps({"trap_power": 1}), good])
+    assert [("error" in result) for result in results] == [False, True, True, True, False]
+    assert results[0] == results[4]
+    assert results[3]["error"].startswith("KeyError")
+
+# A scenario too weak to reach its target is written as an error instead of hanging the batch
+def test_bb_batch_stalled_chain(tmp_path):
+    inventory = {"llavi": 300, "royal": 200, "lbean": 1000, "rbean": 1000, "harps": 20000, "ferts": 50}
+    weak = json.dumps({"trap_power": 1000, "trap_luck": 0, "target_eggs": 50000, "inventory": inventory})
+    good = json.dumps({"id": "good", "trap_power": 40000, "trap_luck": 50, "use_ref": True, "target_eggs": 50000, "inventory": inventory})
+    results = run_batch(sim_bb.batch_main, tmp_path, [weak, good])
+    assert results[0]["error"].startswith("ValueError: No eggs gained")
+    assert results[1]["id"] == "good" and results[1]["stages"] > 0
@@ -0,0 +1,34 @@
+import numpy as np
+import instrument
+import sim_bb
+import sim_toc
+
+SETUP = dict(trap_power=40000, trap_luck=50, use_ref=True)
+
+# Turning instrumentation on counts the runs without changing a single seeded result
+def test_instrumentation_keeps_seeded_results(monkeypatch):
+    monkeypatch.setattr(instrument, "enabled", False)
+    plain_stages = sim_bb.simulate_stages(**SETUP, n_runs=200, seed=3, workers=1)
+    plain_mc = sim_toc.MC(200, 50, 0, 30000, 40, 2.0, rng=4)
+    plain_vec = sim_toc.MC_vec(200, 50, 0, 30000, 40, 2.0, rng=5)
+
+    instrument.enable()
+    try:
+        stages = sim_bb.simulate_stages(**SETUP, n_runs=200, seed=3, workers=1)
+        mc = sim_toc.MC(200, 50, 0, 30000, 40, 2.0, rng=4)
+        vec = sim_toc.MC_vec(200, 50, 0, 30000, 40, 2.0, rng=5)
+        report, prometheus = instrument.report(), instrument.prometheus()
+    finally:
+        instrument.reset()
+    for stage, result in plain_stages.items():
+        for key, vals in result.columns().items():
+            assert np.array_equal(vals, stages[stage].columns()[key])
+    assert plain_mc[:3] == mc[:3] and plain_vec[:3] == vec[:3]
+
+    counters = report["counters"]
+    assert counters["runs"]["beanstalk"] == 200 and counters["runs"]["MC"] == 200
+    assert counters["hunts"]["beanstalk"] == plain_stages["Beanstalk"].hunts.sum()
+    assert counters["hunts"]["MC"] == sum(plain_mc[3])
+    assert counters["rng_draws"]["beanstalk"] > 0
+    assert report["timers"]["MC_vec"][""]["calls"] == 1
+    assert 'sim_runs_total{source="MC"} 200' in prometheus
@@ -0,0 +1,57 @@
+import numpy as np
+import sampling
+
+# Generator stand-in drawing only zeros, the one uniform whose mirror 1 - u falls outside [0, 1)
+class ZeroRng:
+    def random(self, size=None):
+        return np.zeros(size)
+
+def test_antithetic_uniforms():
+    u = sampling.antithetic_uniforms(np.random.default_rng(0), 7, antithetic=True)
+    assert len(u) == 7
+    assert np.allclose(u[0:6:2] + u[1:6:2], 1)
+    assert ((u >= 0) & (u < 1)).all()
+    assert (sampling.antithetic_uniforms(ZeroRng(), 4, antithetic=True) == 0).all()
+
+def test_vr_estimate_controls():
+    rng = np.random.default_rng(1)
+    control = rng.standard_normal(1000)
+    values = 5 + 2 * control + 0.01 * rng.standard_normal(1000)
+    (mean, se), = sampling.vr_estimate([values], [control])
+    (plain_mean, plain_se), = sampling.vr_estimate([values])
+    assert abs(mean - 5) < 3 * se
+    assert se < plain_se / 10
+
+# With no more samples than controls plus one, the plain means are returned
+def test_vr_estimate_few_samples():
+    values = [np.array([1.0, 2.0, 4.0])]
+    controls = [np.array([0.5, -0.5, 0.0]), np.array([1.0, 0.0, -1.0])]
+    (mean, se), = sampling.vr_estimate(values, controls)
+    assert (mean, se) == sampling.vr_estimate(values)[0]
+    # Pairs are averaged and an odd last run counts on its own
+    assert sampling.vr_estimate(values, controls, paired=True)[0][0] == 2.75
+
+# Pairs stay mirrored while both runs remain, and a run left alone draws on its own
+def test_antithetic_uniforms_shrinking_runs():
+    mirrored = sampling.AntitheticUniforms(np.random.default_rng(2), np.arange(5))
+    u = mirrored.draw()
+    assert len(u) == 5 and np.allclose(u[[0, 2]] + u[[1, 3]], 1)
+    mirrored.select(np.array([1, 2, 3, 6]))
+    u = mirrored.draw()
+    assert len(u) == 4 and np.isclose(u[1] + u[2], 1) and ((u >= 0) & (u < 1)).all()
+    mirrored.select(np.array([], dtype=np.int64))
+    assert len(mirrored.draw()) == 0
+    mirrored.select(np.arange(100001))
+    u = np.concatenate([mirrored.draw() for _ in range(10)])
+    assert abs(u.mean() - 0.5) < 0.01
+
+# Merging chunks gives the estimate of all runs at once
+def test_running_estimate_chunks():
+    rng = np.random.default_rng(3)
+    controls = [rng.standard_normal(5001), 100 * rng.standard_normal(5001)]
+    values = [3 + controls[0] + rng.standard_normal(5001), rng.integers(0, 50, 5001)]
+    for paired in (False, True):
+        running = sampling.RunningEstimate(paired)
+        for start in range(0, 5001, 1000):
+            running.update([vals[start:start + 1000] for vals in values], [vals[start:start + 1000] for vals in controls])
+        assert np.allclose(running.estimate(), sampling.vr_estimate(values, controls, paired))
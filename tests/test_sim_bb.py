@@ -0,0 +1,295 @@
+import json
+import math
+import numpy as np
+import pytest
+import sim_bb
+
+SETUP = dict(trap_power=40000, trap_luck=50, use_ref=True)
+STOCKPILE = {"llavi": 10**6, "royal": 10**6, "lbean": 10**5, "mbean": 0,
+             "rbean": 10**5, "harps": 10**8, "geggs": 0, "ferts": 500}
+
+# Seeded samples of two engines agree in mean (within 5 standard errors of the difference) and in standard deviation
+def assert_same_distribution(scalar, batch, std_tol=0.1):
+    scalar, batch = np.asarray(scalar, dtype=float), np.asarray(batch, dtype=float)
+    se = math.sqrt(scalar.var(ddof=1) / len(scalar) + batch.var(ddof=1) / len(batch))
+    assert abs(scalar.mean() - batch.mean()) <= 5 * se + 1e-9
+    assert math.isclose(scalar.std(ddof=1), batch.std(ddof=1), rel_tol=std_tol, abs_tol=1e-9)
+
+# Many runs of do_sim_batch have the distribution of as many do_sim calls, plain and antithetic
+def test_do_sim_batch_matches_scalar():
+    mice = sim_bb.MiceData()
+    args = (mice, 5000, 10, 20, "SB", "Beanstalk", 4)
+    rng = np.random.default_rng(1)
+    scalar = [sim_bb.do_sim(*args, rng=rng) for _ in range(5000)]
+    for antithetic in (False, True):
+        batch = sim_bb.do_sim_batch(*args, n_runs=20000, rng=2, antithetic=antithetic)
+        assert batch.keys() == scalar[0].keys()
+        for key, vals in batch.items():
+            assert_same_distribution([run[key] for run in scalar], vals)
+
+# One Beanstalk run hunt by hunt: a room, 20 hunts with do_sim, then the boss until caught
+def beanstalk_run(mice, trap_power, trap_luck, use_ref, rng):
+    rooms = sim_bb.BEANSTALK_ROOMS
+    room = rooms["room_types"][rng.choice(len(rooms["room_types"]), p=np.array(rooms["room_probs"]) / sum(rooms["room_probs"]))]
+    multiplier = rooms["room_multi"][room]
+    loot = sim_bb.do_sim(mice, trap_power, trap_luck, 20, "SB", "Beanstalk", multiplier, rng=rng)
+    hunts = 20
+    catch = mice.compile(trap_power, trap_luck)[("Boss", "Beanstalk")].catch[0]
+    while True:
+        hunts += 1
+        if rng.random() < catch:
+            break
+    loot["beans"] += multiplier + 20
+    loot["ferts"] += 2 if use_ref else 1
+    return {"hunts": hunts, **loot}
+
+# The vectorized Beanstalk has the distribution of the hunt by hunt run, plain and with variance reduction
+def test_simulate_beanstalk_matches_scalar():
+    mice = sim_bb.MiceData()
+    rng = np.random.default_rng(3)
+    scalar = [beanstalk_run(mice, 5000, 10, True, rng) for _ in range(5000)]
+    for variance_reduction in (False, True):
+        result = sim_bb.simulate_beanstalk(5000, 10, True, n_runs=20000, rng=4, variance_reduction=variance_reduction)
+        for key, vals in result.columns().items():
+            assert_same_distribution([run[key] for run in scalar], vals)
+
+# Farming in bulk has the distribution of farming room by room, plain and antithetic
+@pytest.mark.parametrize("params, target_loot, zone", [
+    (sim_bb.DUNGEON_FARM_PARAMS, "lavish", "Dungeon"),
+    (sim_bb.BALLROOM_FARM_PARAMS, "harps", "Ballroom"),
+])
+def test_simulate_farm_batch_matches_scalar(params, target_loot, zone):
+    mice = sim_bb.MiceData()
+    rng = np.random.default_rng(5)
+    scalar = [sim_bb.simulate_farm(mice, 5000, 10, **params, target_loot=target_loot, zone=zone, rng=rng) for _ in range(4000)]
+    for antithetic in (False, True):
+        batch = sim_bb.simulate_farm_batch(mice, 5000, 10, **params, target_loot=target_loot, zone=zone, n_runs=20000, rng=6, antithetic=antithetic)
+        assert batch.keys() == scalar[0].keys()
+        for key, vals in batch.items():
+            assert_same_distribution([run[key] for run in scalar], vals)
+
+# Room 1 Retreat in one pass has the distribution of the scalar run, plain and antithetic
+@pytest.mark.parametrize("params, zone", [(sim_bb.DUNGEON_R1R_PARAMS, "Dungeon"), (sim_bb.BALLROOM_R1R_PARAMS, "Ballroom")])
+def test_simulate_r1r_batch_matches_scalar(params, zone):
+    mice = sim_bb.MiceData()
+    rng = np.random.default_rng(7)
+    scalar = [sim_bb.simulate_r1r(mice, 5000, 10, **params, zone=zone, rng=rng) for _ in range(5000)]
+    for antithetic in (False, True):
+        batch = sim_bb.simulate_r1r_batch(mice, 5000, 10, **params, zone=zone, n_runs=20000, rng=8, antithetic=antithetic)
+        assert batch.keys() == scalar[0].keys()
+        for key, vals in batch.items():
+            assert_same_distribution([run[key] for run in scalar], vals)
+
+# Targets that can never be reached are refused instead of drawing nonsense attempts
+def test_zero_probability_targets():
+    assert sim_bb._geometric_attempts(np.array([0.0, 0.5, 0.99]), 1.0).tolist() == [1, 1, 1]
+    with pytest.raises(ValueError, match="never end"):
+        sim_bb._geometric_attempts(np.array([0.5]), 0.0)
+    with pytest.raises(ValueError, match="never end"):
+        sim_bb.simulate_beanstalk(0, 0, True, n_runs=10, rng=1)
+    with pytest.raises(ValueError, match="never end"):
+        sim_bb.simulate_dungeon(40000, 50, True, target_loot="mysteries", n_runs=10, rng=1)
+
+# The mouse database is loaded once per file, read-only, and its hash follows the data rather than the file layout
+def test_load_mice_content_hash(tmp_path):
+    db = sim_bb.load_mice()
+    assert sim_bb.load_mice() is db and sim_bb.MiceData().db is db
+    assert not db.powers.flags.writeable
+    with open(sim_bb.MICE_PATH) as f:
+        data = json.load(f)
+
+    same = tmp_path / "same.json"
+    same.write_text(json.dumps(data, indent=1))
+    assert sim_bb.load_mice(str(same)).content_hash == db.content_hash
+
+    data["pools"][0]["powers"][0] += 1
+    changed = tmp_path / "changed.json"
+    changed.write_text(json.dumps(data))
+    other = sim_bb.load_mice(str(changed))
+    assert other.content_hash != db.content_hash
+    assert other.powers[0] == db.powers[0] + 1
+    assert sim_bb.params_hash(sim_bb.MiceData(str(changed))) != sim_bb.params_hash()
+
+# Fast-forwarding over cycles gives the same chain as planning step by step
+@pytest.mark.parametrize("n_runs, seed, thresholds", [
+    (None, None, {}),
+    (200, 3, {}),
+    (200, 7, dict(threshold_harps=25000, threshold_royal=300, threshold_llavi=100)),
+])
+def test_iter_chain_fast_forward(n_runs, seed, thresholds):
+    kwargs = dict(**SETUP, target_eggs=3 * 10**6, inventory=STOCKPILE, verbose=False, n_runs=n_runs, seed=seed, **thresholds)
+    items = list(sim_bb.iter_chain(**kwargs, expand_cycles=False))
+    assert any(isinstance(item, sim_bb.ChainCycle) for item in items)
+
+    slow = list(sim_bb.iter_chain(**kwargs, fast_forward=False))
+    fast = list(sim_bb.iter_chain(**kwargs))
+    assert [step["stage"] for step in fast] == [step["stage"] for step in slow]
+    assert fast[-1]["summary"] == slow[-1]["summary"]
+    assert fast[-1]["inv"] == slow[-1]["inv"]
+    assert sim_bb.chain_tail(items) == (len(slow), slow[-1])
+    assert (sim_bb.chain_log(items) == sim_bb.chain_log(slow)).all()
+
+# Every row of the chain log holds the step plan_chain gives at that position, cycles included
+def test_chain_log_matches_plan_chain():
+    kwargs = dict(**SETUP, target_eggs=3 * 10**6, inventory=STOCKPILE, verbose=False)
+    steps = sim_bb.plan_chain(**kwargs)
+    log = sim_bb.chain_log(sim_bb.iter_chain(**kwargs, expand_cycles=False))
+    assert len(log) == len(steps)
+    stages = list(sim_bb.STAGES)
+    for row, step in zip(log, steps):
+        assert stages[row["stage"]] == step["stage"]
+        assert row["eggs"] == step["eggs"] and row["harps_spent"] == step["harps_spent"]
+        assert {keys: row["loot"][keys] for keys in row["loot"].dtype.names} == {keys: step.get(keys, 0) for keys in row["loot"].dtype.names}
+        assert {keys: row["inv"][keys] for keys in row["inv"].dtype.names} == {keys: step["inv"].get(keys, 0) for keys in row["inv"].dtype.names}
+        assert row["summary"].tolist() == [step["summary"].get(stage, 0) for stage in stages]
+
+# Every policy evaluated together follows the chain plan_chain gives for its thresholds
+@pytest.mark.parametrize("n_runs, seed", [(None, None), (200, 5)])
+def test_evaluate_policies_matches_plan_chain(n_runs, seed):
+    inventory = {"llavi": 300, "royal": 200, "lbean": 1000, "mbean": 0,
+                 "rbean": 1000, "harps": 20000, "geggs": 0, "ferts": 50}
+    target_eggs = 10**6
+    precomp = sim_bb.stage_yields(**SETUP, n_runs=n_runs, seed=seed)
+    policies = sim_bb.policy_grid([5000, 15000, 30000], [50, 150, 400], [50, 250, 500])
+    chains = sim_bb.evaluate_policies(precomp, target_eggs, {**inventory}, policies)
+    assert chains["reached"].all()
+    for i, (harps, royal, llavi) in enumerate(policies):
+        steps = sim_bb.plan_chain(**SETUP, target_eggs=target_eggs, inventory=inventory, verbose=False, n_runs=n_runs, seed=seed,
+                                  threshold_harps=harps, threshold_royal=royal, threshold_llavi=llavi)
+        counts = [steps[-1]["summary"].get(stage, 0) for stage in sim_bb.STAGES]
+        assert chains["stages"][i] == len(steps)
+        assert chains["stage_counts"][i].tolist() == counts
+        assert chains["eggs"][i] == steps[-1]["eggs"]
+        assert {keys: int(vals[i]) for keys, vals in chains["inv"].items()} == {keys: steps[-1]["inv"].get(keys, 0) for keys in sim_bb.INVENTORY_KEYS}
+        assert chains["hunts"][i] == pytest.approx(sum(precomp[stage].get("hunts", 0) * n for stage, n in zip(sim_bb.STAGES, counts)))
+
+# A setup too weak to gain eggs is given up instead of planning forever
+def test_iter_chain_stalls():
+    inventory = {"llavi": 300, "royal": 200, "lbean": 1000, "mbean": 0,
+                 "rbean": 1000, "harps": 20000, "geggs": 0, "ferts": 50}
+    with pytest.raises(ValueError, match="No eggs gained"):
+        sim_bb.plan_chain(1000, 0, False, 50000, inventory, verbose=False)
+
+# Chains cut off by the stage cap are counted apart and kept out of the stats
+def test_chain_report_censors_unfinished_chains():
+    inventory = {"llavi": 300, "royal": 200, "lbean": 1000, "mbean": 0,
+                 "rbean": 1000, "harps": 20000, "geggs": 0, "ferts": 50}
+    chains = sim_bb.simulate_chains(**SETUP, target_eggs=10**6, inventory=inventory, n_chains=400, n_runs=200, seed=1, max_stages=165)
+    reached = chains["reached"]
+    assert 0 < reached.sum() < len(reached)
+    report = sim_bb.chain_report(chains)
+    assert report["chains"] == 400 and report["unfinished"] == 400 - reached.sum()
+    assert report["reached"] == pytest.approx(reached.mean())
+    assert report["hunts"]["mean"] == pytest.approx(chains["hunts"][reached].mean())
+    assert report["stages"]["p95"] == np.percentile(chains["stages"][reached], 95)
+    assert report["stage_counts"]["Beanstalk"] == pytest.approx(chains["stage_counts"][reached, 0].mean())
+
+    none = sim_bb.chain_report(sim_bb.simulate_chains(**SETUP, target_eggs=10**6, inventory=inventory, n_chains=10, n_runs=200, seed=1, max_stages=5))
+    assert none["unfinished"] == 10 and none["reached"] == 0
+    assert np.isnan(none["stages"]["mean"]) and np.isnan(none["stage_counts"]["Beanstalk"])
+
+# Merging concatenates every column, filling keys a result lacks with 0, and percentiles read the merged columns
+def test_sim_result_merge_and_percentile():
+    first = sim_bb.SimResult([1, 2, 3], {"beans": [10, 20, 30], "ferts": [1, 1, 2]}, {"c": [0.5, -0.5, 0.0]})
+    second = sim_bb.SimResult([4, 5], {"beans": [40, 50], "harps": [7, 8]})
+    merged = sim_bb.SimResult.merge(first, second)
+    assert len(merged) == 5 and not merged.paired
+    assert merged.hunts.dtype == sim_bb.RESULT_DTYPE
+    assert {key: vals.tolist() for key, vals in merged.columns().items()} == {
+        "beans": [10, 20, 30, 40, 50], "ferts": [1, 1, 2, 0, 0], "harps": [0, 0, 0, 7, 8], "hunts": [1, 2, 3, 4, 5]}
+    assert merged.controls == {}
+    assert len(sim_bb.SimResult.merge()) == 0
+
+    assert merged.percentile(50) == {"beans": 30.0, "ferts": 1.0, "harps": 0.0, "hunts": 3.0}
+    assert merged.percentile([0, 100])["beans"].tolist() == [10.0, 50.0]
+    assert merged.quantile(0.25) == merged.percentile(25)
+
+# Odd runs stay paired, and merging moves an unpaired run behind the pairs that follow it
+def test_odd_runs_stay_paired():
+    stages = sim_bb.simulate_stages(**SETUP, n_runs=1001, seed=2, variance_reduction=True)
+    assert all(result.paired and len(result) == 1001 for result in stages.values())
+
+    odd = sim_bb.simulate_beanstalk(**SETUP, n_runs=5, rng=1, variance_reduction=True)
+    even = sim_bb.simulate_beanstalk(**SETUP, n_runs=4, rng=2, variance_reduction=True)
+    assert odd.paired and odd.controls
+    merged = sim_bb.SimResult.merge(odd, even)
+    assert merged.paired and len(merged) == 9
+    order = [0, 1, 2, 3, 5, 6, 7, 8, 4]
+    for key, vals in merged.columns().items():
+        assert vals.tolist() == np.concatenate([odd.columns()[key], even.columns()[key]])[order].tolist()
+    assert merged.controls.keys() == odd.controls.keys()
+    assert merged.controls["boss_attempts"].tolist() == np.concatenate([odd.controls["boss_attempts"], even.controls["boss_attempts"]])[order].tolist()
+
+# Only integer seeds are cached, the least recently used setups are evicted and a change of parameters misses
+def test_yield_cache(tmp_path, monkeypatch):
+    path = str(tmp_path / "yields.sqlite")
+    cache = sim_bb.YieldCache(path, max_entries=2)
+    assert cache.key(40000, 50, True, 100) is None
+    assert cache.key(40000, 50, True, 100, np.random.default_rng(1)) is None
+    sim_bb.plan_chain(**SETUP, target_eggs=1000, inventory=STOCKPILE, verbose=False, n_runs=50, cache=cache)
+    assert len(cache) == 0
+
+    keys = [cache.key(40000, 50, True, 100, seed) for seed in range(3)]
+    assert len(set(keys)) == 3 and cache.key(40000, 50, True, 100, 0, variance_reduction=True) not in keys
+    cache.put(keys[0], {"Beanstalk": {"hunts": 0.0}})
+    cache.put(keys[1], {"Beanstalk": {"hunts": 1.0}})
+    assert cache.get(keys[0]) == {"Beanstalk": {"hunts": 0.0}}
+    cache.put(keys[2], {"Beanstalk": {"hunts": 2.0}})
+    assert len(cache) == 2 and cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None and cache.get(keys[2]) is not None
+
+    # A warm plan skips simulation and gives the same chain
+    cold = sim_bb.plan_chain(**SETUP, target_eggs=1000, inventory=STOCKPILE, verbose=False, n_runs=50, seed=7, cache=cache)
+    monkeypatch.setattr(sim_bb, "simulate_stages", None)
+    assert sim_bb.plan_chain(**SETUP, target_eggs=1000, inventory=STOCKPILE, verbose=False, n_runs=50, seed=7, cache=cache) == cold
+
+    # New parameters give new keys, so nothing cached before is found
+    monkeypatch.setattr(sim_bb, "YIELD_CACHE_VERSION", sim_bb.YIELD_CACHE_VERSION + 1)
+    fresh = sim_bb.YieldCache(path, max_entries=2)
+    assert fresh.key(40000, 50, True, 100, 0) != keys[0]
+    assert fresh.get(fresh.key(40000, 50, True, 100, 0)) is None
+
+# The exact yields plan_chain uses by default agree with seeded Monte Carlo averages of every stage
+@pytest.mark.parametrize("setup", [SETUP, dict(trap_power=25000, trap_luck=30, use_ref=False)])
+@pytest.mark.parametrize("variance_reduction", [False, True])
+def test_expected_yields_match_monte_carlo(setup, variance_reduction):
+    exact = sim_bb.expected_yields(**setup)
+    estimates = sim_bb.stage_estimates(**setup, n_runs=10000, seed=1, variance_reduction=variance_reduction)
+    assert exact.keys() == estimates.keys()
+    for stage, keys in estimates.items():
+        assert exact[stage].keys() == keys.keys()
+        for key, (mean, se) in keys.items():
+            assert abs(mean - exact[stage][key]) <= 5 * se + 1e-6 * max(1.0, abs(exact[stage][key])), (stage, key)
+
+# Sharded runs are identical bit for bit whatever the number of workers
+def test_shards_independent_of_workers():
+    for variance_reduction in (False, True):
+        inline = sim_bb.simulate_stages(**SETUP, n_runs=301, seed=5, workers=1, variance_reduction=variance_reduction)
+        pooled = sim_bb.simulate_stages(**SETUP, n_runs=301, seed=5, workers=3, variance_reduction=variance_reduction)
+        for stage, result in inline.items():
+            assert result.paired == pooled[stage].paired
+            for key, vals in result.columns().items():
+                assert np.array_equal(vals, pooled[stage].columns()[key])
+            for key, vals in result.controls.items():
+                assert np.array_equal(vals, pooled[stage].controls[key])
+    args = (40000, 50, True, "royal")
+    inline = sim_bb.run_parallel(sim_bb.simulate_ballroom, *args, n_runs=301, seed=6, workers=1)
+    pooled = sim_bb.run_parallel(sim_bb.simulate_ballroom, *args, n_runs=301, seed=6, workers=3)
+    for key, vals in inline.columns().items():
+        assert np.array_equal(vals, pooled.columns()[key])
+
+# Common random numbers make the paired difference of two setups far more precise than independent runs, and it stays unbiased
+def test_compare_setups_pairs_runs():
+    setups = [(40000, 50, True), (30000, 40, True)]
+    comparison = sim_bb.compare_setups(setups, n_runs=2000, seed=1)
+    exact = [sim_bb.expected_yields(*setup) for setup in setups]
+    assert comparison.keys() == sim_bb.STAGES.keys()
+    for stage, keys in comparison.items():
+        for key, stats in keys.items():
+            assert stats["diff"][0] == 0 and stats["se"][0] == 0
+            assert stats["diff"][1] == pytest.approx(stats["mean"][1] - stats["mean"][0])
+            assert stats["se"][1] <= stats["se_independent"][1]
+            if stats["se_independent"][1] > 0:
+                assert stats["se"][1] < 0.5 * stats["se_independent"][1], (stage, key)
+            expected = exact[1][stage].get(key, 0) - exact[0][stage].get(key, 0)
+            assert abs(stats["diff"][1] - expected) <= 5 * stats["se"][1] + 1e-6 * max(1.0, abs(expected)), (stage, key)
@@ -0,0 +1,78 @@
+import math
+import numpy as np
+import sim_toc
+
+# Long sessions used to loop forever once rounding kept the Mythweaver tail from reaching 1 - tol
+def test_solve_exact_long_session():
+    avg_hunts, avg_words, avg_mws, hunts_pmf, words_pmf, mws_pmf = sim_toc.solve_exact(1000, 0, 30000, 40, 2.0)
+    assert math.isclose(sum(hunts_pmf.values()), 1, abs_tol=1e-9)
+    assert math.isclose(sum(words_pmf.values()), 1, abs_tol=1e-9)
+    assert math.isclose(avg_hunts, 1000 + 2*avg_mws, rel_tol=1e-9)
+
+    # Agrees with Monte Carlo within a few standard errors
+    _, words, _, stats = sim_toc.MC_stream(20000, 1000, 0, 30000, 40, 2.0, rng=1)
+    assert abs(words - avg_words) < 5 * stats["words"].sem()
+
+def test_solve_exact_matches_monte_carlo():
+    avg_hunts, avg_words, avg_mws, *_ = sim_toc.solve_exact(100, 0, 30000, 40, 2.0)
+    hunts, words, mws, stats = sim_toc.MC_stream(50000, 100, 0, 30000, 40, 2.0, rng=2)
+    for exact, mc, key in ((avg_hunts, hunts, "hunts"), (avg_words, words, "words"), (avg_mws, mws, "mws")):
+        assert abs(mc - exact) < 5 * stats[key].sem()
+
+def test_log_factorials():
+    log_fact = sim_toc._log_factorials(5000)
+    assert np.allclose(log_fact[[0, 1, 10, 5000]], [0.0, 0.0, math.log(math.factorial(10)), math.lgamma(5001)])
+
+# Every chunk of MC_vr stays antithetic, an odd last one included, and tiny runs still give finite means
+def test_mc_vr_odd_runs(monkeypatch):
+    calls = []
+    batch = sim_toc.simulate_writing_batch
+    def recording_batch(n_runs, *args, antithetic=False, **kwargs):
+        calls.append((n_runs, antithetic))
+        return batch(n_runs, *args, antithetic=antithetic, **kwargs)
+    monkeypatch.setattr(sim_toc, "simulate_writing_batch", recording_batch)
+
+    _, _, _, stats = sim_toc.MC_vr(10001, 100, 0, 30000, 40, 2.0, chunk_size=4000, rng=3)
+    assert calls == [(4000, True), (4000, True), (2001, True)]
+    assert stats["runs"] == 10001
+
+    for n_runs in (1, 2, 3):
+        hunts, words, mws, stats = sim_toc.MC_vr(n_runs, 100, 0, 30000, 40, 2.0, rng=3)
+        assert np.isfinite([hunts, words, mws]).all()
+
+# Variance reduced averages agree with the exact solution within their standard errors
+def test_mc_vr_matches_exact():
+    exact = sim_toc.solve_exact(100, 0, 30000, 40, 2.0)
+    _, _, _, stats = sim_toc.MC_vr(20001, 100, 0, 30000, 40, 2.0, chunk_size=5000, rng=4)
+    for value, key in zip(exact, ("hunts", "words", "mws")):
+        mean, se = stats["estimates"][key]
+        assert abs(mean - value) < 5 * se
+
+# Sharded runs and sweeps are identical bit for bit whatever the number of workers
+def test_parallel_independent_of_workers():
+    inline = sim_toc.MC_parallel(5001, 100, 0, 30000, 40, 2.0, chunk_size=1000, workers=1, seed=7)
+    pooled = sim_toc.MC_parallel(5001, 100, 0, 30000, 40, 2.0, chunk_size=1000, workers=3, seed=7)
+    assert inline[:3] == pooled[:3]
+    for key in ("hunts", "words", "mws", "volumes"):
+        assert vars(inline[3][key]) == vars(pooled[3][key])
+    assert np.array_equal(inline[3]["volume_counts"], pooled[3]["volume_counts"])
+
+    grid = ([20000, 30000], [40], [50, 100])
+    assert sim_toc.sweep(*grid, n_runs=2000, workers=1, seed=8) == sim_toc.sweep(*grid, n_runs=2000, workers=3, seed=8)
+
+# Seeded samples of two engines agree in mean (within 5 standard errors of the difference) and in standard deviation
+def assert_same_distribution(scalar, batch, std_tol=0.1):
+    scalar, batch = np.asarray(scalar, dtype=float), np.asarray(batch, dtype=float)
+    se = math.sqrt(scalar.var(ddof=1) / len(scalar) + batch.var(ddof=1) / len(batch))
+    assert abs(scalar.mean() - batch.mean()) <= 5 * se + 1e-9
+    assert math.isclose(scalar.std(ddof=1), batch.std(ddof=1), rel_tol=std_tol, abs_tol=1e-9)
+
+# The lockstep sessions have the distribution of the scalar session, plain and antithetic
+def test_simulate_writing_batch_matches_scalar():
+    args = (100, 0, 30000, 40, 2.0)
+    rng = np.random.default_rng(3)
+    scalar = np.array([sim_toc.simulate_writing(*args, rng=rng) for _ in range(5000)])
+    for antithetic in (False, True):
+        batch = sim_toc.simulate_writing_batch(20000, 100, 0, sim_toc.cr_bg(30000, 40), sim_toc.cr_mw(30000, 40), 2.0, rng=4, antithetic=antithetic)
+        for column, vals in zip(scalar.T, batch):
+            assert_same_distribution(column, vals)